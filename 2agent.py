@@ -1,16 +1,11 @@
-from langchain_openai import ChatOpenAI
 from langchain.schema import HumanMessage
 from langchain.tools import Tool
 from langchain.prompts import PromptTemplate
-import os
-from dotenv import load_dotenv
 from langchain.prompts import ChatPromptTemplate
+from llm_client import get_llm
 
-# Carica le variabili globali
-load_dotenv()
-openai_api_key = os.getenv("OPENAI_API_KEY")
-model = os.getenv("MODELLO")
-llm = ChatOpenAI(model_name=model, api_key=openai_api_key)
+# Client condiviso (variabili d'ambiente caricate da llm_client)
+llm = get_llm()
 
 
 def classifica_sentimento_agent(query: str) -> str:
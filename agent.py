@@ -1,40 +1,57 @@
+import asyncio
 import json
 import os
+import threading
+import time
+from contextlib import contextmanager
 from langchain.prompts import ChatPromptTemplate
-from langchain_openai import ChatOpenAI
 from dotenv import load_dotenv
-from tool import create_tools  
+import telemetria
+from tool import SOGLIA_FAQ, SOGLIA_KB, cerca_su_internet, create_tools
+from embedding_store import carica_corpus, versione_corpus
+from llm_client import chiudi_connessioni_loop, embed_query, esegui, get_llm
+from router import carica_router, registra_esito
+from semantic_cache import chiave_fonti, crea_semantic_cache, impronta_contesto
+from memory_store import get_memory_store
+from ticket_store import get_ticket_store
+from sentiment_service import get_sentiment_service
+from contesto import componi, formatta_kb, formatta_turno
 from conversation_utils import (
     save_conversation_memory, 
     create_ticket, 
-    genera_messaggio_ticket
+    genera_messaggio_ticket,
+    normalizza_sentimento
 )
 load_dotenv()
-openai_api_key = os.getenv("OPENAI_API_KEY")
-
-model = os.getenv("MODELLO")
-llm = ChatOpenAI(model_name=model, api_key=openai_api_key)
 
 def openJson(path_json):
     with open(path_json, "r", encoding="utf-8") as f:
         return json.load(f)
 
-def pulisci_query_agent(query: str) -> str:
-    '''
-    agente per pulire la query dell utente 
-    '''
+def _chain_pulizia():
     prompt = ChatPromptTemplate.from_messages([
         ("system", "Sei un assistente che riscrive domande per ottimizzare la ricerca, traducendo italiano."),
         ("human", "{input}")
     ])
-    chain = prompt | llm
-    result = chain.invoke({"input": f"Pulisci la seguente domanda: {query}"})
+    return prompt | get_llm()
+
+def pulisci_query_agent(query: str) -> str:
+    '''
+    agente per pulire la query dell utente 
+    '''
+    result = _chain_pulizia().invoke({"input": f"Pulisci la seguente domanda: {query}"})
+    telemetria.registra_uso_llm(result, "pulizia")
     return result.content.strip()
 
-def classifica_sentimento_agent(query: str) -> str:
+async def apulisci_query_agent(query: str) -> str:
     '''
-    agente per capire il sentimento dell utente e classificarlo
+    versione asincrona di pulisci_query_agent
     '''
+    result = await _chain_pulizia().ainvoke({"input": f"Pulisci la seguente domanda: {query}"})
+    telemetria.registra_uso_llm(result, "pulizia")
+    return result.content.strip()
+
+def _chain_sentimento():
     prompt = ChatPromptTemplate.from_messages(
         [
             (
@@ -52,20 +69,130 @@ def classifica_sentimento_agent(query: str) -> str:
             ("human", "{input}"),
         ]
     )
-    chain = prompt | llm
-    response = chain.invoke({"input": query})
-    return response.content.strip()
-def get_last_conversations(path_json, limit=3):
+    return prompt | get_llm()
+
+def classifica_sentimento_agent(query: str) -> str:
+    '''
+    agente per capire il sentimento dell utente e classificarlo
+    '''
+    response = _chain_sentimento().invoke({"input": query})
+    telemetria.registra_uso_llm(response, "sentimento")
+    return normalizza_sentimento(response.content) or response.content.strip()
+
+async def aclassifica_sentimento_agent(query: str) -> str:
+    '''
+    versione asincrona di classifica_sentimento_agent
+    '''
+    response = await _chain_sentimento().ainvoke({"input": query})
+    telemetria.registra_uso_llm(response, "sentimento")
+    return normalizza_sentimento(response.content) or response.content.strip()
+
+# Sotto questa confidenza il modello locale non basta e si chiede all'LLM
+SOGLIA_SENTIMENTO_LOCALE = float(os.getenv("SENTIMENT_SOGLIA", "0.6"))
+
+async def aclassifica_sentimento(query: str) -> str:
+    '''
+    sentimento con il modello locale se è abbastanza sicuro, altrimenti con l'agente LLM
+    '''
+    # Il primo accesso carica il modello: lo si fa fuori dall'event loop
+    service = await asyncio.to_thread(get_sentiment_service)
+    if service is not None:
+        try:
+            sentimento, confidenza = await service.aclassifica(query)
+            telemetria.span_corrente().imposta("confidenza_locale", confidenza)
+            if confidenza >= SOGLIA_SENTIMENTO_LOCALE:
+                telemetria.incrementa("sentimento_totale", classificatore="locale")
+                return sentimento
+        except Exception as e:
+            telemetria.evento("sentimento_locale_errore", f"Errore nel modello di sentiment locale: {e}")
+    telemetria.incrementa("sentimento_totale", classificatore="llm")
+    return await aclassifica_sentimento_agent(query)
+
+def classifica_sentimento(query: str) -> str:
+    '''
+    versione sincrona di aclassifica_sentimento
+    '''
+    return esegui(aclassifica_sentimento(query))
+
+PERCORSI = ["FAQ", "Knowledge Base", "Web"]
+
+# Se attivo, process_query usa un'unica chiamata LLM per sentimento, pulizia e percorso
+PREPROCESSING_FUSO = os.getenv("PREPROCESSING_FUSO", "0").lower() in ("1", "true", "si")
+
+def _chain_preprocessing():
+    prompt = ChatPromptTemplate.from_messages(
+        [
+            (
+                "system",
+                """
+                Analizza la domanda dell'utente e rispondi SOLO con un oggetto JSON con questi campi:
+                - "sentimento": una tra "Molto Positivo", "Positivo", "Neutro", "Negativo", "Molto Negativo"
+                - "domanda_pulita": la domanda riscritta per ottimizzare la ricerca, in italiano
+                - "percorso": dove cercare la risposta, 'FAQ' se la domanda è comune,
+                  'Knowledge Base' se serve più dettaglio, 'Web' se la risposta non è nei dati interni
+                """
+            ),
+            ("human", "{input}"),
+        ]
+    )
+    return prompt | get_llm()
+
+def _valida_preprocessing(testo: str) -> dict:
     """
-    Carica le ultime `limit` conversazioni dal file JSON.
-    Se ci sono meno di `limit` conversazioni, le restituisce tutte.
+    Estrae e valida il JSON prodotto dall'agente di pre-processing.
+    Solleva ValueError se il formato non è quello atteso.
     """
-    conversations = openJson(path_json)
-    conversations.sort(key=lambda x: x["timestamp"], reverse=True)
-    return conversations[:limit]
+    inizio, fine = testo.find("{"), testo.rfind("}")
+    if inizio == -1 or fine < inizio:
+        raise ValueError(f"Risposta di pre-processing senza JSON: {testo!r}")
+    dati = json.loads(testo[inizio:fine + 1])
+    sentimento = normalizza_sentimento(dati.get("sentimento"))
+    domanda_pulita = dati.get("domanda_pulita")
+    percorso = next((p for p in PERCORSI if p.lower() == str(dati.get("percorso", "")).strip().lower()), None)
+    if sentimento is None or percorso is None or not isinstance(domanda_pulita, str) or not domanda_pulita.strip():
+        raise ValueError(f"Risposta di pre-processing non valida: {dati!r}")
+    return {"sentimento": sentimento, "domanda_pulita": domanda_pulita.strip(), "percorso": percorso}
 
-def generate_assistance(query: str,cId: str, sentiment: str,user: str, faq_result: dict, web_results: list = None) -> str:
-    system_message = """
+def preprocessa_query_agent(query: str) -> dict:
+    '''
+    agente unico che restituisce sentimento, domanda pulita e percorso con una sola chiamata.
+    Se la risposta non è valida usa gli agenti singoli.
+    '''
+    try:
+        result = _chain_preprocessing().invoke({"input": query})
+        telemetria.registra_uso_llm(result, "preprocessing")
+        return _valida_preprocessing(result.content)
+    except ValueError as e:
+        telemetria.evento("preprocessing_fallback", f"Pre-processing fuso non valido, uso gli agenti singoli: {e}")
+        return {
+            "sentimento": classifica_sentimento_agent(query),
+            "domanda_pulita": pulisci_query_agent(query),
+            "percorso": None
+        }
+
+async def apreprocessa_query_agent(query: str) -> dict:
+    '''
+    versione asincrona di preprocessa_query_agent (il fallback gira in parallelo)
+    '''
+    try:
+        result = await _chain_preprocessing().ainvoke({"input": query})
+        telemetria.registra_uso_llm(result, "preprocessing")
+        return _valida_preprocessing(result.content)
+    except ValueError as e:
+        telemetria.evento("preprocessing_fallback", f"Pre-processing fuso non valido, uso gli agenti singoli: {e}")
+        sentimento, domanda_pulita = await asyncio.gather(
+            aclassifica_sentimento_agent(query), apulisci_query_agent(query)
+        )
+        return {"sentimento": sentimento, "domanda_pulita": domanda_pulita, "percorso": None}
+
+def get_last_conversations(cId, limit=3):
+    """
+    Carica le ultime `limit` interazioni della conversazione, dalla più recente.
+    Se ci sono meno di `limit` interazioni, le restituisce tutte.
+    """
+    return get_memory_store().ultime(cId, limit)
+
+SYSTEM_MESSAGE_ASSISTENZA = """
     Ruolo: Sei un assistente specializzato nell'assistenza clienti per l'azienda TechAssist Srl, che si occupa della vendita di hardware e software.  
 
     Contesto:TechAssist Srl ha difficoltà nella gestione delle richieste di assistenza, quindi il tuo compito è fornire risposte precise e tecniche ai clienti.  
@@ -79,63 +206,407 @@ def generate_assistance(query: str,cId: str, sentiment: str,user: str, faq_resul
 
     Stile: Mantieni un tono professionale e tecnico, fornendo risposte chiare e dettagliate.  
     """
+
+def _sezioni_contesto(cId: str, sentiment: str, user: str, faq_result: dict, web_results: list = None) -> list:
+    """
+    Sezioni del contesto in ordine di priorità: ruolo e sentimento, risposta
+    FAQ, campi KB, turni precedenti (dal più recente), risultati web.
+    """
     users=openJson("data/users.json")
-    context_message = f"il sentimento del utente: {sentiment}"
-    if os.path.exists(f"data/conversation_memory_{cId}.json"):
-        lastMessage=get_last_conversations(f"data/conversation_memory_{cId}.json")
-        context_message += f"i messagi precedenti: {lastMessage}"
-    context_message += f"\ncome comportarsi in base al ruolo di questo utente: {user}:{users['utenti'][user]}"
-    context_message += f"\nConoscenza interna: {faq_result['risposta']}"
-    if web_results:
-        context_message += f"\nRisultati dalla ricerca web: {web_results}"
+    sezioni = [("ruolo", f"come comportarsi in base al ruolo di questo utente: {user}:{users['utenti'][user]}"
+                         f"\nil sentimento del utente: {sentiment}", False)]
+    conoscenza = faq_result["risposta"]
+    if isinstance(conoscenza, dict):
+        if conoscenza.get("faq"):
+            sezioni.append(("faq", f"Conoscenza interna (FAQ): {conoscenza['faq']}", True))
+        if conoscenza.get("kb"):
+            sezioni.append(("kb", f"Conoscenza interna (Knowledge Base):\n{formatta_kb(conoscenza['kb'])}", True))
+    else:
+        sezioni.append(("faq", f"Conoscenza interna: {conoscenza}", True))
+    for i, interazione in enumerate(get_last_conversations(cId)):
+        sezioni.append((f"turno[{i}]", f"Messaggio precedente:\n{formatta_turno(interazione)}", False))
+    for i, pagina in enumerate(web_results or []):
+        if pagina.get("contenuto"):
+            sezioni.append((f"web[{i}]", f"Risultato dalla ricerca web ({pagina.get('url')}): {pagina['contenuto']}", True))
+    return sezioni
+
+def _input_assistenza(query: str,cId: str, sentiment: str,user: str, faq_result: dict, web_results: list = None) -> dict:
+    """
+    Costruisce l'input del prompt di risposta (contesto, memoria, ruolo, conoscenza),
+    con il contesto limitato a CONTESTO_MAX_TOKEN token.
+    """
+    context_message = componi(_sezioni_contesto(cId, sentiment, user, faq_result, web_results))
+    return {"input": f"""Un utente ha posto una domanda. Rispondi nella stessa lingua dell'utente: "{query}"
+    {context_message}
+    Fornisci una risposta chiara e utile.
+    """}
+
+def _chain_assistenza():
     prompt = ChatPromptTemplate.from_messages([
-        ("system", system_message),
+        ("system", SYSTEM_MESSAGE_ASSISTENZA),
         ("human", "{input}")
     ])
-    
-    chain = prompt | llm
-    result = chain.invoke({"input": f"""Un utente ha posto una domanda. Rispondi nella stessa lingua dell'utente: "{query}"
-    {context_message}
-    Fornisci una risposta chiara e utile.
-    """})
+    return prompt | get_llm()
+
+def generate_assistance(query: str,cId: str, sentiment: str,user: str, faq_result: dict, web_results: list = None) -> str:
+    result = _chain_assistenza().invoke(_input_assistenza(query, cId, sentiment, user, faq_result, web_results))
+    telemetria.registra_uso_llm(result, "assistenza")
+    return result.content.strip()
+
+async def agenerate_assistance(query: str,cId: str, sentiment: str,user: str, faq_result: dict, web_results: list = None) -> str:
+    input_prompt = await asyncio.to_thread(_input_assistenza, query, cId, sentiment, user, faq_result, web_results)
+    result = await _chain_assistenza().ainvoke(input_prompt)
+    telemetria.registra_uso_llm(result, "assistenza")
     return result.content.strip()
 
+async def astream_assistance(query: str,cId: str, sentiment: str,user: str, faq_result: dict, web_results: list = None):
+    """Come agenerate_assistance, ma restituisce i token della risposta man mano che arrivano."""
+    input_prompt = await asyncio.to_thread(_input_assistenza, query, cId, sentiment, user, faq_result, web_results)
+    uso = None
+    async for chunk in _chain_assistenza().astream(input_prompt):
+        # L'uso dei token, se il modello lo riporta, arriva in uno degli ultimi pezzi
+        if getattr(chunk, "usage_metadata", None):
+            uso = chunk
+        if chunk.content:
+            yield chunk.content
+    telemetria.registra_uso_llm(uso, "assistenza")
+
 
-# Carica gli embedding
-faq= openJson("data/faq.json")
-kb= openJson("data/knowledgeBase.json")
-faq_embeddings = [dizionario['dVec'] for dizionario in faq]
-kb_embeddings = [dizionario['vec'] for dizionario in kb]
-# Crea i tools
-web_tool, faq_tool = create_tools(faq_embeddings, faq, kb_embeddings, kb)
+FAQ_PATH = "data/faq.json"
+KB_PATH = "data/knowledgeBase.json"
 
-def process_query(domanda: str,user: str,cId: str) -> str:
+class StatoAgente:
     """
-    Processa una query dell'utente utilizzando i tool di Langchain.
+    Risorse caricate una sola volta per processo: corpus, tools e cache delle risposte.
     """
-    sentiment=classifica_sentimento_agent(domanda)
-    domanda_pulita = pulisci_query_agent(domanda)
-    # Prima cerca nelle FAQ
-    faq_result = faq_tool.run(domanda_pulita)
-    # Se necessario, cerca anche su web
-    web_results = None
-    if faq_result["fonte"] == "none":
-        web_results = web_tool.run(domanda_pulita)
-    # Genera la risposta finale
-    risposta = generate_assistance(domanda,cId,sentiment,user, faq_result, web_results)
-    save_conversation_memory(
-        conversation_id=cId, 
-        user_query=domanda, 
-        ai_response=risposta, 
-        user_role=user,
-        sentiment=sentiment
-    )
-    ticket = create_ticket(domanda, sentiment, user,cId)
-    if ticket:
-        risposta += f"\n\n{genera_messaggio_ticket(ticket)}"
+
+    def __init__(self, faq_path: str = FAQ_PATH, kb_path: str = KB_PATH, web_searcher=None):
+        # Carica i record e gli embedding (file .npy in memory mapping)
+        self.faq, faq_embeddings = carica_corpus(faq_path, "dVec")
+        self.kb, kb_embeddings = carica_corpus(kb_path, "vec")
+        # Router locale FAQ / KB / Web (se è stato addestrato, vedi router.py)
+        self.router = carica_router(faq_embeddings, kb_embeddings)
+        # Crea i tools
+        self.web_searcher = web_searcher
+        self.web_tool, self.faq_tool, self.stima_ricerca = create_tools(
+            faq_embeddings, self.faq, kb_embeddings, self.kb, normalizzati=True, web_searcher=web_searcher,
+            faq_path=faq_path, kb_path=kb_path, router=self.router
+        )
+        # Cache delle risposte per domande quasi uguali (si svuota quando ingest.py riscrive i corpus)
+        self.semantic_cache = crea_semantic_cache(lambda: versione_corpus(faq_path, kb_path))
+        if self.semantic_cache is not None:
+            telemetria.registra_collettore("cache_risposte", self.semantic_cache.stats)
+
+_stato_lock = threading.Lock()
+_stato_agente = None
+
+def get_stato_agente() -> StatoAgente:
+    """StatoAgente condiviso, creato al primo utilizzo."""
+    global _stato_agente
+    with _stato_lock:
+        if _stato_agente is None:
+            _stato_agente = StatoAgente()
+        return _stato_agente
+
+def imposta_stato_agente(stato_agente: StatoAgente) -> None:
+    """Sostituisce lo StatoAgente condiviso (es. con un corpus sintetico nei benchmark)."""
+    global _stato_agente
+    with _stato_lock:
+        _stato_agente = stato_agente
+
+def avvia() -> StatoAgente:
+    """
+    Carica subito tutto quello che serve alle richieste (client LLM, corpus,
+    modello di sentiment, archivi), così la prima query non paga l'avvio.
+    """
+    get_llm()
+    stato_agente = get_stato_agente()
+    get_sentiment_service()
+    get_memory_store()
+    get_ticket_store()
+    return stato_agente
+
+@contextmanager
+def fase(tempi: dict, nome: str):
+    """
+    Misura la durata di una fase della pipeline e la scrive in `tempi[nome]`
+    (secondi); con la telemetria attiva la fase diventa anche uno span.
+    """
+    with telemetria.span(nome):
+        if tempi is None:
+            yield
+            return
+        inizio = time.perf_counter()
+        try:
+            yield
+        finally:
+            tempi[nome] = time.perf_counter() - inizio
+
+async def _cronometra(tempi: dict, nome: str, coro):
+    with fase(tempi, nome):
+        return await coro
+
+# Ricerca web speculativa: parte insieme alla ricerca interna se la domanda sembra da web
+WEB_SPECULATIVA = os.getenv("WEB_SPECULATIVA", "0").lower() in ("1", "true", "si")
+# Si specula se nessun corpus supera la sua soglia di almeno questo margine
+MARGINE_SPECULAZIONE = float(os.getenv("WEB_SPECULATIVA_MARGINE", "0.05"))
+# ...o se il router dà alla domanda almeno questa probabilità di essere da web
+SOGLIA_SPECULAZIONE_ROUTER = float(os.getenv("WEB_SPECULATIVA_ROUTER", "0.5"))
+
+def motivo_speculazione(stima: dict = None, percorso: str = None):
+    """
+    Perché conviene avviare subito la ricerca web ("preprocessing", "router",
+    "punteggio"), o None se la ricerca interna dovrebbe bastare.
+
+    `stima` è quella di tool.stima_ricerca, `percorso` quello suggerito dal
+    pre-processing fuso.
+    """
+    if percorso == "Web":
+        return "preprocessing"
+    if stima is None:
+        return None
+    if stima["web"] is not None and stima["web"] >= SOGLIA_SPECULAZIONE_ROUTER:
+        return "router"
+    # Punteggi vicini alle soglie (o sotto): la fonte potrebbe essere "none"
+    if stima["faq"] < SOGLIA_FAQ + MARGINE_SPECULAZIONE and stima["kb"] < SOGLIA_KB + MARGINE_SPECULAZIONE:
+        return "punteggio"
+    return None
+
+async def _avvia_web_speculativa(risorse, domanda_pulita: str, stima_task, percorso: str):
+    """
+    Avvia la ricerca web in parallelo alla ricerca interna se la stima fatta
+    durante la pulizia (o il percorso del pre-processing) lo suggerisce.
+
+    Returns:
+        tuple or None: (task, evento per annullarla, motivo, istante di avvio)
+    """
+    stima = None
+    if percorso == "Web" and stima_task is not None:
+        # Il pre-processing basta: la stima non serve
+        stima_task.cancel()
+    elif stima_task is not None:
+        try:
+            stima = await stima_task
+        except Exception as e:
+            telemetria.evento("stima_ricerca_errore", f"Errore nella stima della ricerca interna: {e}")
+    motivo = motivo_speculazione(stima, percorso)
+    if motivo is None:
+        return None
+    annulla = threading.Event()
+    task = asyncio.create_task(asyncio.to_thread(cerca_su_internet, domanda_pulita, risorse.web_searcher, annulla))
+    return task, annulla, motivo, time.perf_counter()
+
+def _scarta_web_speculativa(speculazione) -> None:
+    """Annulla una ricerca web speculativa che non serve."""
+    task, annulla, motivo, avvio = speculazione
+    annulla.set()
+    task.cancel()
+    telemetria.incrementa("web_speculativa_totale", motivo=motivo, esito="scartata")
+    telemetria.incrementa("web_speculativa_secondi_totale", time.perf_counter() - avvio, esito="scartata")
+
+def _impronta_contesto(cId: str, sentiment: str) -> str:
+    """Impronta di ciò che entra nel prompt oltre a domanda, ruolo e fonti: sentimento e turni precedenti."""
+    return impronta_contesto(sentiment, *(formatta_turno(i) for i in get_last_conversations(cId)))
+
+async def _aprepara_risposta(domanda: str,user: str,cId: str, preprocessing_fuso: bool = None, tempi: dict = None) -> dict:
+    """
+    Prima parte della pipeline: sentimento, pulizia della query, ricerca
+    (FAQ/KB e, se serve, web) e controllo della cache delle risposte.
+    Le fasi indipendenti girano in parallelo: il sentimento serve solo per
+    la risposta finale, quindi viene calcolato mentre si pulisce la query e
+    si cerca nelle FAQ / sul web.
+
+    Con WEB_SPECULATIVA, mentre si pulisce la query si stimano i punteggi
+    della ricerca interna sulla domanda originale: se sono vicini alle
+    soglie la ricerca web parte insieme a quella interna invece che dopo,
+    e viene annullata se la ricerca interna trova la risposta.
+    La stima costa un embedding in più per domanda (quella originale, non
+    quella pulita), tranne quando la domanda pulita coincide con
+    l'originale (la ricerca lo trova in cache) o quando la ricerca
+    lessicale identifica già una FAQ (nessun embedding).
+    """
+    if preprocessing_fuso is None:
+        preprocessing_fuso = PREPROCESSING_FUSO
+    risorse = get_stato_agente()
+    sentiment_task = None
+    stima_task = None
+    speculazione = None
+    try:
+        if WEB_SPECULATIVA:
+            stima_task = asyncio.create_task(asyncio.to_thread(risorse.stima_ricerca, domanda))
+        if preprocessing_fuso:
+            with fase(tempi, "preprocessing"):
+                preprocessing = await apreprocessa_query_agent(domanda)
+            sentiment = preprocessing["sentimento"]
+            domanda_pulita = preprocessing["domanda_pulita"]
+        else:
+            sentiment_task = asyncio.create_task(_cronometra(tempi, "sentimento", aclassifica_sentimento(domanda)))
+            with fase(tempi, "pulizia"):
+                domanda_pulita = await apulisci_query_agent(domanda)
+        # Percorso scelto dall'LLM, indipendente dalle soglie della ricerca
+        percorso = preprocessing["percorso"] if preprocessing_fuso else None
+        if WEB_SPECULATIVA:
+            speculazione = await _avvia_web_speculativa(risorse, domanda_pulita, stima_task, percorso)
+        # Prima cerca nelle FAQ
+        with fase(tempi, "ricerca_interna"):
+            faq_result = await asyncio.to_thread(risorse.faq_tool.run, domanda_pulita)
+        # Dati di addestramento del router (ROUTER_LOG); gli esiti decisi dal router non servono
+        if faq_result["ricerca"] != "router":
+            registra_esito(domanda_pulita, faq_result["fonte"], percorso)
+        # Se necessario, cerca anche su web
+        web_results = None
+        if faq_result["fonte"] == "none":
+            if speculazione is not None:
+                task, _, motivo, avvio = speculazione
+                speculazione = None
+                # Secondi di ricerca web già fatti in parallelo alla ricerca interna
+                telemetria.incrementa("web_speculativa_totale", motivo=motivo, esito="usata")
+                telemetria.incrementa("web_speculativa_secondi_totale", time.perf_counter() - avvio, esito="usata")
+                with fase(tempi, "ricerca_web"):
+                    web_results = await task
+            else:
+                if WEB_SPECULATIVA:
+                    telemetria.incrementa("web_speculativa_totale", motivo="nessuno", esito="non_avviata")
+                with fase(tempi, "ricerca_web"):
+                    web_results = await asyncio.to_thread(risorse.web_tool.run, domanda_pulita)
+        elif speculazione is not None:
+            _scarta_web_speculativa(speculazione)
+            speculazione = None
+        if sentiment_task:
+            sentiment = await sentiment_task
+    except BaseException:
+        if sentiment_task:
+            sentiment_task.cancel()
+        if stima_task:
+            stima_task.cancel()
+        if speculazione is not None:
+            _scarta_web_speculativa(speculazione)
+        raise
+    # Riusa la risposta di una domanda quasi uguale con le stesse fonti e lo stesso contesto, se c'è
+    risposta, vettore, contesto = None, None, None
+    fonti = chiave_fonti(faq_result) if risorse.semantic_cache is not None else None
+    if fonti is not None:
+        with fase(tempi, "cache_risposte"):
+            contesto = await asyncio.to_thread(_impronta_contesto, cId, sentiment)
+            # Se la ricerca lessicale ha evitato l'embedding, si confronta solo il testo
+            if faq_result.get("ricerca") != "lessicale":
+                vettore = await asyncio.to_thread(embed_query, domanda_pulita)
+            risposta = risorse.semantic_cache.cerca(vettore, user, fonti, domanda_pulita, contesto)
+        telemetria.incrementa("cache_risposte_totale", esito="miss" if risposta is None else "hit")
+    return {
+        "sentiment": sentiment,
+        "faq_result": faq_result,
+        "web_results": web_results,
+        "fonti": fonti,
+        "vettore": vettore,
+        "contesto": contesto,
+        "domanda_pulita": domanda_pulita,
+        "risposta_cache": risposta
+    }
+
+async def _afinalizza_risposta(domanda: str,user: str,cId: str, stato: dict, risposta: str, tempi: dict = None) -> str:
+    """
+    Ultima parte della pipeline: salva la risposta in cache e in memoria e
+    crea l'eventuale ticket. Restituisce il messaggio del ticket ("" se non c'è).
+    """
+    if stato["risposta_cache"] is None and stato["fonti"] is not None:
+        get_stato_agente().semantic_cache.salva(stato["vettore"], user, stato["fonti"], risposta, stato["domanda_pulita"],
+                                                stato["contesto"])
+    with fase(tempi, "memoria"):
+        await asyncio.to_thread(
+            save_conversation_memory,
+            conversation_id=cId, 
+            user_query=domanda, 
+            ai_response=risposta, 
+            user_role=user,
+            sentiment=stato["sentiment"]
+        )
+    with fase(tempi, "ticket"):
+        ticket = await asyncio.to_thread(create_ticket, domanda, stato["sentiment"], user, cId)
+    return genera_messaggio_ticket(ticket) if ticket else ""
+
+async def aprocess_query(domanda: str,user: str,cId: str, preprocessing_fuso: bool = None, tempi: dict = None) -> str:
+    """
+    Versione asincrona della pipeline.
+    Con `preprocessing_fuso` (default: PREPROCESSING_FUSO) sentimento e
+    pulizia arrivano da un'unica chiamata LLM.
+    Se si passa `tempi`, vi vengono scritte le durate delle fasi (secondi).
+    """
+    with fase(tempi, "totale"):
+        stato = await _aprepara_risposta(domanda, user, cId, preprocessing_fuso, tempi)
+        # Genera la risposta finale
+        risposta = stato["risposta_cache"]
+        if risposta is None:
+            with fase(tempi, "generazione"):
+                risposta = await agenerate_assistance(domanda,cId,stato["sentiment"],user, stato["faq_result"], stato["web_results"])
+        messaggio_ticket = await _afinalizza_risposta(domanda, user, cId, stato, risposta, tempi)
+    if messaggio_ticket:
+        risposta += f"\n\n{messaggio_ticket}"
     return risposta
 
-# Esempio di utilizzo
-domanda2 = "ho un problema con un prodotto difettoso vorrei parlare con un operatore"
-risposta = process_query(domanda2,"Cliente Occasionale",'conversazione_01')
-print("Risposta AI:", risposta)
\ No newline at end of file
+def process_query(domanda: str,user: str,cId: str, preprocessing_fuso: bool = None, tempi: dict = None) -> str:
+    """
+    Processa una query dell'utente utilizzando i tool di Langchain.
+    """
+    return esegui(aprocess_query(domanda, user, cId, preprocessing_fuso, tempi))
+
+async def aprocess_query_stream(domanda: str,user: str,cId: str, preprocessing_fuso: bool = None, metriche: dict = None):
+    """
+    Come aprocess_query, ma restituisce la risposta a pezzi man mano che
+    l'LLM la genera; il messaggio del ticket arriva in fondo. Memoria e
+    ticket vengono salvati solo a risposta completa.
+
+    Se si passa `metriche`, vi vengono scritti `ttft` (secondi fino al
+    primo token), `totale` (secondi fino alla fine dello stream) e le
+    durate delle singole fasi.
+    """
+    inizio = time.perf_counter()
+    ttft = None
+    stato = await _aprepara_risposta(domanda, user, cId, preprocessing_fuso, metriche)
+    risposta = stato["risposta_cache"]
+    if risposta is not None:
+        ttft = time.perf_counter() - inizio
+        yield risposta
+    else:
+        pezzi = []
+        async for pezzo in astream_assistance(domanda,cId,stato["sentiment"],user, stato["faq_result"], stato["web_results"]):
+            if ttft is None:
+                ttft = time.perf_counter() - inizio
+            pezzi.append(pezzo)
+            yield pezzo
+        risposta = "".join(pezzi).strip()
+    messaggio_ticket = await _afinalizza_risposta(domanda, user, cId, stato, risposta, metriche)
+    if messaggio_ticket:
+        yield f"\n\n{messaggio_ticket}"
+    # Una risposta vuota non ha primo token
+    if ttft is not None:
+        telemetria.osserva("ttft_secondi", ttft)
+    if metriche is not None:
+        metriche["ttft"] = ttft
+        metriche["totale"] = time.perf_counter() - inizio
+
+def process_query_stream(domanda: str,user: str,cId: str, preprocessing_fuso: bool = None, metriche: dict = None):
+    """
+    Versione sincrona di aprocess_query_stream (generatore).
+    """
+    loop = asyncio.new_event_loop()
+    stream = aprocess_query_stream(domanda, user, cId, preprocessing_fuso, metriche)
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(stream.__anext__())
+            except StopAsyncIteration:
+                break
+    finally:
+        loop.run_until_complete(stream.aclose())
+        loop.run_until_complete(chiudi_connessioni_loop())
+        loop.close()
+
+if __name__ == "__main__":
+    # Esempio di utilizzo
+    domanda2 = "ho un problema con un prodotto difettoso vorrei parlare con un operatore"
+    with telemetria.span("esempio") as s:
+        risposta = process_query(domanda2,"Cliente Occasionale",'conversazione_01')
+        s.imposta("risposta", risposta)
+    # Output dell'esempio a riga di comando
+    print("Risposta AI:", risposta)
\ No newline at end of file
@@ -0,0 +1,219 @@
+import argparse
+import os
+import time
+import numpy as np
+import telemetria
+from embedding_store import carica_vettori, firma_corpus, percorso_vettori
+from similarity import SimilarityIndex, normalizza_righe, rivaluta
+
+# Indice approssimato IVF (inverted file) per corpus grandi: i vettori sono
+# divisi in liste con k-means sferico e ogni query confronta solo le righe
+# delle `nprobe` liste con il centroide più vicino, con punteggio esatto.
+
+# Sotto questo numero di righe la ricerca esatta è abbastanza veloce
+ANN_MIN_RIGHE = int(os.getenv("ANN_MIN_RIGHE", "20000"))
+# Liste controllate per query: più alto = richiamo migliore, query più lente
+ANN_NPROBE = int(os.getenv("ANN_NPROBE", "8"))
+
+
+def percorso_ivf(path_json: str) -> str:
+    """Percorso del file dell'indice IVF associato a un file JSON di record."""
+    return os.path.splitext(path_json)[0] + ".ivf.npz"
+
+
+def _assegna(matrice: np.ndarray, centroidi: np.ndarray, blocco: int = 8192) -> np.ndarray:
+    """Indice del centroide più simile a ogni riga, a blocchi per limitare la memoria."""
+    assegnazioni = np.empty(matrice.shape[0], dtype=np.int32)
+    for inizio in range(0, matrice.shape[0], blocco):
+        righe = np.asarray(matrice[inizio:inizio + blocco], dtype=np.float32)
+        assegnazioni[inizio:inizio + blocco] = np.argmax(righe @ centroidi.T, axis=1)
+    return assegnazioni
+
+
+def kmeans_sferico(matrice: np.ndarray, n_liste: int, iterazioni: int = 10, campione: int = None, seed: int = 0) -> np.ndarray:
+    """
+    Centroidi (normalizzati) di `n_liste` cluster per similarità coseno,
+    calcolati su un campione di al massimo `campione` righe (default 64 per lista).
+    """
+    rng = np.random.default_rng(seed)
+    n = matrice.shape[0]
+    campione = min(n, campione or 64 * n_liste)
+    righe = np.sort(rng.choice(n, size=campione, replace=False))
+    dati = np.asarray(matrice[righe], dtype=np.float32)
+    centroidi = dati[rng.choice(campione, size=n_liste, replace=False)].copy()
+    for _ in range(iterazioni):
+        assegnazioni = _assegna(dati, centroidi)
+        # Somma delle righe di ogni cluster: righe ordinate per cluster e reduceat sui blocchi
+        ordine = np.argsort(assegnazioni, kind="stable")
+        conteggi = np.bincount(assegnazioni, minlength=n_liste)
+        pieni = np.flatnonzero(conteggi)
+        inizi = np.concatenate([[0], np.cumsum(conteggi)])[pieni]
+        somme = np.zeros_like(centroidi)
+        somme[pieni] = np.add.reduceat(dati[ordine], inizi, axis=0)
+        vuoti = np.flatnonzero(~somme.any(axis=1))
+        # I cluster rimasti vuoti ripartono da righe a caso
+        somme[vuoti] = dati[rng.choice(campione, size=len(vuoti), replace=False)]
+        centroidi = normalizza_righe(somme).astype(np.float32)
+    return centroidi
+
+
+class IVFIndex(SimilarityIndex):
+    """
+    SimilarityIndex con ricerca approssimata: `top_k` confronta la query con
+    i centroidi, poi calcola il punteggio esatto solo per le righe delle
+    `nprobe` liste più vicine. `punteggi` e `punteggi_di` restano esatti.
+    Con `ridotti` (vedi quantizzazione.py) le righe delle liste vengono
+    prima stimate con i vettori ridotti e solo le migliori rivalutate.
+
+    Le righe di ogni lista sono in `ordine[offset[l]:offset[l + 1]]`.
+    """
+
+    def __init__(self, embeddings, centroidi: np.ndarray, ordine: np.ndarray, offset: np.ndarray,
+                 nprobe: int = ANN_NPROBE, normalizzata: bool = True):
+        super().__init__(embeddings, normalizzata=normalizzata)
+        self.centroidi = np.asarray(centroidi, dtype=np.float32)
+        self.ordine = np.asarray(ordine, dtype=np.int64)
+        self.offset = np.asarray(offset, dtype=np.int64)
+        self.nprobe = nprobe
+        self.ridotti = None
+        self.fattore = 10
+
+    @classmethod
+    def costruisci(cls, embeddings, n_liste: int = None, nprobe: int = ANN_NPROBE, iterazioni: int = 10, seed: int = 0):
+        """Costruisce l'indice: `n_liste` (default ~ 4·√n) cluster con k-means sferico."""
+        indice = SimilarityIndex(embeddings, normalizzata=True)
+        n = len(indice)
+        n_liste = max(1, min(n, n_liste or int(4 * np.sqrt(n))))
+        centroidi = kmeans_sferico(indice.matrice, n_liste, iterazioni, seed=seed)
+        assegnazioni = _assegna(indice.matrice, centroidi)
+        ordine = np.argsort(assegnazioni, kind="stable")
+        offset = np.concatenate([[0], np.cumsum(np.bincount(assegnazioni, minlength=n_liste))])
+        return cls(indice.matrice, centroidi, ordine, offset, nprobe)
+
+    def candidati(self, q: np.ndarray, nprobe: int) -> np.ndarray:
+        """Righe delle `nprobe` liste con il centroide più simile alla query (normalizzata)."""
+        n_liste = self.centroidi.shape[0]
+        nprobe = min(nprobe, n_liste)
+        punteggi = self.centroidi @ q
+        liste = np.argpartition(-punteggi, nprobe - 1)[:nprobe] if nprobe < n_liste else np.arange(n_liste)
+        righe = np.concatenate([self.ordine[self.offset[l]:self.offset[l + 1]] for l in liste])
+        # In ordine crescente le letture dal file in memory mapping sono sequenziali
+        righe.sort()
+        return righe
+
+    def top_k(self, query, k: int = 1, nprobe: int = None):
+        if not len(self) or k <= 0:
+            return []
+        q, matrice = self._prepara_query(query)
+        if q.shape[0] != self.centroidi.shape[1]:
+            # Dimensione diversa da quella dell'indice: ricerca esatta
+            return super().top_k(query, k)
+        righe = self.candidati(q, nprobe or self.nprobe)
+        if righe.size < k:
+            return super().top_k(query, k)
+        if self.ridotti is not None:
+            return rivaluta(matrice, q, righe, self.ridotti.stima(q, righe), k, self.fattore)
+        punteggi = matrice[righe] @ q
+        migliori = np.argpartition(-punteggi, k - 1)[:k] if k < righe.size else np.arange(righe.size)
+        migliori = migliori[np.argsort(-punteggi[migliori])]
+        return [(int(righe[i]), float(punteggi[i])) for i in migliori]
+
+
+def salva_ivf(path_json: str, indice: IVFIndex) -> None:
+    """Salva centroidi e liste accanto al corpus (scrittura su file temporaneo)."""
+    path = percorso_ivf(path_json)
+    tmp = path + ".tmp.npz"
+    np.savez(tmp, centroidi=indice.centroidi, ordine=indice.ordine, offset=indice.offset,
+             firma=np.array(firma_corpus(path_json, len(indice))))
+    os.replace(tmp, path)
+
+
+def carica_ivf(path_json: str, embeddings, nprobe: int = ANN_NPROBE):
+    """
+    Carica l'indice IVF del corpus, o None se manca o non corrisponde più
+    ai vettori (corpus riscritto senza ricostruire l'indice).
+    """
+    path = percorso_ivf(path_json)
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as dati:
+        if str(dati["firma"]) != firma_corpus(path_json, embeddings.shape[0]):
+            telemetria.evento("ivf_non_aggiornato",
+                              f"{path} non corrisponde a {path_json}: uso la ricerca esatta (rilanciare ingest.py)")
+            return None
+        return IVFIndex(embeddings, dati["centroidi"], dati["ordine"], dati["offset"], nprobe)
+
+
+def query_di_prova(matrice: np.ndarray, n: int = 200, rumore: float = 0.5, seed: int = 0) -> np.ndarray:
+    """Righe del corpus a caso con un po' di rumore, come query per misurare il richiamo."""
+    rng = np.random.default_rng(seed)
+    righe = np.sort(rng.choice(matrice.shape[0], size=min(n, matrice.shape[0]), replace=False))
+    query = np.asarray(matrice[righe], dtype=np.float32)
+    query = query + rumore * rng.standard_normal(query.shape).astype(np.float32) / np.sqrt(query.shape[1])
+    return normalizza_righe(query)
+
+
+def valuta(indice: IVFIndex, query: np.ndarray, k: int = 10, nprobe: int = None) -> dict:
+    """
+    Richiamo@k dell'indice rispetto alla ricerca esatta e latenza media
+    (millisecondi) delle due ricerche.
+    """
+    esatto = SimilarityIndex(indice.matrice, normalizzata=True)
+    trovati, tempo_ann, tempo_esatto = 0, 0.0, 0.0
+    for q in query:
+        t = time.perf_counter()
+        approssimati = {i for i, _ in indice.top_k(q, k, nprobe)}
+        tempo_ann += time.perf_counter() - t
+        t = time.perf_counter()
+        veri = {i for i, _ in esatto.top_k(q, k)}
+        tempo_esatto += time.perf_counter() - t
+        trovati += len(approssimati & veri)
+    return {
+        "nprobe": nprobe or indice.nprobe,
+        "richiamo": trovati / (k * len(query)) if len(query) else 1.0,
+        "ms_ann": 1000 * tempo_ann / max(1, len(query)),
+        "ms_esatto": 1000 * tempo_esatto / max(1, len(query)),
+    }
+
+
+def aggiorna_ivf(path_json: str, n_liste: int = None, min_righe: int = ANN_MIN_RIGHE, forza: bool = False):
+    """
+    Ricostruisce e salva l'indice IVF del corpus se ha almeno `min_righe`
+    righe e l'indice salvato manca o è vecchio. Stampa il richiamo misurato.
+
+    Returns:
+        IVFIndex or None: L'indice costruito, None se non serviva
+    """
+    matrice = carica_vettori(percorso_vettori(path_json))
+    if matrice.shape[0] < min_righe and not forza:
+        if os.path.exists(percorso_ivf(path_json)):
+            os.remove(percorso_ivf(path_json))
+        return None
+    if not forza and carica_ivf(path_json, matrice) is not None:
+        print(f"{path_json}: indice IVF già aggiornato")
+        return None
+    inizio = time.perf_counter()
+    indice = IVFIndex.costruisci(matrice, n_liste)
+    salva_ivf(path_json, indice)
+    risultato = valuta(indice, query_di_prova(matrice))
+    print(f"{path_json}: indice IVF con {indice.centroidi.shape[0]} liste in {time.perf_counter() - inizio:.1f}s, "
+          f"richiamo@10 {risultato['richiamo']:.3f} con nprobe={indice.nprobe}")
+    return indice
+
+
+if __name__ == "__main__":
+    # Richiamo e latenza al variare di nprobe, per scegliere ANN_NPROBE
+    parser = argparse.ArgumentParser(description="Costruisce l'indice IVF di un corpus e ne misura il richiamo.")
+    parser.add_argument("corpus", help="File JSON del corpus (es. data/knowledgeBase.json)")
+    parser.add_argument("--liste", type=int, default=None, help="Numero di liste (default ~ 4·√n)")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--query", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    indice = aggiorna_ivf(args.corpus, args.liste, forza=True)
+    query = query_di_prova(indice.matrice, args.query)
+    for nprobe in args.nprobe:
+        r = valuta(indice, query, args.k, nprobe)
+        print(f"nprobe={r['nprobe']:4d}  richiamo@{args.k}={r['richiamo']:.3f}  "
+              f"ann={r['ms_ann']:.2f}ms  esatto={r['ms_esatto']:.2f}ms")
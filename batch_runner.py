@@ -0,0 +1,168 @@
+import argparse
+import asyncio
+import json
+import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import agent
+from llm_client import BATCH, con_priorita
+from memory_store import get_memory_store
+from rate_limit import TokenBucket
+
+
+def leggi_richieste(path_input: str) -> list:
+    """
+    Legge il file JSONL di richieste `{question, user, conversation_id}`.
+    Ogni richiesta ha come id il campo `id` o, se manca, il numero di riga.
+    """
+    richieste = []
+    with open(path_input, "r", encoding="utf-8") as f:
+        for numero, riga in enumerate(f):
+            if not riga.strip():
+                continue
+            record = json.loads(riga)
+            record.setdefault("id", numero)
+            richieste.append(record)
+    return richieste
+
+
+def esiti_precedenti(path_output: str) -> dict:
+    """
+    Ultimo risultato scritto per ogni id di richiesta nelle esecuzioni
+    precedenti: una richiesta ripresa può comparire più volte.
+    """
+    esiti = {}
+    if not os.path.exists(path_output):
+        return esiti
+    with open(path_output, "r", encoding="utf-8") as f:
+        for riga in f:
+            try:
+                record = json.loads(riga)
+            except ValueError:
+                # Ultima riga troncata da un crash
+                continue
+            esiti[record["id"]] = record
+    return esiti
+
+
+def richieste_completate(path_output: str) -> set:
+    """Id delle richieste elaborate con successo nelle esecuzioni precedenti."""
+    return {id_richiesta for id_richiesta, record in esiti_precedenti(path_output).items() if "risposta" in record}
+
+
+def richieste_da_elaborare(richieste: list, completate: set) -> OrderedDict:
+    """
+    Richieste da (ri)elaborare raggruppate per conversazione, nell'ordine del
+    file. Ogni conversazione riparte dalla sua prima richiesta non completata,
+    comprese le successive già riuscite: erano state elaborate senza quel
+    turno in memoria e vanno rifatte in ordine.
+    """
+    conversazioni = OrderedDict()
+    for richiesta in richieste:
+        conversazioni.setdefault(richiesta.get("conversation_id"), []).append(richiesta)
+    da_elaborare = OrderedDict()
+    for conversation_id, richieste_conversazione in conversazioni.items():
+        prima = next((i for i, r in enumerate(richieste_conversazione) if r["id"] not in completate), None)
+        if prima is not None:
+            da_elaborare[conversation_id] = richieste_conversazione[prima:]
+    return da_elaborare
+
+
+class BatchRunner:
+    """
+    Esegue un insieme di richieste con `concorrenza` conversazioni in parallelo.
+
+    Le richieste della stessa conversazione vengono elaborate in ordine, una
+    alla volta; `rate` limita le query al secondo (0 = nessun limite). Ogni
+    risultato viene scritto subito su file, quindi dopo un crash basta
+    rilanciare per riprendere da dove si era arrivati (per ogni
+    conversazione, dalla prima richiesta non riuscita).
+
+    Ogni risultato registra anche `turno`, i turni in memoria prima della
+    richiesta: alla ripresa la memoria della conversazione viene riportata a
+    quel punto, così i turni rielaborati non vengono salvati due volte.
+    """
+
+    def __init__(self, path_output: str, concorrenza: int = 8, rate: float = 0.0, preprocessing_fuso: bool = None):
+        self.path_output = path_output
+        self.concorrenza = concorrenza
+        self.limite = TokenBucket(rate) if rate > 0 else None
+        self.preprocessing_fuso = preprocessing_fuso
+        self.elaborate = 0
+        self.errori = 0
+        self._esiti = {}
+
+    def _scrivi(self, f, record: dict) -> None:
+        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        f.flush()
+
+    async def _elabora(self, f, richiesta: dict) -> None:
+        if self.limite is not None:
+            await self.limite.aacquisisci()
+        tempi = {}
+        record = {"id": richiesta["id"], "conversation_id": richiesta.get("conversation_id")}
+        record["turno"] = await asyncio.to_thread(get_memory_store().conta, richiesta["conversation_id"])
+        try:
+            # Le chiamate LLM del batch cedono il passo al traffico interattivo
+            with con_priorita(BATCH):
+                record["risposta"] = await agent.aprocess_query(
+                    richiesta["question"], richiesta["user"], richiesta["conversation_id"],
+                    self.preprocessing_fuso, tempi
+                )
+            self.elaborate += 1
+        except Exception as e:
+            record["errore"] = f"{type(e).__name__}: {e}"
+            self.errori += 1
+        record["tempi"] = tempi
+        self._scrivi(f, record)
+
+    async def _riallinea_memoria(self, richiesta: dict) -> None:
+        """
+        Elimina dalla memoria i turni salvati dopo il precedente tentativo di
+        `richiesta`, la prima da rielaborare della sua conversazione.
+        """
+        turno = self._esiti.get(richiesta["id"], {}).get("turno")
+        # Risultati scritti senza `turno`: non si sa da dove troncare
+        if turno is not None:
+            await asyncio.to_thread(get_memory_store().tronca, richiesta["conversation_id"], turno)
+
+    async def _worker(self, f, coda: asyncio.Queue) -> None:
+        while True:
+            try:
+                richieste = coda.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            await self._riallinea_memoria(richieste[0])
+            for richiesta in richieste:
+                await self._elabora(f, richiesta)
+
+    async def esegui(self, richieste: list) -> None:
+        self._esiti = esiti_precedenti(self.path_output)
+        completate = {id_richiesta for id_richiesta, record in self._esiti.items() if "risposta" in record}
+        conversazioni = richieste_da_elaborare(richieste, completate)
+        n_da_elaborare = sum(len(r) for r in conversazioni.values())
+        print(f"Richieste da elaborare: {n_da_elaborare} (già completate: {len(richieste) - n_da_elaborare})")
+
+        coda = asyncio.Queue()
+        for richieste_conversazione in conversazioni.values():
+            coda.put_nowait(richieste_conversazione)
+
+        loop = asyncio.get_running_loop()
+        loop.set_default_executor(ThreadPoolExecutor(max_workers=self.concorrenza * 4))
+        await asyncio.to_thread(agent.avvia)
+        with open(self.path_output, "a", encoding="utf-8") as f:
+            await asyncio.gather(*(self._worker(f, coda) for _ in range(self.concorrenza)))
+        print(f"Completate: {self.elaborate}, errori: {self.errori}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Elabora un file JSONL di domande con process_query.")
+    parser.add_argument("input", help="File JSONL con record {question, user, conversation_id}")
+    parser.add_argument("output", help="File JSONL dei risultati (riprende se esiste già)")
+    parser.add_argument("--concorrenza", type=int, default=8, help="Conversazioni elaborate in parallelo")
+    parser.add_argument("--rate", type=float, default=0.0, help="Query al secondo al massimo (0 = nessun limite)")
+    parser.add_argument("--preprocessing-fuso", action="store_true", help="Usa l'agente di pre-processing unico")
+    args = parser.parse_args()
+
+    runner = BatchRunner(args.output, args.concorrenza, args.rate, args.preprocessing_fuso or None)
+    asyncio.run(runner.esegui(leggi_richieste(args.input)))
@@ -0,0 +1,275 @@
+import asyncio
+import hashlib
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List
+import numpy as np
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from rate_limit import TokenBucket
+
+# Sostituti locali e deterministici di ChatOpenAI, OpenAIEmbeddings e della
+# ricerca web, con latenze configurabili, per benchmark e prove offline.
+
+_RE_PAROLE = re.compile(r"\w+", re.UNICODE)
+
+
+def risposta_finta(sistema: str, testo: str, parole_risposta: int = 60) -> str:
+    """Output valido per l'agente riconosciuto dal prompt di sistema."""
+    if "JSON" in sistema:
+        domanda = testo.split(":", 1)[-1].strip()
+        return json.dumps({"sentimento": "Neutro", "domanda_pulita": domanda, "percorso": "FAQ"})
+    if "Analizza il sentimento" in sistema:
+        return "Neutro"
+    if "riscrive domande" in sistema:
+        return testo.replace("Pulisci la seguente domanda:", "").strip()
+    if "Decidi dove" in sistema:
+        return "FAQ"
+    return " ".join(f"parola{i}" for i in range(parole_risposta))
+
+
+class StubChatModel(BaseChatModel):
+    """
+    Modello chat finto: riconosce il prompt di sistema dei vari agenti e
+    risponde con un output valido per ciascuno dopo `latenza` secondi.
+    """
+
+    latenza: float = 0.0
+    parole_risposta: int = 60
+
+    @property
+    def _llm_type(self) -> str:
+        return "stub"
+
+    def _risposta(self, messages) -> str:
+        sistema = messages[0].content if len(messages) > 1 else ""
+        return risposta_finta(sistema, messages[-1].content, self.parole_risposta)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        time.sleep(self.latenza)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self._risposta(messages)))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        await asyncio.sleep(self.latenza)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self._risposta(messages)))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        parole = self._risposta(messages).split(" ")
+        for parola in parole:
+            time.sleep(self.latenza / len(parole))
+            yield ChatGenerationChunk(message=AIMessageChunk(content=parola + " "))
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        parole = self._risposta(messages).split(" ")
+        for parola in parole:
+            await asyncio.sleep(self.latenza / len(parole))
+            yield ChatGenerationChunk(message=AIMessageChunk(content=parola + " "))
+
+
+class StubEmbeddings:
+    """
+    Embedding finti: ogni parola ha un vettore casuale fisso (seme = hash
+    della parola) e il testo è la somma normalizzata delle sue parole, così
+    testi con parole in comune risultano simili.
+    """
+
+    def __init__(self, dim: int = 256, latenza: float = 0.0):
+        self.dim = dim
+        self.latenza = latenza
+        self._parole = {}
+        self._lock = threading.Lock()
+
+    def _vettore_parola(self, parola: str) -> np.ndarray:
+        vettore = self._parole.get(parola)
+        if vettore is None:
+            seme = int(hashlib.sha1(parola.encode("utf-8")).hexdigest()[:8], 16)
+            vettore = np.random.default_rng(seme).standard_normal(self.dim).astype(np.float32)
+            with self._lock:
+                self._parole[parola] = vettore
+        return vettore
+
+    def vettore(self, testo: str) -> np.ndarray:
+        v = np.zeros(self.dim, dtype=np.float32)
+        for parola in _RE_PAROLE.findall(testo.lower()):
+            v += self._vettore_parola(parola)
+        norma = np.linalg.norm(v)
+        return v / norma if norma > 0 else v
+
+    def embed_documents(self, testi: List[str]) -> List[List[float]]:
+        time.sleep(self.latenza)
+        return [self.vettore(t).tolist() for t in testi]
+
+    def embed_query(self, testo: str) -> List[float]:
+        return self.embed_documents([testo])[0]
+
+
+class StubWebServer:
+    """
+    Server HTTP locale che restituisce pagine HTML sintetiche dopo
+    `latenza` secondi, più una funzione di ricerca compatibile con
+    WebSearcher che restituisce URL di questo server.
+    """
+
+    def __init__(self, latenza: float = 0.0, latenza_ricerca: float = 0.0, dimensione_pagina: int = 20000):
+        self.latenza_ricerca = latenza_ricerca
+        corpo = ("<html><head><script>var x = 1;</script><style>p {}</style></head><body>"
+                 + "<p>Contenuto di prova per la ricerca web.</p>" * (dimensione_pagina // 45)
+                 + "</body></html>").encode("utf-8")
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                time.sleep(latenza)
+                self.send_response(200)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(corpo)))
+                self.end_headers()
+                self.wfile.write(corpo)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self.porta = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def search(self, domanda: str, num: int) -> List[str]:
+        time.sleep(self.latenza_ricerca)
+        chiave = hashlib.sha1(domanda.encode("utf-8")).hexdigest()[:8]
+        return [f"http://127.0.0.1:{self.porta}/{chiave}/{i}" for i in range(num)]
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class StubOpenAIServer:
+    """
+    Server HTTP locale compatibile con l'API OpenAI (chat/completions, anche
+    in streaming, ed embeddings) con le risposte degli stub, per provare il
+    client condiviso di llm_client (LLM_BASE_URL = `base_url`). `latenza`
+    vale per la chat, gli embedding usano quella di `embeddings`.
+
+    Simula i limiti del servizio: oltre `richieste_minuto` richieste al
+    minuto o `concorrenza_max` richieste contemporanee risponde 429 con
+    Retry-After; `tasso_errori` è la quota di 500 casuali.
+    """
+
+    def __init__(self, embeddings: StubEmbeddings, latenza: float = 0.0, parole_risposta: int = 60,
+                 richieste_minuto: float = 0.0, concorrenza_max: int = 0, tasso_errori: float = 0.0, seed: int = 0):
+        limite = TokenBucket(richieste_minuto / 60, richieste_minuto) if richieste_minuto > 0 else None
+        rng = np.random.default_rng(seed)
+        stato = {"in_corso": 0}
+        self.conteggi = {}
+        lock = threading.Lock()
+        conteggi = self.conteggi
+        encoder = []
+
+        def testo_input(voce) -> str:
+            # OpenAIEmbeddings manda gli id dei token: si ritorna al testo con tiktoken
+            if isinstance(voce, list):
+                if not encoder:
+                    import tiktoken
+                    encoder.append(tiktoken.get_encoding("cl100k_base"))
+                return encoder[0].decode(voce)
+            return str(voce)
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _json(self, stato_http: int, corpo: dict, headers: dict = None):
+                dati = json.dumps(corpo).encode("utf-8")
+                self.send_response(stato_http)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(dati)))
+                for nome, valore in (headers or {}).items():
+                    self.send_header(nome, valore)
+                self.end_headers()
+                self.wfile.write(dati)
+
+            def _conta(self, esito: str):
+                with lock:
+                    conteggi[esito] = conteggi.get(esito, 0) + 1
+
+            def do_POST(self):
+                richiesta = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                with lock:
+                    rifiuto = ((limite is not None and limite.prova() > 0)
+                               or (concorrenza_max and stato["in_corso"] >= concorrenza_max))
+                    errore = not rifiuto and tasso_errori > 0 and rng.random() < tasso_errori
+                    if not rifiuto and not errore:
+                        stato["in_corso"] += 1
+                if rifiuto:
+                    self._conta("429")
+                    return self._json(429, {"error": {"message": "Rate limit", "type": "rate_limit_exceeded"}},
+                                      {"Retry-After": "0.2"})
+                if errore:
+                    self._conta("500")
+                    return self._json(500, {"error": {"message": "Errore simulato", "type": "server_error"}})
+                try:
+                    self._conta("200")
+                    if self.path.rstrip("/").endswith("embeddings"):
+                        self._embeddings(richiesta)
+                    else:
+                        self._chat(richiesta)
+                finally:
+                    with lock:
+                        stato["in_corso"] -= 1
+
+            def _embeddings(self, richiesta):
+                time.sleep(embeddings.latenza)
+                voci = richiesta.get("input", [])
+                if isinstance(voci, str) or (voci and isinstance(voci[0], int)):
+                    voci = [voci]
+                dati = [{"object": "embedding", "index": i, "embedding": embeddings.vettore(testo_input(v)).tolist()}
+                        for i, v in enumerate(voci)]
+                self._json(200, {"object": "list", "data": dati, "model": richiesta.get("model"),
+                                 "usage": {"prompt_tokens": 0, "total_tokens": 0}})
+
+            def _chat(self, richiesta):
+                messaggi = richiesta.get("messages", [])
+                sistema = messaggi[0].get("content", "") if len(messaggi) > 1 else ""
+                testo = messaggi[-1].get("content", "") if messaggi else ""
+                risposta = risposta_finta(sistema, testo, parole_risposta)
+                base = {"id": "chatcmpl-stub", "created": int(time.time()), "model": richiesta.get("model") or "stub"}
+                if not richiesta.get("stream"):
+                    time.sleep(latenza)
+                    return self._json(200, dict(base, object="chat.completion", choices=[{
+                        "index": 0, "message": {"role": "assistant", "content": risposta}, "finish_reason": "stop",
+                    }], usage={"prompt_tokens": len(testo) // 4, "completion_tokens": len(risposta) // 4,
+                               "total_tokens": (len(testo) + len(risposta)) // 4}))
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                parole = risposta.split(" ")
+                for i, parola in enumerate(parole):
+                    time.sleep(latenza / len(parole))
+                    blocco = dict(base, object="chat.completion.chunk", choices=[{
+                        "index": 0, "delta": {"content": parola + (" " if i < len(parole) - 1 else "")},
+                        "finish_reason": None,
+                    }])
+                    self.wfile.write(f"data: {json.dumps(blocco)}\n\n".encode("utf-8"))
+                fine = dict(base, object="chat.completion.chunk",
+                            choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}])
+                self.wfile.write(f"data: {json.dumps(fine)}\n\ndata: [DONE]\n\n".encode("utf-8"))
+                self.wfile.flush()
+                self.close_connection = True
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self.base_url = f"http://127.0.0.1:{self._server.server_address[1]}/v1"
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
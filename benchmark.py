@@ -0,0 +1,286 @@
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+import numpy as np
+
+# Benchmark offline della pipeline: LLM, embedding e ricerca web sono
+# sostituiti dagli stub di bench_stubs, i corpus FAQ/KB sono sintetici.
+# Esempio:
+#   python benchmark.py --dimensioni 100 10000 100000 --output bench.json
+#   python benchmark.py --output nuovo.json --confronta bench.json
+#   python benchmark.py --server-openai --server-concorrenza 4  (client HTTP condiviso e server finto)
+
+PAROLE = (
+    "password account fattura ordine spedizione reso rimborso garanzia stampante monitor "
+    "notebook router licenza software aggiornamento driver installazione backup rete wifi "
+    "assistenza tecnico contratto abbonamento pagamento carta bonifico consegna corriere "
+    "prodotto difettoso sostituzione riparazione configurazione server cloud email antivirus "
+    "sicurezza accesso profilo portale cliente azienda partner prezzo sconto offerta catalogo"
+).split()
+VERBI = ["resettare", "attivare", "configurare", "aggiornare", "annullare", "modificare", "verificare", "richiedere"]
+RUOLI = ["Cliente Occasionale", "Cliente Registrato", "Azienda Cliente", "Partner Tecnologico"]
+
+
+def genera_corpus(n: int, stub, rng, cartella: str):
+    """Scrive in `cartella` un corpus FAQ e uno KB sintetici di `n` elementi ciascuno."""
+    from embedding_store import salva_corpus
+    faq, kb = [], []
+    for i in range(n):
+        parole = rng.choice(PAROLE, size=3, replace=False)
+        codice = f"TA-{i:06d}"
+        faq.append({
+            "domanda": f"Come posso {rng.choice(VERBI)} {parole[0]} {parole[1]} {parole[2]} {codice}?",
+            "risposta": f"Per {parole[0]} {codice} segui la procedura nel portale clienti.",
+        })
+        kb.append({"tipo": "prodotto", "codice": codice, "descrizione": " ".join(rng.choice(PAROLE, size=8))})
+    faq_path = os.path.join(cartella, f"faq_{n}.json")
+    kb_path = os.path.join(cartella, f"kb_{n}.json")
+    salva_corpus(faq_path, faq, np.array([stub.vettore(r["domanda"]) for r in faq]))
+    salva_corpus(kb_path, kb, np.array([stub.vettore(" ".join(f"{k}: {v}," for k, v in r.items())) for r in kb]))
+    return faq_path, kb_path, faq
+
+
+def genera_query(faq: list, n: int, rng, quota_miss: float = 0.3) -> list:
+    """Parafrasi delle domande FAQ (una parola tolta) più domande casuali che non trovano nulla."""
+    query = []
+    for _ in range(n):
+        if rng.random() < quota_miss:
+            query.append(" ".join(rng.choice(VERBI + ["meteo", "calcio", "ricetta", "vacanze"], size=5)))
+        else:
+            parole = faq[rng.integers(len(faq))]["domanda"].rstrip("?").split()
+            del parole[rng.integers(1, len(parole))]
+            query.append(" ".join(parole))
+    return query
+
+
+def riassumi(durate: list, secondi_totali: float = None) -> dict:
+    """Statistiche di latenza (millisecondi) e throughput (operazioni al secondo)."""
+    if not durate:
+        return {"n": 0}
+    ms = np.array(durate) * 1000
+    secondi_totali = secondi_totali or float(np.sum(durate))
+    return {
+        "n": len(durate),
+        "media_ms": round(float(np.mean(ms)), 3),
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+        "throughput": round(len(durate) / secondi_totali, 3) if secondi_totali > 0 else None,
+    }
+
+
+def _misura(fn, argomenti: list) -> dict:
+    durate = []
+    inizio = time.perf_counter()
+    for args in argomenti:
+        t = time.perf_counter()
+        fn(*args)
+        durate.append(time.perf_counter() - t)
+    return riassumi(durate, time.perf_counter() - inizio)
+
+
+def bench_ricerca(stato_agente, query: list) -> dict:
+    """find_best_match (embedding + similarità) sul corpus dello stato."""
+    return _misura(stato_agente.faq_tool.run, [(q,) for q in query])
+
+
+def bench_memoria(n: int) -> dict:
+    from conversation_utils import save_conversation_memory
+    cId = f"bench_memoria_{time.time_ns()}"
+    return _misura(save_conversation_memory, [(cId, f"domanda {i}", "risposta " * 50, RUOLI[0], "Neutro") for i in range(n)])
+
+
+def bench_ticket(n: int) -> dict:
+    from conversation_utils import create_ticket
+    return _misura(create_ticket, [(f"domanda {i}", "Negativo", RUOLI[i % len(RUOLI)], f"bench_ticket_{i}") for i in range(n)])
+
+
+async def _query_misurata(agent, domanda: str, user: str, cId: str, tempi_fasi: dict, durate: list):
+    tempi = {}
+    t = time.perf_counter()
+    await agent.aprocess_query(domanda, user, cId, None, tempi)
+    durate.append(time.perf_counter() - t)
+    for fase, secondi in tempi.items():
+        tempi_fasi.setdefault(fase, []).append(secondi)
+
+
+async def bench_pipeline(agent, query: list) -> dict:
+    """process_query end-to-end, una query alla volta, con i tempi delle singole fasi."""
+    tempi_fasi, durate = {}, []
+    inizio = time.perf_counter()
+    for i, domanda in enumerate(query):
+        await _query_misurata(agent, domanda, RUOLI[i % len(RUOLI)], f"bench_seq_{i}", tempi_fasi, durate)
+    risultato = {"end_to_end": riassumi(durate, time.perf_counter() - inizio)}
+    risultato.update({f"fase_{fase}": riassumi(secondi) for fase, secondi in tempi_fasi.items()})
+    return risultato
+
+
+async def bench_carico(agent, query: list, conversazioni: int, turni: int) -> dict:
+    """`conversazioni` conversazioni concorrenti da `turni` domande ciascuna."""
+    tempi_fasi, durate = {}, []
+
+    async def conversazione(c: int):
+        for t in range(turni):
+            domanda = query[(c * turni + t) % len(query)]
+            await _query_misurata(agent, domanda, RUOLI[c % len(RUOLI)], f"bench_carico_{c}", tempi_fasi, durate)
+
+    inizio = time.perf_counter()
+    await asyncio.gather(*(conversazione(c) for c in range(conversazioni)))
+    risultato = {"end_to_end": riassumi(durate, time.perf_counter() - inizio)}
+    risultato.update({f"fase_{fase}": riassumi(secondi) for fase, secondi in tempi_fasi.items()})
+    return risultato
+
+
+def confronta(base: dict, nuovo: dict, soglia: float) -> list:
+    """
+    Confronta due report e restituisce le regressioni: p99 peggiorato o
+    throughput calato di più di `soglia` (frazione).
+    """
+    regressioni = []
+    for nome, metriche in nuovo["risultati"].items():
+        vecchie = base["risultati"].get(nome)
+        if not vecchie or not metriche.get("n"):
+            continue
+        for chiave in ("p50_ms", "p99_ms", "throughput"):
+            prima, dopo = vecchie.get(chiave), metriche.get(chiave)
+            if not prima or dopo is None:
+                continue
+            delta = (dopo - prima) / prima
+            peggiorato = delta > soglia if chiave != "throughput" else delta < -soglia
+            print(f"{nome:45s} {chiave:10s} {prima:12.3f} -> {dopo:12.3f} ({delta:+.1%}){'  REGRESSIONE' if peggiorato else ''}")
+            if peggiorato:
+                regressioni.append((nome, chiave, prima, dopo))
+    return regressioni
+
+
+def _appiattisci(prefisso: str, risultati: dict, destinazione: dict) -> None:
+    for nome, valore in risultati.items():
+        destinazione[f"{prefisso}.{nome}"] = valore
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark offline della pipeline con backend finti.")
+    parser.add_argument("--dimensioni", type=int, nargs="+", default=[100, 10000, 100000], help="Dimensioni dei corpus sintetici")
+    parser.add_argument("--query", type=int, default=200, help="Query per la ricerca interna")
+    parser.add_argument("--query-pipeline", type=int, default=50, help="Query end-to-end in sequenza")
+    parser.add_argument("--operazioni", type=int, default=500, help="Scritture per memoria e ticket")
+    parser.add_argument("--conversazioni", type=int, default=20, help="Conversazioni concorrenti (modalità carico, 0 = salta)")
+    parser.add_argument("--turni", type=int, default=3, help="Turni per conversazione (modalità carico)")
+    parser.add_argument("--dim", type=int, default=256, help="Dimensione degli embedding finti")
+    parser.add_argument("--latenza-llm", type=float, default=0.2)
+    parser.add_argument("--latenza-embedding", type=float, default=0.05)
+    parser.add_argument("--latenza-ricerca", type=float, default=0.1)
+    parser.add_argument("--latenza-pagina", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--server-openai", action="store_true",
+                        help="LLM ed embedding tramite il client HTTP di llm_client e un server finto compatibile OpenAI")
+    parser.add_argument("--server-rpm", type=float, default=0.0, help="Richieste al minuto del server finto (0 = nessun limite)")
+    parser.add_argument("--server-concorrenza", type=int, default=0, help="Richieste contemporanee del server finto (0 = nessun limite)")
+    parser.add_argument("--output", help="File JSON del report (default: stdout)")
+    parser.add_argument("--confronta", help="Report precedente da confrontare con questo")
+    parser.add_argument("--soglia-regressione", type=float, default=0.1)
+    args = parser.parse_args()
+
+    progetto = os.path.dirname(os.path.abspath(__file__))
+    cartella = tempfile.mkdtemp(prefix="bench_")
+    # Archivi, sommari e cache isolati dal resto del progetto: si lavora in una cartella temporanea
+    os.makedirs(os.path.join(cartella, "data"))
+    shutil.copy(os.path.join(progetto, "data", "users.json"), os.path.join(cartella, "data", "users.json"))
+    output = os.path.abspath(args.output) if args.output else None
+    confronto = os.path.abspath(args.confronta) if args.confronta else None
+    sys.path.insert(0, progetto)
+    os.chdir(cartella)
+    os.environ["CONVERSATION_MEMORY_DB"] = os.path.join(cartella, "memoria.db")
+    os.environ["TICKETS_DB"] = os.path.join(cartella, "tickets.db")
+    os.environ.setdefault("SENTIMENT_LOCALE", "0")
+    os.environ.pop("EMBEDDING_CACHE_DB", None)
+
+    from bench_stubs import StubChatModel, StubEmbeddings, StubOpenAIServer, StubWebServer
+    embeddings = StubEmbeddings(dim=args.dim, latenza=args.latenza_embedding)
+    server_openai = None
+    if args.server_openai:
+        # llm_client legge LLM_BASE_URL all'import
+        server_openai = StubOpenAIServer(embeddings, args.latenza_llm, richieste_minuto=args.server_rpm,
+                                         concorrenza_max=args.server_concorrenza, seed=args.seed)
+        os.environ["LLM_BASE_URL"] = server_openai.base_url
+        os.environ.setdefault("OPENAI_API_KEY", "stub")
+        os.environ.setdefault("MODELLO", "stub")
+
+    import agent
+    from ann import aggiorna_ivf
+    import llm_client
+    from web_search import WebSearcher
+
+    rng = np.random.default_rng(args.seed)
+    if server_openai is None:
+        llm_client.imposta_client(llm=StubChatModel(latenza=args.latenza_llm), embeddings_model=embeddings)
+    web = StubWebServer(latenza=args.latenza_pagina, latenza_ricerca=args.latenza_ricerca)
+    web_searcher = WebSearcher(search_fn=web.search, cache_ttl=0)
+
+    risultati = {}
+    # aggiorna_ivf e gli indici ridotti stampano l'avanzamento: va su stderr,
+    # così stdout contiene solo il report JSON
+    with contextlib.redirect_stdout(sys.stderr):
+        for n in args.dimensioni:
+            faq_path, kb_path, faq = genera_corpus(n, embeddings, rng, cartella)
+            # Come ingest.py: indice IVF per i corpus grandi (ANN_MIN_RIGHE)
+            aggiorna_ivf(faq_path)
+            aggiorna_ivf(kb_path)
+            stato_agente = agent.StatoAgente(faq_path, kb_path, web_searcher=web_searcher)
+            agent.imposta_stato_agente(stato_agente)
+            query = genera_query(faq, args.query, rng)
+            risultati[f"ricerca_interna.n{n}"] = bench_ricerca(stato_agente, query)
+            # Seconda passata: embedding già in cache, resta solo la similarità
+            risultati[f"ricerca_interna_cache.n{n}"] = bench_ricerca(stato_agente, query)
+
+        risultati["memoria.save_conversation_memory"] = bench_memoria(args.operazioni)
+        risultati["ticket.create_ticket"] = bench_ticket(args.operazioni)
+
+        query = genera_query(faq, max(args.query_pipeline, args.conversazioni * args.turni), rng)
+        # llm_client.esegui chiude le connessioni del client asincrono prima che
+        # il loop di ogni scenario termini (--server-openai)
+        _appiattisci("pipeline", llm_client.esegui(bench_pipeline(agent, query[:args.query_pipeline])), risultati)
+        if args.conversazioni:
+            _appiattisci(
+                f"carico.c{args.conversazioni}",
+                llm_client.esegui(bench_carico(agent, query, args.conversazioni, args.turni)),
+                risultati,
+            )
+    web.close()
+
+    report = {
+        "meta": {
+            "data": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "parametri": vars(args),
+        },
+        "risultati": risultati,
+    }
+    if server_openai is not None:
+        server_openai.close()
+        # Risposte del server finto per codice (i 429 sono quelli assorbiti dal client)
+        report["meta"]["server_openai"] = dict(server_openai.conteggi)
+    testo = json.dumps(report, indent=2, ensure_ascii=False)
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            f.write(testo)
+    else:
+        print(testo)
+
+    if confronto:
+        with open(confronto, "r", encoding="utf-8") as f:
+            base = json.load(f)
+        regressioni = confronta(base, report, args.soglia_regressione)
+        if regressioni:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
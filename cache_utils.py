@@ -0,0 +1,97 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+def normalizza_testo(testo: str) -> str:
+    """Normalizza un testo per usarlo come chiave (minuscolo, spazi compattati)."""
+    return " ".join(testo.lower().split())
+
+
+class LRUCache:
+    """
+    Cache in memoria con dimensione massima: quando è piena elimina
+    l'elemento usato meno di recente. Con `ttl` (secondi) gli elementi
+    scadono dopo il tempo indicato. Thread-safe.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._dati = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, chiave, default=None):
+        with self._lock:
+            if chiave in self._dati:
+                scadenza, valore = self._dati[chiave]
+                if scadenza is None or scadenza > time.monotonic():
+                    self._dati.move_to_end(chiave)
+                    self.hits += 1
+                    return valore
+                del self._dati[chiave]
+            self.misses += 1
+            return default
+
+    def put(self, chiave, valore) -> None:
+        scadenza = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._dati[chiave] = (scadenza, valore)
+            self._dati.move_to_end(chiave)
+            while len(self._dati) > self.max_size:
+                self._dati.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._dati.clear()
+
+    def __len__(self):
+        return len(self._dati)
+
+    def __contains__(self, chiave):
+        return chiave in self._dati
+
+
+class SingleFlight:
+    """
+    Accorpa le chiamate concorrenti con la stessa chiave: la prima esegue la
+    funzione, le altre aspettano e ricevono lo stesso risultato (o errore).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._in_corso = {}
+        self.accorpate = 0
+
+    def do(self, chiave, fn):
+        with self._lock:
+            future = self._in_corso.get(chiave)
+            leader = future is None
+            if leader:
+                future = Future()
+                future.seguaci = 0
+                self._in_corso[chiave] = future
+            else:
+                self.accorpate += 1
+                future.seguaci += 1
+        if not leader:
+            return future.result()
+        try:
+            risultato = fn()
+            future.set_result(risultato)
+            return risultato
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._in_corso[chiave]
+
+    def seguaci(self, chiave) -> int:
+        """Chiamate in attesa del risultato di quella in corso con `chiave`."""
+        with self._lock:
+            future = self._in_corso.get(chiave)
+            return future.seguaci if future is not None else 0
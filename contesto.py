@@ -0,0 +1,122 @@
+import os
+import threading
+import telemetria
+
+# Costruzione del contesto per il prompt di risposta entro un budget di token.
+# Le sezioni vengono aggiunte in ordine di priorità: quelle che non entrano
+# vengono accorciate (se troncabili) o escluse, e le esclusioni finiscono nel log.
+# La prima (ruolo e sentimento) non viene mai esclusa: al più si accorcia.
+
+# Token massimi del contesto (domanda e prompt di sistema esclusi)
+MAX_TOKEN_CONTESTO = int(os.getenv("CONTESTO_MAX_TOKEN", "1500"))
+# Token massimi per la risposta di ogni turno precedente
+MAX_TOKEN_TURNO = int(os.getenv("CONTESTO_TOKEN_TURNO", "120"))
+# Sotto questa soglia non vale la pena troncare una sezione: si esclude
+MIN_TOKEN_SEZIONE = 20
+
+_lock = threading.Lock()
+_encoder = None
+_encoder_caricato = False
+
+
+def _get_encoder():
+    """Tokenizer tiktoken del modello (MODELLO), o None se tiktoken non è installato."""
+    global _encoder, _encoder_caricato
+    with _lock:
+        if not _encoder_caricato:
+            _encoder_caricato = True
+            try:
+                import tiktoken
+                try:
+                    _encoder = tiktoken.encoding_for_model(os.getenv("MODELLO") or "gpt-4o")
+                except KeyError:
+                    _encoder = tiktoken.get_encoding("o200k_base")
+            except Exception as e:
+                # Solo il tipo di errore: senza rete tiktoken solleva eccezioni molto lunghe
+                telemetria.evento("tiktoken_non_disponibile",
+                                  f"tiktoken non disponibile, stima dei token con len/4 ({type(e).__name__})")
+        return _encoder
+
+
+def conta_token(testo: str) -> int:
+    """Numero di token di `testo` (stima di 4 caratteri per token senza tiktoken)."""
+    encoder = _get_encoder()
+    if encoder is None:
+        return (len(testo) + 3) // 4
+    return len(encoder.encode(testo))
+
+
+def tronca(testo: str, max_token: int) -> str:
+    """Accorcia `testo` ai primi `max_token` token, aggiungendo "…" se tagliato."""
+    if max_token <= 0:
+        return ""
+    encoder = _get_encoder()
+    if encoder is None:
+        if len(testo) <= max_token * 4:
+            return testo
+        return testo[:max_token * 4 - 1].rstrip() + "…"
+    token = encoder.encode(testo)
+    if len(token) <= max_token:
+        return testo
+    return encoder.decode(token[:max_token - 1]).rstrip() + "…"
+
+
+def componi(sezioni: list, budget: int = None) -> str:
+    """
+    Compone il contesto entro `budget` token.
+
+    Args:
+        sezioni (list): Tuple (nome, testo, troncabile) in ordine di priorità;
+            la prima è sempre inclusa, troncata al budget se non entra
+        budget (int, optional): Token disponibili (default: MAX_TOKEN_CONTESTO)
+
+    Returns:
+        str: Le sezioni incluse, una per riga, nell'ordine dato
+    """
+    residuo = MAX_TOKEN_CONTESTO if budget is None else budget
+    incluse, escluse, troncate = [], [], []
+    for indice, (nome, testo, troncabile) in enumerate(sezioni):
+        if not testo:
+            continue
+        # +1 per l'a capo che separa le sezioni
+        token = conta_token(testo) + 1
+        if token <= residuo:
+            incluse.append(testo)
+            residuo -= token
+        elif indice == 0 or (troncabile and residuo - 1 >= MIN_TOKEN_SEZIONE):
+            incluse.append(tronca(testo, residuo - 1))
+            troncate.append(nome)
+            residuo = 0
+        else:
+            escluse.append(nome)
+
+    for nome in escluse:
+        telemetria.incrementa("contesto_sezioni_totale", sezione=nome.split("[")[0], esito="esclusa")
+    for nome in troncate:
+        telemetria.incrementa("contesto_sezioni_totale", sezione=nome.split("[")[0], esito="troncata")
+    if escluse or troncate:
+        telemetria.evento("contesto_oltre_budget", f"Contesto oltre il budget: escluse {escluse}, troncate {troncate}")
+    span = telemetria.span_corrente()
+    span.imposta("contesto_token", (MAX_TOKEN_CONTESTO if budget is None else budget) - residuo)
+    span.imposta("contesto_escluse", escluse)
+    return "\n".join(incluse)
+
+
+def formatta_kb(record: dict) -> str:
+    """Campi di un record KB come righe `campo: valore` (liste separate da virgole)."""
+    righe = []
+    for campo, valore in record.items():
+        if campo == "vec":
+            continue
+        if isinstance(valore, list):
+            valore = ", ".join(str(v) for v in valore)
+        elif isinstance(valore, dict):
+            valore = ", ".join(f"{k}: {v}" for k, v in valore.items())
+        righe.append(f"- {campo}: {valore}")
+    return "\n".join(righe)
+
+
+def formatta_turno(interazione: dict, max_token: int = None) -> str:
+    """Un turno precedente, con la risposta dell'assistente accorciata a `max_token` token."""
+    risposta = tronca(interazione.get("ai_response") or "", MAX_TOKEN_TURNO if max_token is None else max_token)
+    return f"Utente: {interazione.get('user_query', '')}\nAssistente: {risposta}"
@@ -2,7 +2,29 @@ import json
 import os
 import uuid
 from datetime import datetime, timedelta
-from transformers import pipeline
+import telemetria
+from memory_store import get_memory_store
+from ticket_store import get_ticket_store
+from sentiment_service import get_sentiment_service
+
+# Le cinque classi di sentiment usate dagli agenti e da create_ticket
+SENTIMENTI = ["Molto Positivo", "Positivo", "Neutro", "Negativo", "Molto Negativo"]
+
+def normalizza_sentimento(label):
+    """
+    Riporta un'etichetta di sentiment (es. "molto negativo", "Negativo.")
+    a una delle cinque classi di SENTIMENTI.
+
+    Returns:
+        str or None: Classe normalizzata o None se non riconosciuta
+    """
+    if not isinstance(label, str):
+        return None
+    pulita = " ".join(label.strip().strip(".-*'\"").lower().split())
+    for sentimento in SENTIMENTI:
+        if pulita == sentimento.lower():
+            return sentimento
+    return None
 
 def analyze_sentiment(text, sentiment_analyzer=None):
     """
@@ -10,15 +32,19 @@ def analyze_sentiment(text, sentiment_analyzer=None):
     
     Args:
         text (str): Testo da analizzare
-        sentiment_analyzer (pipeline, optional): Analizzatore di sentiment pre-inizializzato
+        sentiment_analyzer (pipeline, optional): Analizzatore di sentiment pre-inizializzato;
+            se assente usa il SentimentService condiviso (modello caricato una volta sola)
     
     Returns:
         dict: Risultato dell'analisi del sentiment
     """
-    if sentiment_analyzer is None:
-        sentiment_analyzer = pipeline("sentiment-analysis")
-    
     try:
+        if sentiment_analyzer is None:
+            service = get_sentiment_service()
+            if service is None:
+                return _manual_sentiment_classification(text)
+            label, score = service.classifica(text)
+            return {"label": label, "score": score}
         result = sentiment_analyzer(text)[0]
         return {
             "label": result['label'],
@@ -50,7 +76,7 @@ def save_conversation_memory(
     ai_response, 
     user_role, 
     sentiment=None,
-    memory_file=None
+    memory_store=None
 ):
     """
     Salva l'interazione in memoria
@@ -61,16 +87,10 @@ def save_conversation_memory(
         ai_response (str): Risposta dell'IA
         user_role (str): Ruolo dell'utente
         sentiment (str, optional): Sentiment dell'interazione
-        memory_file (str, optional): Percorso del file di memoria
+        memory_store (MemoryStore, optional): Store della memoria (default: quello condiviso)
     """
-    if memory_file is None:
-        memory_file = f"data/conversation_memory_{conversation_id}.json"
-    
-    # Carica memoria esistente
-    memory = []
-    if os.path.exists(memory_file):
-        with open(memory_file, 'r', encoding='utf-8') as f:
-            memory = json.load(f)
+    if memory_store is None:
+        memory_store = get_memory_store()
     
     # Analizza sentiment se non fornito
     if sentiment is None:
@@ -85,34 +105,37 @@ def save_conversation_memory(
         "sentiment": sentiment
     }
     
-    # Aggiungi interazione
-    memory.append(interaction)
-    
-    # Salva memoria
-    os.makedirs(os.path.dirname(memory_file) or '.', exist_ok=True)
-    with open(memory_file, 'w', encoding='utf-8') as f:
-        json.dump(memory, f, ensure_ascii=False, indent=2)
+    # Aggiungi interazione (append, senza riscrivere la storia)
+    with telemetria.span("memory_store.aggiungi"):
+        turni = memory_store.aggiungi(conversation_id, interaction)
     
     # Genera sommario ogni 10 interazioni
-    if len(memory) % 10 == 0:
-        generate_conversation_summary(conversation_id, memory)
+    if turni % 10 == 0:
+        with telemetria.span("sommario_conversazione", turni=turni):
+            generate_conversation_summary(conversation_id, memory_store)
 
-def generate_conversation_summary(conversation_id, memory):
+def generate_conversation_summary(conversation_id, memory_store=None):
     """
-    Genera un sommario della conversazione
+    Genera un sommario della conversazione dagli aggregati del MemoryStore
+    (aggiornati a ogni interazione), senza rileggere la storia.
     
     Args:
         conversation_id (str): ID della conversazione
-        memory (list): Memoria della conversazione
+        memory_store (MemoryStore, optional): Store della memoria (default: quello condiviso)
     """
+    if memory_store is None:
+        memory_store = get_memory_store()
+    riepilogo = memory_store.riepilogo(conversation_id)
+    if riepilogo is None:
+        return
     summary = {
         "conversation_id": conversation_id,
-        "total_interactions": len(memory),
+        "total_interactions": riepilogo["turni"],
         "date_range": {
-            "start": memory[0]['timestamp'],
-            "end": memory[-1]['timestamp']
+            "start": riepilogo["inizio"],
+            "end": riepilogo["fine"]
         },
-        "sentiment_distribution": _calculate_sentiment_distribution(memory),
+        "sentiment_distribution": riepilogo["sentimenti"],
         "summary_timestamp": datetime.now().isoformat()
     }
     
@@ -122,20 +145,12 @@ def generate_conversation_summary(conversation_id, memory):
     with open(os.path.join('conversation_summaries', summary_file), 'w', encoding='utf-8') as f:
         json.dump(summary, f, ensure_ascii=False, indent=2)
 
-def _calculate_sentiment_distribution(memory):
-    """Calcola la distribuzione dei sentiment"""
-    sentiments = [interaction['sentiment'] for interaction in memory]
-    return {
-        sentiment: sentiments.count(sentiment) 
-        for sentiment in set(sentiments)
-    }
-
 def create_ticket(
     query, 
     sentiment, 
     user_role, 
     conversation_id,
-    tickets_file='data/tickets.json'
+    ticket_store=None
 ):
     """
     Crea un nuovo ticket se necessario
@@ -144,7 +159,8 @@ def create_ticket(
         query (str): Query dell'utente
         sentiment (str): Sentiment dell'interazione
         user_role (str): Ruolo dell'utente
-        tickets_file (str, optional): Percorso del file dei ticket
+        conversation_id (str): ID della conversazione
+        ticket_store (TicketStore, optional): Archivio dei ticket (default: quello condiviso)
     
     Returns:
         dict or None: Ticket creato o None
@@ -153,12 +169,6 @@ def create_ticket(
     if sentiment not in ["Negativo", "Molto Negativo"]:
         return None
     
-    # Carica ticket esistenti
-    tickets = {"aperti": [], "chiusi": [], "statistiche": {}}
-    if os.path.exists(tickets_file):
-        with open(tickets_file, 'r', encoding='utf-8') as f:
-            tickets = json.load(f)
-    
     # Genera motivazione
     motivazioni_map = {
         "Molto Negativo": [
@@ -192,20 +202,12 @@ def create_ticket(
         "data_scadenza": (datetime.now() + timedelta(days=2)).isoformat()
     }
     
-    # Aggiorna statistiche
-    tickets["aperti"].append(ticket)
-    tickets["statistiche"]["totale_ticket"] = tickets["statistiche"].get("totale_ticket", 0) + 1
-    
-    tickets["statistiche"]["ticket_per_ruolo"] = tickets["statistiche"].get("ticket_per_ruolo", {})
-    tickets["statistiche"]["ticket_per_ruolo"][user_role] = tickets["statistiche"]["ticket_per_ruolo"].get(user_role, 0) + 1
-    
-    tickets["statistiche"]["ticket_per_sentimento"] = tickets["statistiche"].get("ticket_per_sentimento", {})
-    tickets["statistiche"]["ticket_per_sentimento"][sentiment] = tickets["statistiche"]["ticket_per_sentimento"].get(sentiment, 0) + 1
-    
-    # Salva ticket
-    os.makedirs(os.path.dirname(tickets_file) or '.', exist_ok=True)
-    with open(tickets_file, 'w', encoding='utf-8') as f:
-        json.dump(tickets, f, ensure_ascii=False, indent=2)
+    # Salva ticket e aggiorna statistiche in un'unica transazione
+    if ticket_store is None:
+        ticket_store = get_ticket_store()
+    with telemetria.span("ticket_store.crea"):
+        ticket_store.crea(ticket)
+    telemetria.incrementa("ticket_totale", sentimento=sentiment, ruolo=user_role)
     
     return ticket
 
@@ -0,0 +1,47 @@
+import os
+import sqlite3
+import threading
+
+
+class SQLiteDB:
+    """
+    Accesso a un database SQLite condiviso tra thread e processi.
+
+    Ogni thread ha la sua connessione; il database usa il journal WAL, così
+    più processi possono leggere mentre uno scrive, e le scritture
+    concorrenti aspettano il lock invece di fallire subito.
+    """
+
+    def __init__(self, path_db: str, schema: str = ""):
+        self.path_db = path_db
+        os.makedirs(os.path.dirname(path_db) or '.', exist_ok=True)
+        self._locale = threading.local()
+        if schema:
+            self.connessione().executescript(schema)
+
+    def connessione(self) -> sqlite3.Connection:
+        conn = getattr(self._locale, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path_db, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._locale.conn = conn
+        return conn
+
+    def transazione(self):
+        """Context manager per una transazione in scrittura (BEGIN IMMEDIATE)."""
+        return _Transazione(self.connessione())
+
+
+class _Transazione:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, tipo, valore, traceback):
+        self.conn.execute("COMMIT" if tipo is None else "ROLLBACK")
+        return False
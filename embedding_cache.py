@@ -0,0 +1,101 @@
+import os
+import sqlite3
+import threading
+import numpy as np
+from cache_utils import LRUCache, normalizza_testo
+
+
+class EmbeddingCache:
+    """
+    Cache degli embedding delle query, con chiave (modello, testo normalizzato).
+
+    Il primo livello è una LRU in memoria; se è indicato `path_db` gli
+    embedding vengono salvati anche in un file SQLite e sopravvivono al
+    riavvio del processo. I vettori sono array float32 di sola lettura,
+    condivisi tra i chiamanti.
+    """
+
+    def __init__(self, max_size: int = 2048, path_db: str = None):
+        self._memoria = LRUCache(max_size)
+        self._lock = threading.Lock()
+        self._db = None
+        self.hits = 0
+        self.hits_disco = 0
+        self.misses = 0
+        if path_db:
+            os.makedirs(os.path.dirname(path_db) or '.', exist_ok=True)
+            self._db = sqlite3.connect(path_db, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "modello TEXT NOT NULL, testo TEXT NOT NULL, vettore BLOB NOT NULL, "
+                "PRIMARY KEY (modello, testo))"
+            )
+            self._db.commit()
+
+    def _leggi_disco(self, modello, testo):
+        if self._db is None:
+            return None
+        with self._lock:
+            riga = self._db.execute(
+                "SELECT vettore FROM embeddings WHERE modello = ? AND testo = ?", (modello, testo)
+            ).fetchone()
+        if riga is None:
+            return None
+        # frombuffer su bytes dà già un array di sola lettura
+        return np.frombuffer(riga[0], dtype=np.float32)
+
+    def _scrivi_disco(self, modello, testo, vettore):
+        if self._db is None:
+            return
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO embeddings (modello, testo, vettore) VALUES (?, ?, ?)",
+                (modello, testo, vettore.tobytes()),
+            )
+            self._db.commit()
+
+    def get(self, testo: str, modello: str):
+        """Restituisce l'embedding in cache o None."""
+        chiave = (modello, normalizza_testo(testo))
+        vettore = self._memoria.get(chiave)
+        if vettore is not None:
+            self._conta("hits")
+            return vettore
+        vettore = self._leggi_disco(*chiave)
+        if vettore is not None:
+            self._conta("hits_disco")
+            self._memoria.put(chiave, vettore)
+            return vettore
+        self._conta("misses")
+        return None
+
+    def _conta(self, contatore: str) -> None:
+        with self._lock:
+            setattr(self, contatore, getattr(self, contatore) + 1)
+
+    def put(self, testo: str, modello: str, vettore) -> np.ndarray:
+        """Salva l'embedding di `testo` e restituisce il vettore come memorizzato."""
+        chiave = (modello, normalizza_testo(testo))
+        vettore = np.array(vettore, dtype=np.float32).reshape(-1)
+        vettore.flags.writeable = False
+        self._memoria.put(chiave, vettore)
+        self._scrivi_disco(*chiave, vettore)
+        return vettore
+
+    def embed(self, testo: str, modello: str, embeddings_model):
+        """
+        Restituisce l'embedding di `testo`, chiamando `embeddings_model`
+        solo in caso di miss. Il testo normalizzato fa solo da chiave: al
+        modello arriva il testo originale, con maiuscole e punteggiatura.
+        """
+        vettore = self.get(testo, modello)
+        if vettore is None:
+            vettore = self.put(testo, modello, embeddings_model.embed_documents([testo])[0])
+        return vettore
+
+    def stats(self) -> dict:
+        """Contatori di hit (memoria e disco) e miss."""
+        with self._lock:
+            statistiche = {"hits": self.hits, "hits_disco": self.hits_disco, "misses": self.misses}
+        statistiche["dimensione"] = len(self._memoria)
+        return statistiche
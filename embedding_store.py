@@ -0,0 +1,116 @@
+import hashlib
+import json
+import os
+import numpy as np
+from similarity import normalizza_righe
+
+
+def percorso_vettori(path_json: str) -> str:
+    """Percorso del file binario dei vettori associato a un file JSON di record."""
+    return os.path.splitext(path_json)[0] + ".npy"
+
+
+def salva_vettori(path_npy: str, vettori) -> None:
+    """
+    Salva i vettori come matrice float32 normalizzata in formato .npy.
+    La scrittura avviene su un file temporaneo per non lasciare file a metà.
+    """
+    matrice = np.asarray(vettori, dtype=np.float32)
+    if matrice.ndim == 1:
+        matrice = matrice.reshape(len(matrice), -1) if matrice.size else matrice.reshape(0, 0)
+    if matrice.size:
+        matrice = normalizza_righe(matrice).astype(np.float32)
+    tmp = path_npy + ".tmp"
+    with open(tmp, "wb") as f:
+        np.save(f, np.ascontiguousarray(matrice))
+    os.replace(tmp, path_npy)
+
+
+def carica_vettori(path_npy: str) -> np.ndarray:
+    """Apre i vettori in memory mapping (sola lettura), senza caricarli in RAM."""
+    return np.load(path_npy, mmap_mode="r")
+
+
+def percorso_manifest(path_json: str) -> str:
+    """Percorso del manifest con gli hash dei testi indicizzati."""
+    return os.path.splitext(path_json)[0] + ".manifest.json"
+
+
+def carica_manifest(path_json: str) -> dict:
+    """
+    Carica il manifest del corpus: modello di embedding e hash del testo di
+    ogni riga del file .npy (nello stesso ordine). Vuoto se non esiste.
+    """
+    path = percorso_manifest(path_json)
+    if not os.path.exists(path):
+        return {"modello": None, "hash": []}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def salva_corpus(path_json: str, records: list, vettori, hashes=None, modello=None) -> None:
+    """
+    Scrive i record testuali nel JSON, i vettori nel file .npy accanto e,
+    se forniti, gli hash dei testi nel manifest.
+    """
+    with open(path_json, "w", encoding="utf-8") as f:
+        json.dump(records, f, indent=4, ensure_ascii=False)
+    salva_vettori(percorso_vettori(path_json), vettori)
+    if hashes is not None:
+        with open(percorso_manifest(path_json), "w", encoding="utf-8") as f:
+            json.dump({"modello": modello, "hash": list(hashes)}, f, indent=4)
+
+
+def carica_corpus(path_json: str, campo_vettore: str):
+    """
+    Carica i record testuali e i relativi embedding normalizzati.
+
+    Args:
+        path_json (str): File JSON con i record (domande, risposte, campi KB)
+        campo_vettore (str): Campo che conteneva il vettore nel vecchio formato
+
+    Returns:
+        tuple: (records, matrice float32 normalizzata)
+    """
+    with open(path_json, "r", encoding="utf-8") as f:
+        records = json.load(f)
+
+    path_npy = percorso_vettori(path_json)
+    if os.path.exists(path_npy):
+        vettori = carica_vettori(path_npy)
+        if vettori.shape[0] != len(records):
+            raise ValueError(
+                f"{path_npy} contiene {vettori.shape[0]} vettori ma {path_json} ha {len(records)} record: rilanciare ingest.py"
+            )
+        return records, vettori
+
+    # Vecchio formato: i vettori sono dentro il JSON
+    vettori = [r.pop(campo_vettore) for r in records]
+    matrice = np.asarray(vettori, dtype=np.float32)
+    if matrice.size:
+        matrice = normalizza_righe(matrice).astype(np.float32)
+    return records, matrice
+
+
+def versione_corpus(*paths_json: str) -> tuple:
+    """
+    Identifica la versione corrente dei corpus (data di modifica dei file
+    .npy): cambia ogni volta che ingest.py li riscrive.
+    """
+    versione = []
+    for path_json in paths_json:
+        path_npy = percorso_vettori(path_json)
+        versione.append(os.stat(path_npy).st_mtime_ns if os.path.exists(path_npy) else None)
+    return tuple(versione)
+
+
+def firma_corpus(path_json: str, n_righe: int) -> str:
+    """
+    Identifica il contenuto del corpus indicizzato (per gli indici derivati
+    dai vettori): hash dei testi del manifest se c'è, altrimenti solo il
+    numero di righe.
+    """
+    hashes = carica_manifest(path_json)["hash"]
+    if len(hashes) != n_righe:
+        return f"righe:{n_righe}"
+    return hashlib.sha256("\n".join(hashes).encode("utf-8")).hexdigest()
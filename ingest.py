@@ -1,7 +1,14 @@
+import hashlib
 import json
 import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 from langchain_openai import OpenAIEmbeddings
 from dotenv import load_dotenv
+from ann import aggiorna_ivf
+from quantizzazione import aggiorna_ridotti
+from embedding_store import carica_manifest, carica_vettori, percorso_vettori, salva_corpus
+from llm_client import BATCH, EMBEDDING_MODEL, imposta_priorita_predefinita, parametri_client
 
 
 def openJson(path_json):
@@ -9,27 +16,96 @@ def openJson(path_json):
         return json.load(f)
 
 
-# Caricamento API Key
-env_loaded = load_dotenv()
-openai_api_key = os.getenv("OPENAI_API_KEY")
+def testo_faq(record: dict) -> str:
+    """Testo da indicizzare per una FAQ: la domanda."""
+    return record["domanda"]
 
 
-faq=openJson("data/faq.json")
-embeddings_model = OpenAIEmbeddings(model="text-embedding-3-large")
-for f in faq:
-    f["dVec"] = embeddings_model.embed_documents([f["domanda"]])[0]
-with open("data/faq.json", "w", encoding="utf-8") as f:
-    json.dump(faq, f, indent=4, ensure_ascii=False)   
+def testo_kb(record: dict) -> str:
+    """Testo da indicizzare per la KB: tutti i campi uniti in una stringa."""
+    return " ".join(f"{key}: {value}," for key, value in record.items() if key != "vec")
 
 
+def hash_testo(testo: str) -> str:
+    return hashlib.sha256(testo.encode("utf-8")).hexdigest()
 
-kb=openJson("data/knowledgeBase.json")
-for f in kb:
-    # Unisci tutti i contenuti in una singola stringa
-    content = " ".join(f"{key}: {value}," for key, value in f.items())
-    # Genera l'embedding    
-    f["vec"] = embeddings_model.embed_documents([content])[0]
 
-# Salva il file aggiornato
-with open("data/knowledgeBase.json", "w", encoding="utf-8") as file:
-    json.dump(kb, file, indent=4, ensure_ascii=False)
+def embed_in_batch(embeddings_model, testi: list, batch_size: int, concorrenza: int) -> list:
+    """
+    Calcola gli embedding di `testi` con chiamate da `batch_size` elementi,
+    al massimo `concorrenza` chiamate in parallelo. L'ordine è preservato.
+    """
+    batch = [testi[i:i + batch_size] for i in range(0, len(testi), batch_size)]
+    with ThreadPoolExecutor(max_workers=max(1, concorrenza)) as executor:
+        risultati = executor.map(embeddings_model.embed_documents, batch)
+    return [vettore for vettori in risultati for vettore in vettori]
+
+
+def aggiorna_corpus(path_json, campo_vettore, testo_fn, embeddings_model, batch_size=256, concorrenza=4):
+    """
+    Aggiorna gli embedding di un corpus in modo incrementale.
+
+    Ricalcola solo i record il cui testo è nuovo o cambiato (confrontando gli
+    hash con il manifest), riusa gli altri vettori e scarta quelli dei record
+    eliminati.
+
+    Returns:
+        int: Numero di testi inviati al modello di embedding
+    """
+    records = openJson(path_json)
+    vettori_json = [r.pop(campo_vettore, None) for r in records]
+    hashes = [hash_testo(testo_fn(r)) for r in records]
+
+    # Vettori già calcolati, indicizzati per hash del testo
+    esistenti = {}
+    manifest = carica_manifest(path_json)
+    path_npy = percorso_vettori(path_json)
+    if manifest["modello"] == EMBEDDING_MODEL and os.path.exists(path_npy):
+        vecchi = carica_vettori(path_npy)
+        if len(manifest["hash"]) == vecchi.shape[0]:
+            esistenti = {h: vecchi[i] for i, h in enumerate(manifest["hash"])}
+    elif manifest["modello"] is None and not os.path.exists(path_npy):
+        # Prima migrazione dal vecchio formato: si riusano i vettori del JSON
+        esistenti = {h: v for h, v in zip(hashes, vettori_json) if v is not None}
+
+    # Testi nuovi o modificati (senza duplicati)
+    da_calcolare = {}
+    for r, h in zip(records, hashes):
+        if h not in esistenti and h not in da_calcolare:
+            da_calcolare[h] = testo_fn(r)
+
+    if not da_calcolare and hashes == manifest["hash"]:
+        print(f"{path_json}: nessuna modifica")
+        return 0
+
+    nuovi = embed_in_batch(embeddings_model, list(da_calcolare.values()), batch_size, concorrenza)
+    esistenti.update(zip(da_calcolare.keys(), nuovi))
+
+    vettori = np.array([esistenti[h] for h in hashes], dtype=np.float32)
+    salva_corpus(path_json, records, vettori, hashes=hashes, modello=EMBEDDING_MODEL)
+    print(f"{path_json}: {len(da_calcolare)} embedding calcolati, {len(records)} record totali")
+    return len(da_calcolare)
+
+
+if __name__ == "__main__":
+    # Caricamento API Key
+    env_loaded = load_dotenv()
+    openai_api_key = os.getenv("OPENAI_API_KEY")
+    batch_size = int(os.getenv("INGEST_BATCH_SIZE", "256"))
+    concorrenza = int(os.getenv("INGEST_CONCORRENZA", "4"))
+
+    # Client HTTP condiviso (limiti, nuovi tentativi), con priorità batch
+    imposta_priorita_predefinita(BATCH)
+    embeddings_model = OpenAIEmbeddings(model=EMBEDDING_MODEL, chunk_size=batch_size, **parametri_client())
+
+    # I vettori vanno nei file .npy, i JSON contengono solo i record testuali
+    aggiorna_corpus("data/faq.json", "dVec", testo_faq, embeddings_model, batch_size, concorrenza)
+    aggiorna_corpus("data/knowledgeBase.json", "vec", testo_kb, embeddings_model, batch_size, concorrenza)
+
+    # Indici approssimati (IVF) per i corpus con almeno ANN_MIN_RIGHE righe
+    aggiorna_ivf("data/faq.json")
+    aggiorna_ivf("data/knowledgeBase.json")
+
+    # Vettori ridotti per la prima passata (EMBEDDING_DIM_RIDOTTA / EMBEDDING_INT8)
+    aggiorna_ridotti("data/faq.json")
+    aggiorna_ridotti("data/knowledgeBase.json")
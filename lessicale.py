@@ -0,0 +1,193 @@
+import math
+import re
+import unicodedata
+import numpy as np
+
+# Indice lessicale BM25 per FAQ e Knowledge Base, con normalizzazione per
+# l'italiano: accenti, elisioni ("l'account"), parole vuote e uno stemming
+# leggero sulle desinenze. I codici prodotto (es. "TA-1200") restano interi
+# e vengono indicizzati anche a pezzi.
+
+PAROLE_VUOTE = frozenset("""
+a ad al allo ai agli all alla alle anche che chi ci come con col coi cosa cui da dal dallo dai dagli dall
+dalla dalle del dello dei degli dell della delle di dove e ed gli ha hanno ho i il in io la le lei lo loro
+lui ma mi mia mie miei mio ne negli nel nello nei nell nella nelle no noi non o per perche piu puo quale
+quali quando quanto quella quelle quelli quello questa queste questi questo se si sia sono su sul sullo
+sui sugli sull sulla sulle suo sua suoi sue ti tra fra tu tua tue tuo tuoi un una uno vi voi vorrei posso
+essere sono e stato stata fare faccio fa devo
+""".split())
+
+# Desinenze rimosse dallo stemming, dalla più lunga
+_DESINENZE = ("amento", "amenti", "azione", "azioni", "mente", "are", "ere", "ire", "ato", "ata", "ati", "ate",
+              "ito", "ita", "iti", "ite", "uto", "uta", "uti", "ute")
+_RE_TOKEN = re.compile(r"[a-z0-9]+(?:[-./][a-z0-9]+)*")
+
+
+def _senza_accenti(testo: str) -> str:
+    decomposto = unicodedata.normalize("NFKD", testo)
+    return "".join(c for c in decomposto if not unicodedata.combining(c))
+
+
+def radice(parola: str) -> str:
+    """Stemming leggero: toglie una desinenza verbale/nominale o la vocale finale."""
+    if not parola.isalpha() or len(parola) <= 3:
+        return parola
+    for desinenza in _DESINENZE:
+        if parola.endswith(desinenza) and len(parola) - len(desinenza) >= 3:
+            return parola[:-len(desinenza)]
+    if parola[-1] in "aeiou":
+        return parola[:-1]
+    return parola
+
+
+def tokenizza(testo: str) -> list:
+    """
+    Token normalizzati di `testo`: minuscole senza accenti, senza parole
+    vuote, con radice. I codici con separatori restano un token unico più
+    i singoli pezzi.
+    """
+    testo = _senza_accenti(str(testo).lower()).replace("'", " ").replace("’", " ")
+    token = []
+    for parola in _RE_TOKEN.findall(testo):
+        # Parole vuote e lettere isolate delle elisioni ("l'", "d'")
+        if parola in PAROLE_VUOTE or (len(parola) == 1 and parola.isalpha()):
+            continue
+        if not parola.isalnum():
+            token.append(parola)
+            token.extend(pezzo for pezzo in re.split(r"[-./]", parola) if pezzo not in PAROLE_VUOTE)
+        else:
+            token.append(radice(parola))
+    return token
+
+
+class BM25Index:
+    """
+    Indice invertito BM25 su una lista di testi.
+
+    Per ogni termine tiene gli id dei documenti e il peso BM25 già calcolato,
+    così una query costa una somma di array per termine. Conserva anche il
+    punteggio massimo di ogni documento (la query che ne contiene tutti i
+    termini), per capire quanto una query lo copre.
+    """
+
+    def __init__(self, testi: list, k1: float = 1.5, b: float = 0.75):
+        documenti = [tokenizza(t) for t in testi]
+        self.n = len(documenti)
+        lunghezze = np.array([len(d) for d in documenti], dtype=np.float32)
+        media = float(lunghezze.mean()) if self.n and lunghezze.mean() > 0 else 1.0
+
+        frequenze = {}
+        for doc_id, doc in enumerate(documenti):
+            conteggi = {}
+            for termine in doc:
+                conteggi[termine] = conteggi.get(termine, 0) + 1
+            for termine, tf in conteggi.items():
+                frequenze.setdefault(termine, ([], []))
+                frequenze[termine][0].append(doc_id)
+                frequenze[termine][1].append(tf)
+
+        self.idf = {}
+        self.postings = {}
+        self.massimi = np.zeros(self.n, dtype=np.float32)
+        for termine, (ids, tfs) in frequenze.items():
+            ids = np.array(ids, dtype=np.int32)
+            tfs = np.array(tfs, dtype=np.float32)
+            idf = math.log(1.0 + (self.n - len(ids) + 0.5) / (len(ids) + 0.5))
+            pesi = idf * tfs * (k1 + 1) / (tfs + k1 * (1 - b + b * lunghezze[ids] / media))
+            self.idf[termine] = idf
+            self.postings[termine] = (ids, pesi.astype(np.float32))
+            self.massimi[ids] += pesi
+
+    def __len__(self):
+        return self.n
+
+    def punteggi(self, testo: str) -> np.ndarray:
+        """Punteggi BM25 di tutti i documenti per la query `testo`."""
+        punteggi = np.zeros(self.n, dtype=np.float32)
+        for termine in set(tokenizza(testo)):
+            posting = self.postings.get(termine)
+            if posting is not None:
+                punteggi[posting[0]] += posting[1]
+        return punteggi
+
+    def cerca(self, testo: str, k: int = 10):
+        """Coppie (indice, punteggio) dei `k` documenti migliori con punteggio > 0."""
+        return self._top_k(self.punteggi(testo), k)
+
+    def _top_k(self, punteggi: np.ndarray, k: int):
+        if not self.n or k <= 0:
+            return []
+        k = min(k, self.n)
+        candidati = np.argpartition(-punteggi, k - 1)[:k] if k < self.n else np.arange(self.n)
+        ordinati = candidati[np.argsort(-punteggi[candidati])]
+        return [(int(i), float(punteggi[i])) for i in ordinati if punteggi[i] > 0]
+
+    def copertura(self, testo: str, indice: int) -> tuple:
+        """
+        (copertura del documento, copertura della query) tra 0 e 1: quota del
+        punteggio massimo del documento raggiunta e quota dell'idf della query
+        presente nel documento.
+        """
+        termini = set(tokenizza(testo))
+        punteggio, idf_query, idf_comune = 0.0, 0.0, 0.0
+        for termine in termini:
+            # I termini che non compaiono nel corpus pesano come i più rari
+            idf = self.idf.get(termine, math.log(1.0 + (self.n + 0.5) / 0.5))
+            idf_query += idf
+            posting = self.postings.get(termine)
+            if posting is None:
+                continue
+            posizione = np.searchsorted(posting[0], indice)
+            if posizione < len(posting[0]) and posting[0][posizione] == indice:
+                punteggio += float(posting[1][posizione])
+                idf_comune += idf
+        massimo = float(self.massimi[indice]) if self.n else 0.0
+        return (punteggio / massimo if massimo > 0 else 0.0,
+                idf_comune / idf_query if idf_query > 0 else 0.0)
+
+    def match_sicuro(self, testo: str, soglia: float = 0.8, margine: float = 1.5):
+        """
+        Il documento che la query identifica senza ambiguità, o None.
+
+        Serve che query e documento si coprano a vicenda almeno per `soglia`
+        e che il primo punteggio superi il secondo di almeno `margine` volte.
+
+        Returns:
+            tuple or None: (indice, copertura minima)
+        """
+        top = self.cerca(testo, 2)
+        if not top:
+            return None
+        if len(top) > 1 and top[0][1] < margine * top[1][1]:
+            return None
+        copertura = min(self.copertura(testo, top[0][0]))
+        if copertura < soglia:
+            return None
+        return top[0][0], copertura
+
+
+def testo_record(record: dict) -> str:
+    """Testo indicizzato per un record KB: i valori di tutti i campi (liste comprese)."""
+    valori = []
+    for campo, valore in record.items():
+        if campo == "vec":
+            continue
+        if isinstance(valore, (list, tuple)):
+            valori.extend(str(v) for v in valore)
+        elif isinstance(valore, dict):
+            valori.extend(str(v) for v in valore.values())
+        else:
+            valori.append(str(valore))
+    return " ".join(valori)
+
+
+def fusione_rrf(*classifiche, k: int = 60) -> list:
+    """
+    Reciprocal rank fusion: unisce più classifiche di coppie (indice, punteggio)
+    e restituisce gli indici ordinati per somma di 1 / (k + posizione).
+    """
+    punteggi = {}
+    for classifica in classifiche:
+        for posizione, (indice, _) in enumerate(classifica):
+            punteggi[indice] = punteggi.get(indice, 0.0) + 1.0 / (k + posizione + 1)
+    return sorted(punteggi, key=punteggi.get, reverse=True)
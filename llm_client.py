@@ -0,0 +1,478 @@
+import asyncio
+import contextvars
+import json
+import os
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+import httpx
+from dotenv import load_dotenv
+from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+from embedding_cache import EmbeddingCache
+from rate_limit import LimiteAdattivo, TokenBucket, attesa_backoff
+import telemetria
+
+# Livello client condiviso da agenti e tool: tutte le chiamate HTTP verso
+# l'API (chat ed embedding) passano da un unico trasporto httpx che riusa le
+# connessioni e, per ogni endpoint, applica:
+# - token bucket su richieste/minuto e token/minuto (stimati dal corpo),
+#   con una riserva che il traffico batch non può consumare;
+# - limite di concorrenza adattivo (AIMD) guidato da 429 e latenza;
+# - nuovi tentativi con backoff esponenziale e jitter (o Retry-After);
+# - priorità: il traffico interattivo passa prima di quello batch.
+#
+# LLM_BASE_URL punta il client a un altro server compatibile (es. il server
+# finto di bench_stubs.StubOpenAIServer).
+
+load_dotenv()
+
+EMBEDDING_MODEL = "text-embedding-3-large"
+
+LLM_BASE_URL = os.getenv("LLM_BASE_URL") or None
+# Limiti per endpoint (0 = nessun limite)
+RICHIESTE_MINUTO = float(os.getenv("LLM_RICHIESTE_MINUTO", "0"))
+TOKEN_MINUTO = float(os.getenv("LLM_TOKEN_MINUTO", "0"))
+# Concorrenza adattiva
+CONCORRENZA_INIZIALE = int(os.getenv("LLM_CONCORRENZA_INIZIALE", "8"))
+CONCORRENZA_MIN = int(os.getenv("LLM_CONCORRENZA_MIN", "1"))
+CONCORRENZA_MAX = int(os.getenv("LLM_CONCORRENZA_MAX", "64"))
+# Secondi fino agli header oltre i quali la risposta conta come sovraccarico (0 = solo i 429)
+LATENZA_OBIETTIVO = float(os.getenv("LLM_LATENZA_OBIETTIVO", "0"))
+MAX_TENTATIVI = int(os.getenv("LLM_MAX_TENTATIVI", "4"))
+BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "30"))
+TIMEOUT = float(os.getenv("LLM_TIMEOUT", "120"))
+# Token di risposta stimati per le chiamate chat senza max_tokens
+TOKEN_RISPOSTA = int(os.getenv("LLM_TOKEN_RISPOSTA", "500"))
+# Quota dei token bucket tenuta per le chiamate interattive: il batch si ferma prima
+RISERVA_INTERATTIVA = float(os.getenv("LLM_RISERVA_INTERATTIVA", "0.2"))
+
+# Priorità delle chiamate (valore più basso = servita prima)
+INTERATTIVA = 0
+BATCH = 1
+
+# Codici per cui la richiesta viene ripetuta (come l'SDK OpenAI)
+_STATI_RIPETIBILI = {408, 409, 429}
+
+_lock = threading.RLock()
+_llm = None
+_embeddings_model = None
+_embedding_cache = None
+_http_client = None
+_http_async_client = None
+_trasporto_async = None
+_limiti = {}
+
+_priorita = contextvars.ContextVar("priorita_llm", default=None)
+_priorita_predefinita = INTERATTIVA
+
+
+@contextmanager
+def con_priorita(livello: int):
+    """Le chiamate fatte nel blocco (anche da asyncio.to_thread) hanno priorità `livello`."""
+    token = _priorita.set(livello)
+    try:
+        yield
+    finally:
+        _priorita.reset(token)
+
+
+def imposta_priorita_predefinita(livello: int) -> None:
+    """Priorità delle chiamate fuori da con_priorita (es. BATCH per ingest.py)."""
+    global _priorita_predefinita
+    _priorita_predefinita = livello
+
+
+def priorita_corrente() -> int:
+    livello = _priorita.get()
+    return _priorita_predefinita if livello is None else livello
+
+
+def stima_token(corpo: bytes) -> int:
+    """Token stimati di una richiesta chat o embedding (circa 4 caratteri per token)."""
+    try:
+        dati = json.loads(corpo)
+    except ValueError:
+        return 0
+    if not isinstance(dati, dict):
+        return 0
+    if "messages" in dati:
+        caratteri = sum(len(str(m.get("content") or "")) for m in dati["messages"])
+        risposta = dati.get("max_completion_tokens") or dati.get("max_tokens") or TOKEN_RISPOSTA
+        return caratteri // 4 + risposta
+    voci = dati.get("input", [])
+    if isinstance(voci, str) or (voci and isinstance(voci[0], int)):
+        voci = [voci]
+    # OpenAIEmbeddings manda liste di id di token già calcolati
+    return sum(len(v) if isinstance(v, list) else len(str(v)) // 4 for v in voci)
+
+
+class LimitiEndpoint:
+    """
+    Limiti di un endpoint dell'API: token bucket e concorrenza adattiva.
+    Entrambi rispettano la priorità: la coda della concorrenza serve prima
+    le chiamate interattive e i bucket tengono loro una riserva
+    (RISERVA_INTERATTIVA) che le chiamate batch non possono usare.
+    """
+
+    def __init__(self, richieste_minuto: float = RICHIESTE_MINUTO, token_minuto: float = TOKEN_MINUTO,
+                 riserva: float = RISERVA_INTERATTIVA):
+        # Capienza = un minuto di richieste/token, come le finestre dell'API
+        self.richieste = TokenBucket(richieste_minuto / 60, richieste_minuto, riserva) if richieste_minuto > 0 else None
+        self.token = TokenBucket(token_minuto / 60, token_minuto, riserva) if token_minuto > 0 else None
+        self.concorrenza = LimiteAdattivo(CONCORRENZA_INIZIALE, CONCORRENZA_MIN, CONCORRENZA_MAX,
+                                          LATENZA_OBIETTIVO or None)
+
+    def _token(self, n: int) -> float:
+        # Una richiesta più grande della capienza aspetterebbe per sempre
+        return min(n, self.token.capacita)
+
+    def acquisisci(self, token: int) -> None:
+        priorita = priorita_corrente()
+        self.concorrenza.acquisisci(priorita)
+        try:
+            if self.richieste is not None:
+                self.richieste.acquisisci(1.0, priorita)
+            if self.token is not None and token:
+                self.token.acquisisci(self._token(token), priorita)
+        except BaseException:
+            self.concorrenza.rilascia()
+            raise
+
+    async def aacquisisci(self, token: int) -> None:
+        priorita = priorita_corrente()
+        await self.concorrenza.aacquisisci(priorita)
+        try:
+            if self.richieste is not None:
+                await self.richieste.aacquisisci(1.0, priorita)
+            if self.token is not None and token:
+                await self.token.aacquisisci(self._token(token), priorita)
+        except BaseException:
+            self.concorrenza.rilascia()
+            raise
+
+    def stats(self) -> dict:
+        return {
+            "limite": self.concorrenza.limite,
+            "in_corso": self.concorrenza.in_corso,
+            "in_attesa": self.concorrenza.in_attesa,
+            "riduzioni": self.concorrenza.riduzioni,
+        }
+
+
+def _nome_endpoint(request: httpx.Request) -> str:
+    """Endpoint della richiesta (es. "chat/completions", "embeddings")."""
+    percorso = request.url.path.rstrip("/")
+    for nome in ("chat/completions", "embeddings", "completions"):
+        if percorso.endswith(nome):
+            return nome
+    return percorso.rsplit("/", 1)[-1] or "altro"
+
+
+def get_limiti(endpoint: str) -> LimitiEndpoint:
+    with _lock:
+        limiti = _limiti.get(endpoint)
+        if limiti is None:
+            limiti = _limiti[endpoint] = LimitiEndpoint()
+        return limiti
+
+
+def _stats_limiti() -> dict:
+    with _lock:
+        limiti = dict(_limiti)
+    return {f"{endpoint}.{chiave}": valore
+            for endpoint, l in limiti.items() for chiave, valore in l.stats().items()}
+
+
+def _attesa_ritentativo(risposta: httpx.Response, tentativo: int) -> float:
+    """Secondi prima del nuovo tentativo: Retry-After del server se c'è, altrimenti backoff con jitter."""
+    if risposta is not None:
+        for header, scala in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+            try:
+                return min(BACKOFF_MAX, float(risposta.headers[header]) * scala)
+            except (KeyError, ValueError):
+                pass
+    return attesa_backoff(tentativo, BACKOFF_BASE, BACKOFF_MAX)
+
+
+def _esito(endpoint: str, esito: str, latenza: float = None) -> None:
+    telemetria.incrementa("llm_http_totale", endpoint=endpoint, esito=esito)
+    if latenza is not None:
+        telemetria.osserva("llm_http_secondi", latenza, endpoint=endpoint)
+
+
+class _StreamSync(httpx.SyncByteStream):
+    """Corpo della risposta che restituisce il posto di concorrenza quando viene chiuso."""
+
+    def __init__(self, stream, rilascia):
+        self._stream = stream
+        self._rilascia = rilascia
+
+    def __iter__(self):
+        yield from self._stream
+
+    def close(self):
+        try:
+            self._stream.close()
+        finally:
+            self._rilascia()
+
+
+class _StreamAsync(httpx.AsyncByteStream):
+    def __init__(self, stream, rilascia):
+        self._stream = stream
+        self._rilascia = rilascia
+
+    async def __aiter__(self):
+        async for blocco in self._stream:
+            yield blocco
+
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            self._rilascia()
+
+
+def _rilascio_unico(limiti: LimitiEndpoint):
+    """Funzione che rilascia il posto una sola volta (la chiusura può arrivare più volte)."""
+    fatto = threading.Lock()
+
+    def rilascia():
+        if fatto.acquire(blocking=False):
+            limiti.concorrenza.rilascia()
+    return rilascia
+
+
+def _con_stream(risposta: httpx.Response, request: httpx.Request, stream) -> httpx.Response:
+    return httpx.Response(risposta.status_code, headers=risposta.headers, stream=stream,
+                          extensions=risposta.extensions, request=request)
+
+
+class TrasportoLimitato(httpx.BaseTransport):
+    """Trasporto httpx sincrono con limiti, concorrenza adattiva e nuovi tentativi."""
+
+    def __init__(self, interno: httpx.BaseTransport = None):
+        self._interno = interno or httpx.HTTPTransport(
+            limits=httpx.Limits(max_connections=CONCORRENZA_MAX, max_keepalive_connections=CONCORRENZA_MAX))
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        endpoint = _nome_endpoint(request)
+        limiti = get_limiti(endpoint)
+        token = stima_token(request.read())
+        for tentativo in range(MAX_TENTATIVI):
+            limiti.acquisisci(token)
+            rilascia = _rilascio_unico(limiti)
+            inizio = time.monotonic()
+            try:
+                risposta = self._interno.handle_request(request)
+            except httpx.TransportError:
+                rilascia()
+                _esito(endpoint, "errore")
+                if tentativo + 1 >= MAX_TENTATIVI:
+                    raise
+                limiti.concorrenza.sovraccarico()
+                time.sleep(_attesa_ritentativo(None, tentativo))
+                continue
+            except BaseException:
+                rilascia()
+                raise
+            latenza = time.monotonic() - inizio
+            ripetibile = risposta.status_code in _STATI_RIPETIBILI or risposta.status_code >= 500
+            _esito(endpoint, str(risposta.status_code), latenza)
+            if ripetibile and tentativo + 1 < MAX_TENTATIVI:
+                risposta.close()
+                rilascia()
+                if risposta.status_code == 429:
+                    limiti.concorrenza.sovraccarico()
+                telemetria.incrementa("llm_ritentativi_totale", endpoint=endpoint, stato=str(risposta.status_code))
+                time.sleep(_attesa_ritentativo(risposta, tentativo))
+                continue
+            if risposta.status_code == 429:
+                limiti.concorrenza.sovraccarico()
+            elif risposta.status_code < 400:
+                limiti.concorrenza.successo(latenza)
+            return _con_stream(risposta, request, _StreamSync(risposta.stream, rilascia))
+
+    def close(self) -> None:
+        self._interno.close()
+
+
+class TrasportoLimitatoAsync(httpx.AsyncBaseTransport):
+    """
+    Come TrasportoLimitato, per il client asincrono. Le connessioni sono
+    legate all'event loop: il trasporto interno viene creato per ogni loop
+    e va chiuso con chiudi_loop prima che il loop termini (vedi esegui).
+    """
+
+    def __init__(self, crea_interno=None):
+        self._crea_interno = crea_interno or (lambda: httpx.AsyncHTTPTransport(
+            limits=httpx.Limits(max_connections=CONCORRENZA_MAX, max_keepalive_connections=CONCORRENZA_MAX)))
+        self._interni = weakref.WeakKeyDictionary()
+
+    def _interno(self) -> httpx.AsyncBaseTransport:
+        loop = asyncio.get_running_loop()
+        interno = self._interni.get(loop)
+        if interno is None:
+            interno = self._interni[loop] = self._crea_interno()
+        return interno
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        endpoint = _nome_endpoint(request)
+        limiti = get_limiti(endpoint)
+        token = stima_token(await request.aread())
+        for tentativo in range(MAX_TENTATIVI):
+            await limiti.aacquisisci(token)
+            rilascia = _rilascio_unico(limiti)
+            inizio = time.monotonic()
+            try:
+                risposta = await self._interno().handle_async_request(request)
+            except httpx.TransportError:
+                rilascia()
+                _esito(endpoint, "errore")
+                if tentativo + 1 >= MAX_TENTATIVI:
+                    raise
+                limiti.concorrenza.sovraccarico()
+                await asyncio.sleep(_attesa_ritentativo(None, tentativo))
+                continue
+            except BaseException:
+                rilascia()
+                raise
+            latenza = time.monotonic() - inizio
+            ripetibile = risposta.status_code in _STATI_RIPETIBILI or risposta.status_code >= 500
+            _esito(endpoint, str(risposta.status_code), latenza)
+            if ripetibile and tentativo + 1 < MAX_TENTATIVI:
+                await risposta.aclose()
+                rilascia()
+                if risposta.status_code == 429:
+                    limiti.concorrenza.sovraccarico()
+                telemetria.incrementa("llm_ritentativi_totale", endpoint=endpoint, stato=str(risposta.status_code))
+                await asyncio.sleep(_attesa_ritentativo(risposta, tentativo))
+                continue
+            if risposta.status_code == 429:
+                limiti.concorrenza.sovraccarico()
+            elif risposta.status_code < 400:
+                limiti.concorrenza.successo(latenza)
+            return _con_stream(risposta, request, _StreamAsync(risposta.stream, rilascia))
+
+    async def chiudi_loop(self) -> None:
+        """Chiude le connessioni aperte dal loop corrente."""
+        interno = self._interni.pop(asyncio.get_running_loop(), None)
+        if interno is not None:
+            await interno.aclose()
+
+    async def aclose(self) -> None:
+        # I trasporti di altri loop si possono chiudere solo dal loro loop
+        await self.chiudi_loop()
+
+
+def get_http_client() -> httpx.Client:
+    """Client httpx sincrono condiviso (connessioni riusate tra chat ed embedding)."""
+    global _http_client
+    with _lock:
+        if _http_client is None:
+            _http_client = httpx.Client(transport=TrasportoLimitato(), timeout=TIMEOUT)
+            telemetria.registra_collettore("llm_concorrenza", _stats_limiti)
+        return _http_client
+
+
+def get_http_async_client() -> httpx.AsyncClient:
+    """Client httpx asincrono condiviso."""
+    global _http_async_client, _trasporto_async
+    with _lock:
+        if _http_async_client is None:
+            _trasporto_async = TrasportoLimitatoAsync()
+            _http_async_client = httpx.AsyncClient(transport=_trasporto_async, timeout=TIMEOUT)
+            telemetria.registra_collettore("llm_concorrenza", _stats_limiti)
+        return _http_async_client
+
+
+async def chiudi_connessioni_loop() -> None:
+    """Chiude le connessioni del client asincrono aperte dal loop corrente."""
+    if _trasporto_async is not None:
+        await _trasporto_async.chiudi_loop()
+
+
+def esegui(coro):
+    """
+    asyncio.run per i percorsi sincroni: prima che il loop termini chiude
+    le connessioni che il client asincrono ha aperto su quel loop, che
+    altrimenti resterebbero appese a un loop chiuso a ogni chiamata.
+    """
+    async def _esegui():
+        try:
+            return await coro
+        finally:
+            await chiudi_connessioni_loop()
+    return asyncio.run(_esegui())
+
+
+def parametri_client() -> dict:
+    """
+    Parametri comuni per ChatOpenAI e OpenAIEmbeddings: client HTTP
+    condivisi, base_url e nessun tentativo nell'SDK (li fa il trasporto).
+    """
+    parametri = {
+        "http_client": get_http_client(),
+        "http_async_client": get_http_async_client(),
+        "max_retries": 0,
+    }
+    if LLM_BASE_URL:
+        parametri["base_url"] = LLM_BASE_URL
+    return parametri
+
+
+def get_llm() -> ChatOpenAI:
+    """Client chat condiviso (modello da MODELLO), creato una sola volta per processo."""
+    global _llm
+    with _lock:
+        if _llm is None:
+            _llm = ChatOpenAI(model_name=os.getenv("MODELLO"), api_key=os.getenv("OPENAI_API_KEY"),
+                              **parametri_client())
+        return _llm
+
+
+def get_embeddings_model() -> OpenAIEmbeddings:
+    """Client di embedding condiviso, creato una sola volta per processo."""
+    global _embeddings_model
+    with _lock:
+        if _embeddings_model is None:
+            _embeddings_model = OpenAIEmbeddings(model=EMBEDDING_MODEL, **parametri_client())
+        return _embeddings_model
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    """
+    Cache degli embedding delle query condivisa.
+    EMBEDDING_CACHE_SIZE imposta la dimensione della LRU, EMBEDDING_CACHE_DB
+    (opzionale) il file SQLite per la persistenza su disco.
+    """
+    global _embedding_cache
+    with _lock:
+        if _embedding_cache is None:
+            _embedding_cache = EmbeddingCache(
+                max_size=int(os.getenv("EMBEDDING_CACHE_SIZE", "2048")),
+                path_db=os.getenv("EMBEDDING_CACHE_DB") or None,
+            )
+            telemetria.registra_collettore("cache_embedding", _embedding_cache.stats)
+        return _embedding_cache
+
+
+def imposta_client(llm=None, embeddings_model=None) -> None:
+    """
+    Sostituisce i client condivisi (es. con modelli finti per test e
+    benchmark). La cache degli embedding viene ricreata.
+    """
+    global _llm, _embeddings_model, _embedding_cache
+    with _lock:
+        if llm is not None:
+            _llm = llm
+        if embeddings_model is not None:
+            _embeddings_model = embeddings_model
+        _embedding_cache = None
+
+
+def embed_query(testo: str):
+    """Embedding di una query, passando dalla cache."""
+    return get_embedding_cache().embed(testo, EMBEDDING_MODEL, get_embeddings_model())
@@ -1,14 +1,9 @@
-from langchain_openai import ChatOpenAI
 from langchain.schema import HumanMessage
 from langchain.prompts import PromptTemplate
-import os
-from dotenv import load_dotenv
+from llm_client import get_llm
 
-# Carica le variabili d'ambiente
-load_dotenv()
-openai_api_key = os.getenv("OPENAI_API_KEY")
-model = os.getenv("MODELLO")
-chat = ChatOpenAI(model_name=model, api_key=openai_api_key)
+# Client condiviso (variabili d'ambiente caricate da llm_client)
+chat = get_llm()
 
 query = "ciao,dimmi un curiosita"
 prompt = PromptTemplate.from_template("Fornisci una risposta utilizzando un linguaggio per bambini alla seguente domanda {question}")
@@ -0,0 +1,352 @@
+import argparse
+import glob
+import json
+import os
+import re
+import threading
+from db import SQLiteDB
+
+DEFAULT_DB = "data/conversation_memory.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS interazioni (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    conversation_id TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    user_query TEXT,
+    ai_response TEXT,
+    user_role TEXT,
+    sentiment TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_interazioni_conversazione ON interazioni (conversation_id, id);
+CREATE TABLE IF NOT EXISTS conversazioni (
+    conversation_id TEXT PRIMARY KEY,
+    turni INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS riepiloghi (
+    conversation_id TEXT PRIMARY KEY,
+    inizio TEXT NOT NULL,
+    fine TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sentimenti_conversazione (
+    conversation_id TEXT NOT NULL,
+    sentiment TEXT NOT NULL,
+    n INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (conversation_id, sentiment)
+);
+CREATE TABLE IF NOT EXISTS statistiche_giornaliere (
+    giorno TEXT NOT NULL,
+    user_role TEXT NOT NULL,
+    sentiment TEXT NOT NULL,
+    n INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (giorno, user_role, sentiment)
+);
+"""
+
+# Raggruppamenti ammessi da MemoryStore.statistiche
+_DIMENSIONI = {
+    "giorno": "giorno",
+    "mese": "substr(giorno, 1, 7)",
+    "user_role": "user_role",
+    "sentiment": "sentiment",
+}
+
+_CAMPI = ("timestamp", "user_query", "ai_response", "user_role", "sentiment")
+
+
+class MemoryStore:
+    """
+    Memoria delle conversazioni su SQLite.
+
+    Ogni interazione è una riga: aggiungere un turno e leggere gli ultimi N
+    costa lo stesso indipendentemente dalla lunghezza della conversazione.
+    I vecchi file `conversation_memory_{id}.json` vengono importati alla
+    prima richiesta sulla conversazione e rinominati in `.migrato`.
+
+    Gli aggregati (periodo e sentimenti di ogni conversazione, conteggi per
+    giorno, ruolo e sentimento di tutte le conversazioni) sono contatori
+    aggiornati nella stessa transazione dell'interazione, così riepiloghi e
+    statistiche non rileggono le storie.
+    """
+
+    def __init__(self, path_db: str = DEFAULT_DB, cartella_legacy: str = "data"):
+        self.db = SQLiteDB(path_db, SCHEMA)
+        self.cartella_legacy = cartella_legacy
+        self._verificate = set()
+        self._lock = threading.Lock()
+        # Database creato prima degli aggregati: si calcolano una volta dalle interazioni
+        if self._aggregati_mancanti(self.db.connessione()):
+            self.ricostruisci_aggregati()
+
+    def _path_legacy(self, conversation_id: str) -> str:
+        return os.path.join(self.cartella_legacy, f"conversation_memory_{conversation_id}.json")
+
+    def _migra_se_necessario(self, conversation_id: str) -> None:
+        if conversation_id in self._verificate:
+            return
+        with self._lock:
+            if conversation_id in self._verificate:
+                return
+            path_json = self._path_legacy(conversation_id)
+            if os.path.exists(path_json):
+                self.migra_json(conversation_id, path_json)
+            self._verificate.add(conversation_id)
+
+    def migra_json(self, conversation_id: str, path_json: str) -> int:
+        """
+        Importa un file di memoria nel vecchio formato JSON e lo rinomina.
+
+        Returns:
+            int: Numero di interazioni importate
+        """
+        try:
+            with open(path_json, 'r', encoding='utf-8') as f:
+                memory = json.load(f)
+        except FileNotFoundError:
+            return 0
+        memory.sort(key=lambda x: x["timestamp"])
+        with self.db.transazione() as conn:
+            # Un altro processo potrebbe averlo già migrato
+            if not os.path.exists(path_json):
+                return 0
+            for interaction in memory:
+                self._inserisci(conn, conversation_id, interaction)
+            os.replace(path_json, path_json + ".migrato")
+        return len(memory)
+
+    def migra_tutto(self) -> int:
+        """Importa tutti i file `conversation_memory_*.json` della cartella legacy."""
+        totale = 0
+        for path_json in glob.glob(os.path.join(self.cartella_legacy, "conversation_memory_*.json")):
+            conversation_id = re.match(r"conversation_memory_(.*)\.json$", os.path.basename(path_json)).group(1)
+            totale += self.migra_json(conversation_id, path_json)
+        return totale
+
+    def _inserisci(self, conn, conversation_id: str, interaction: dict) -> int:
+        conn.execute(
+            "INSERT INTO interazioni (conversation_id, timestamp, user_query, ai_response, user_role, sentiment) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (conversation_id, *(interaction.get(campo) for campo in _CAMPI)),
+        )
+        conn.execute(
+            "INSERT INTO conversazioni (conversation_id, turni) VALUES (?, 1) "
+            "ON CONFLICT(conversation_id) DO UPDATE SET turni = turni + 1",
+            (conversation_id,),
+        )
+        self._aggiorna_aggregati(conn, conversation_id, interaction)
+        return conn.execute(
+            "SELECT turni FROM conversazioni WHERE conversation_id = ?", (conversation_id,)
+        ).fetchone()[0]
+
+    def _aggiorna_aggregati(self, conn, conversation_id: str, interaction: dict) -> None:
+        timestamp = interaction["timestamp"]
+        sentimento = interaction.get("sentiment") or ""
+        conn.execute(
+            "INSERT INTO riepiloghi (conversation_id, inizio, fine) VALUES (?, ?, ?) "
+            "ON CONFLICT(conversation_id) DO UPDATE SET "
+            "inizio = min(inizio, excluded.inizio), fine = max(fine, excluded.fine)",
+            (conversation_id, timestamp, timestamp),
+        )
+        conn.execute(
+            "INSERT INTO sentimenti_conversazione (conversation_id, sentiment, n) VALUES (?, ?, 1) "
+            "ON CONFLICT(conversation_id, sentiment) DO UPDATE SET n = n + 1",
+            (conversation_id, sentimento),
+        )
+        conn.execute(
+            "INSERT INTO statistiche_giornaliere (giorno, user_role, sentiment, n) VALUES (?, ?, ?, 1) "
+            "ON CONFLICT(giorno, user_role, sentiment) DO UPDATE SET n = n + 1",
+            (timestamp[:10], interaction.get("user_role") or "", sentimento),
+        )
+
+    @staticmethod
+    def _aggregati_mancanti(conn) -> bool:
+        conversazioni = conn.execute("SELECT COUNT(*) FROM conversazioni").fetchone()[0]
+        return conversazioni != conn.execute("SELECT COUNT(*) FROM riepiloghi").fetchone()[0]
+
+    def ricostruisci_aggregati(self) -> None:
+        """Ricalcola tutti gli aggregati dalle interazioni salvate (una query per tabella)."""
+        with self.db.transazione() as conn:
+            conn.execute("DELETE FROM riepiloghi")
+            conn.execute("DELETE FROM sentimenti_conversazione")
+            conn.execute("DELETE FROM statistiche_giornaliere")
+            conn.execute(
+                "INSERT INTO riepiloghi (conversation_id, inizio, fine) "
+                "SELECT conversation_id, min(timestamp), max(timestamp) FROM interazioni GROUP BY conversation_id"
+            )
+            conn.execute(
+                "INSERT INTO sentimenti_conversazione (conversation_id, sentiment, n) "
+                "SELECT conversation_id, COALESCE(sentiment, ''), COUNT(*) FROM interazioni GROUP BY 1, 2"
+            )
+            conn.execute(
+                "INSERT INTO statistiche_giornaliere (giorno, user_role, sentiment, n) "
+                "SELECT substr(timestamp, 1, 10), COALESCE(user_role, ''), COALESCE(sentiment, ''), COUNT(*) "
+                "FROM interazioni GROUP BY 1, 2, 3"
+            )
+
+    def aggiungi(self, conversation_id: str, interaction: dict) -> int:
+        """
+        Aggiunge un'interazione alla conversazione.
+
+        Returns:
+            int: Numero di turni della conversazione dopo l'inserimento
+        """
+        self._migra_se_necessario(conversation_id)
+        with self.db.transazione() as conn:
+            return self._inserisci(conn, conversation_id, interaction)
+
+    def tronca(self, conversation_id: str, turni: int) -> int:
+        """
+        Tiene solo le prime `turni` interazioni della conversazione e
+        aggiorna gli aggregati per quelle eliminate.
+
+        Returns:
+            int: Numero di interazioni eliminate
+        """
+        self._migra_se_necessario(conversation_id)
+        with self.db.transazione() as conn:
+            eliminate = conn.execute(
+                "SELECT id, timestamp, user_role, sentiment FROM interazioni WHERE conversation_id = ? "
+                "ORDER BY id LIMIT -1 OFFSET ?",
+                (conversation_id, turni),
+            ).fetchall()
+            if not eliminate:
+                return 0
+            conn.executemany("DELETE FROM interazioni WHERE id = ?", [(riga["id"],) for riga in eliminate])
+            for riga in eliminate:
+                conn.execute(
+                    "UPDATE statistiche_giornaliere SET n = n - 1 WHERE giorno = ? AND user_role = ? AND sentiment = ?",
+                    (riga["timestamp"][:10], riga["user_role"] or "", riga["sentiment"] or ""),
+                )
+            conn.execute("DELETE FROM statistiche_giornaliere WHERE n <= 0")
+            # Periodo e sentimenti della conversazione si ricalcolano dalle righe rimaste
+            conn.execute("DELETE FROM riepiloghi WHERE conversation_id = ?", (conversation_id,))
+            conn.execute("DELETE FROM sentimenti_conversazione WHERE conversation_id = ?", (conversation_id,))
+            if turni <= 0:
+                conn.execute("DELETE FROM conversazioni WHERE conversation_id = ?", (conversation_id,))
+                return len(eliminate)
+            conn.execute("UPDATE conversazioni SET turni = ? WHERE conversation_id = ?", (turni, conversation_id))
+            conn.execute(
+                "INSERT INTO riepiloghi (conversation_id, inizio, fine) "
+                "SELECT conversation_id, min(timestamp), max(timestamp) FROM interazioni WHERE conversation_id = ?",
+                (conversation_id,),
+            )
+            conn.execute(
+                "INSERT INTO sentimenti_conversazione (conversation_id, sentiment, n) "
+                "SELECT conversation_id, COALESCE(sentiment, ''), COUNT(*) FROM interazioni "
+                "WHERE conversation_id = ? GROUP BY 1, 2",
+                (conversation_id,),
+            )
+        return len(eliminate)
+
+    def ultime(self, conversation_id: str, limit: int = 3) -> list:
+        """Le ultime `limit` interazioni, dalla più recente."""
+        self._migra_se_necessario(conversation_id)
+        righe = self.db.connessione().execute(
+            "SELECT timestamp, user_query, ai_response, user_role, sentiment FROM interazioni "
+            "WHERE conversation_id = ? ORDER BY id DESC LIMIT ?",
+            (conversation_id, limit),
+        ).fetchall()
+        return [dict(riga) for riga in righe]
+
+    def tutte(self, conversation_id: str) -> list:
+        """Tutte le interazioni della conversazione, in ordine cronologico."""
+        self._migra_se_necessario(conversation_id)
+        righe = self.db.connessione().execute(
+            "SELECT timestamp, user_query, ai_response, user_role, sentiment FROM interazioni "
+            "WHERE conversation_id = ? ORDER BY id",
+            (conversation_id,),
+        ).fetchall()
+        return [dict(riga) for riga in righe]
+
+    def conta(self, conversation_id: str) -> int:
+        """Numero di turni della conversazione."""
+        self._migra_se_necessario(conversation_id)
+        riga = self.db.connessione().execute(
+            "SELECT turni FROM conversazioni WHERE conversation_id = ?", (conversation_id,)
+        ).fetchone()
+        return riga[0] if riga else 0
+
+    def riepilogo(self, conversation_id: str) -> dict:
+        """
+        Aggregati della conversazione, senza leggerne le interazioni.
+
+        Returns:
+            dict: `turni`, `inizio`, `fine` e `sentimenti` (conteggio per sentimento),
+                  o None se la conversazione non esiste
+        """
+        self._migra_se_necessario(conversation_id)
+        conn = self.db.connessione()
+        riga = conn.execute(
+            "SELECT c.turni, r.inizio, r.fine FROM conversazioni c "
+            "JOIN riepiloghi r ON r.conversation_id = c.conversation_id WHERE c.conversation_id = ?",
+            (conversation_id,),
+        ).fetchone()
+        if riga is None:
+            return None
+        sentimenti = conn.execute(
+            "SELECT sentiment, n FROM sentimenti_conversazione WHERE conversation_id = ?", (conversation_id,)
+        ).fetchall()
+        return {
+            "turni": riga["turni"],
+            "inizio": riga["inizio"],
+            "fine": riga["fine"],
+            "sentimenti": {s["sentiment"]: s["n"] for s in sentimenti},
+        }
+
+    def statistiche(self, raggruppa=("giorno", "user_role", "sentiment"), dal: str = None, al: str = None) -> list:
+        """
+        Interazioni di tutte le conversazioni raggruppate per `raggruppa`
+        (tra "giorno", "mese", "user_role", "sentiment"), dai contatori
+        giornalieri. `dal` e `al` (date ISO, inclusi) limitano il periodo.
+
+        Returns:
+            list: dict con le colonne di `raggruppa` e `n`, in ordine di gruppo
+        """
+        colonne = [f"{_DIMENSIONI[nome]} AS {nome}" for nome in raggruppa]
+        condizioni, parametri = [], []
+        if dal:
+            condizioni.append("giorno >= ?")
+            parametri.append(dal[:10])
+        if al:
+            condizioni.append("giorno <= ?")
+            parametri.append(al[:10])
+        where = f" WHERE {' AND '.join(condizioni)}" if condizioni else ""
+        posizioni = ", ".join(str(i + 1) for i in range(len(raggruppa)))
+        gruppi = f" GROUP BY {posizioni} ORDER BY {posizioni}" if raggruppa else ""
+        righe = self.db.connessione().execute(
+            f"SELECT {', '.join(colonne + ['SUM(n) AS n'])} FROM statistiche_giornaliere{where}{gruppi}",
+            parametri,
+        ).fetchall()
+        return [dict(riga) for riga in righe]
+
+
+_lock = threading.Lock()
+_memory_store = None
+
+
+def get_memory_store() -> MemoryStore:
+    """MemoryStore condiviso dal processo (percorso da CONVERSATION_MEMORY_DB)."""
+    global _memory_store
+    with _lock:
+        if _memory_store is None:
+            _memory_store = MemoryStore(os.getenv("CONVERSATION_MEMORY_DB", DEFAULT_DB))
+        return _memory_store
+
+
+if __name__ == "__main__":
+    # Migrazione una tantum dei vecchi file JSON (gli aggregati si aggiornano importando)
+    parser = argparse.ArgumentParser(description="Importa le vecchie memorie JSON e mostra le statistiche.")
+    parser.add_argument("--ricostruisci", action="store_true", help="Ricalcola gli aggregati da tutte le interazioni")
+    parser.add_argument("--statistiche", nargs="*", choices=list(_DIMENSIONI),
+                        help="Stampa le interazioni raggruppate (default: giorno user_role sentiment)")
+    args = parser.parse_args()
+
+    store = get_memory_store()
+    importate = store.migra_tutto()
+    print(f"Interazioni importate: {importate}")
+    if args.ricostruisci:
+        store.ricostruisci_aggregati()
+        print("Aggregati ricalcolati")
+    if args.statistiche is not None:
+        for riga in store.statistiche(args.statistiche or ("giorno", "user_role", "sentiment")):
+            print(json.dumps(riga, ensure_ascii=False))
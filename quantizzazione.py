@@ -0,0 +1,191 @@
+import argparse
+import os
+import numpy as np
+from embedding_store import carica_vettori, firma_corpus, percorso_vettori
+from ann import query_di_prova
+from similarity import SimilarityIndex, normalizza_righe, rivaluta
+
+# Ricerca in due passate: una prima stima dei punteggi su vettori ridotti
+# (prime `dim` dimensioni, che i modelli text-embedding-3 permettono di
+# usare da sole, e/o quantizzati a int8) e il punteggio esatto solo per i
+# migliori candidati, letti dal file .npy in memory mapping.
+
+# Dimensioni tenute in memoria per la prima passata (0 = modalità disattivata)
+DIM_RIDOTTA = int(os.getenv("EMBEDDING_DIM_RIDOTTA", "0"))
+# Quantizzazione int8 dei vettori della prima passata
+INT8 = os.getenv("EMBEDDING_INT8", "0").lower() in ("1", "true", "si")
+# Candidati rivalutati con i vettori completi, per ogni risultato richiesto
+FATTORE_RESCORING = int(os.getenv("EMBEDDING_FATTORE_RESCORING", "10"))
+
+
+def percorso_ridotti(path_json: str) -> str:
+    """Percorso del file dei vettori ridotti associato a un file JSON di record."""
+    return os.path.splitext(path_json)[0] + ".ridotti.npz"
+
+
+class VettoriRidotti:
+    """
+    Vettori troncati alle prime `dim` dimensioni e rinormalizzati; con
+    `scale` sono codici int8 con una scala per riga (valore ≈ codice · scala).
+    """
+
+    def __init__(self, codici: np.ndarray, scale: np.ndarray = None):
+        self.codici = codici
+        self.scale = scale
+
+    @property
+    def dim(self) -> int:
+        return self.codici.shape[1]
+
+    @property
+    def nbytes(self) -> int:
+        return self.codici.nbytes + (self.scale.nbytes if self.scale is not None else 0)
+
+    @classmethod
+    def da_matrice(cls, matrice: np.ndarray, dim: int = None, int8: bool = True, blocco: int = 65536):
+        """Riduce `matrice` (normalizzata, anche in memory mapping) a blocchi di righe."""
+        n, dim_piena = matrice.shape
+        dim = min(dim or dim_piena, dim_piena)
+        codici = np.empty((n, dim), dtype=np.int8 if int8 else np.float32)
+        scale = np.empty(n, dtype=np.float32) if int8 else None
+        for inizio in range(0, n, blocco):
+            righe = normalizza_righe(np.asarray(matrice[inizio:inizio + blocco, :dim], dtype=np.float32))
+            if int8:
+                massimi = np.abs(righe).max(axis=1)
+                massimi[massimi == 0] = 1.0
+                scale[inizio:inizio + blocco] = massimi / 127.0
+                codici[inizio:inizio + blocco] = np.round(righe / scale[inizio:inizio + blocco, None]).astype(np.int8)
+            else:
+                codici[inizio:inizio + blocco] = righe
+        return cls(codici, scale)
+
+    def stima(self, q: np.ndarray, righe: np.ndarray = None, blocco: int = 65536) -> np.ndarray:
+        """Punteggi approssimati della query (vettore completo) con tutte le righe o con `righe`."""
+        q = np.asarray(q, dtype=np.float32)[:self.dim]
+        norma = np.linalg.norm(q)
+        if norma > 0:
+            q = q / norma
+        codici = self.codici if righe is None else self.codici[righe]
+        scale = self.scale if righe is None or self.scale is None else self.scale[righe]
+        stime = np.empty(codici.shape[0], dtype=np.float32)
+        # La conversione da int8 a float32 si fa a blocchi per non duplicare la matrice
+        for inizio in range(0, codici.shape[0], blocco):
+            stime[inizio:inizio + blocco] = codici[inizio:inizio + blocco].astype(np.float32, copy=False) @ q
+        if scale is not None:
+            stime *= scale
+        return stime
+
+
+class QuantizedIndex(SimilarityIndex):
+    """
+    SimilarityIndex in due passate: `top_k` stima i punteggi con i vettori
+    ridotti e rivaluta solo i migliori candidati con i vettori completi.
+    La matrice completa resta su disco (memory mapping): si leggono solo
+    le righe dei candidati.
+    """
+
+    def __init__(self, embeddings, ridotti: VettoriRidotti, fattore: int = FATTORE_RESCORING):
+        super().__init__(embeddings, normalizzata=True)
+        self.ridotti = ridotti
+        self.fattore = fattore
+
+    def top_k(self, query, k: int = 1):
+        if not len(self) or k <= 0:
+            return []
+        q, matrice = self._prepara_query(query)
+        if q.shape[0] != self.dim:
+            return super().top_k(query, k)
+        righe = np.arange(len(self))
+        return rivaluta(matrice, q, righe, self.ridotti.stima(q), k, self.fattore)
+
+
+def salva_ridotti(path_json: str, ridotti: VettoriRidotti) -> None:
+    """Salva i vettori ridotti accanto al corpus (scrittura su file temporaneo)."""
+    path = percorso_ridotti(path_json)
+    tmp = path + ".tmp.npz"
+    dati = {"codici": ridotti.codici, "firma": np.array(firma_corpus(path_json, ridotti.codici.shape[0]))}
+    if ridotti.scale is not None:
+        dati["scale"] = ridotti.scale
+    np.savez(tmp, **dati)
+    os.replace(tmp, path)
+
+
+def carica_ridotti(path_json: str, embeddings, dim: int = DIM_RIDOTTA, int8: bool = INT8) -> VettoriRidotti:
+    """
+    Vettori ridotti del corpus: dal file scritto da ingest.py se corrisponde
+    a corpus e configurazione, altrimenti calcolati dalla matrice completa.
+    """
+    path = percorso_ridotti(path_json)
+    if os.path.exists(path):
+        with np.load(path) as dati:
+            scale = dati["scale"] if "scale" in dati else None
+            if (str(dati["firma"]) == firma_corpus(path_json, embeddings.shape[0])
+                    and dati["codici"].shape[1] == min(dim or embeddings.shape[1], embeddings.shape[1])
+                    and (scale is not None) == int8):
+                return VettoriRidotti(dati["codici"], scale)
+    return VettoriRidotti.da_matrice(embeddings, dim, int8)
+
+
+def modalita_ridotta(dim: int = DIM_RIDOTTA, int8: bool = INT8) -> bool:
+    """True se la configurazione chiede la ricerca in due passate."""
+    return bool(dim) or int8
+
+
+def aggiorna_ridotti(path_json: str, dim: int = DIM_RIDOTTA, int8: bool = INT8):
+    """Scrive i vettori ridotti del corpus se la modalità è attiva; restituisce il richiamo misurato."""
+    if not modalita_ridotta(dim, int8):
+        if os.path.exists(percorso_ridotti(path_json)):
+            os.remove(percorso_ridotti(path_json))
+        return None
+    matrice = carica_vettori(percorso_vettori(path_json))
+    ridotti = VettoriRidotti.da_matrice(matrice, dim, int8)
+    salva_ridotti(path_json, ridotti)
+    risultato = valuta(matrice, ridotti)
+    print(f"{path_json}: vettori ridotti a {ridotti.dim} dimensioni{' int8' if int8 else ''} "
+          f"({ridotti.nbytes / 2**20:.1f} MB invece di {matrice.nbytes / 2**20:.1f} MB), "
+          f"richiamo@{risultato['k']} {risultato['richiamo_prima_passata']:.3f} senza rescoring, "
+          f"{risultato['richiamo']:.3f} con rescoring")
+    return risultato
+
+
+def valuta(matrice: np.ndarray, ridotti: VettoriRidotti, query: np.ndarray = None, k: int = 3,
+           fattore: int = FATTORE_RESCORING) -> dict:
+    """
+    Richiamo@k rispetto alla ricerca esatta con i vettori completi: solo
+    prima passata e con rescoring. Senza `query` usa le righe del corpus
+    con un po' di rumore (vedi ann.query_di_prova).
+    """
+    if query is None:
+        query = query_di_prova(matrice)
+    esatto = SimilarityIndex(matrice, normalizzata=True)
+    indice = QuantizedIndex(matrice, ridotti, fattore)
+    k = min(k, len(esatto))
+    prima, dopo = 0, 0
+    for q in query:
+        veri = {i for i, _ in esatto.top_k(q, k)}
+        stime = ridotti.stima(q)
+        prima += len(veri & set(np.argsort(-stime)[:k].tolist()))
+        dopo += len(veri & {i for i, _ in indice.top_k(q, k)})
+    totale = max(1, k * len(query))
+    return {"k": k, "richiamo_prima_passata": prima / totale, "richiamo": dopo / totale}
+
+
+if __name__ == "__main__":
+    # Perdita di richiamo al variare delle dimensioni tenute, sul corpus indicato
+    parser = argparse.ArgumentParser(description="Misura il richiamo dei vettori ridotti rispetto a quelli completi.")
+    parser.add_argument("corpus", nargs="?", default="data/faq.json")
+    parser.add_argument("--dim", type=int, nargs="+", default=[128, 256, 512, 1024])
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--query", type=int, default=200)
+    parser.add_argument("--rumore", type=float, default=0.5)
+    args = parser.parse_args()
+
+    matrice = carica_vettori(percorso_vettori(args.corpus))
+    query = query_di_prova(matrice, args.query, args.rumore)
+    print(f"{args.corpus}: {matrice.shape[0]} vettori da {matrice.shape[1]} dimensioni ({matrice.nbytes / 2**20:.1f} MB)")
+    for dim in args.dim:
+        for int8 in (False, True):
+            ridotti = VettoriRidotti.da_matrice(matrice, dim, int8)
+            r = valuta(matrice, ridotti, query, args.k)
+            print(f"dim={ridotti.dim:5d} {'int8   ' if int8 else 'float32'} {ridotti.nbytes / 2**20:8.2f} MB  "
+                  f"richiamo@{r['k']} prima passata={r['richiamo_prima_passata']:.3f}  con rescoring={r['richiamo']:.3f}")
@@ -0,0 +1,194 @@
+import asyncio
+import heapq
+import itertools
+import random
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Limitatore a token bucket: `rate` gettoni al secondo, al massimo
+    `capacita` accumulabili (il picco consentito). Thread-safe.
+
+    Con `riserva` (quota della capacità, 0-1) le richieste con priorità > 0
+    prendono gettoni solo se ne resta almeno la riserva: sotto carico batch
+    le chiamate con priorità 0 trovano ancora gettoni invece di mettersi in
+    fila dietro di loro.
+    """
+
+    def __init__(self, rate: float, capacita: float = None, riserva: float = 0.0):
+        self.rate = rate
+        self.capacita = capacita if capacita is not None else max(rate, 1.0)
+        self.riserva = riserva * self.capacita
+        self._gettoni = self.capacita
+        self._ultimo = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _ricarica(self) -> None:
+        adesso = time.monotonic()
+        self._gettoni = min(self.capacita, self._gettoni + (adesso - self._ultimo) * self.rate)
+        self._ultimo = adesso
+
+    def prova(self, n: float = 1.0, priorita: int = 0) -> float:
+        """
+        Prende `n` gettoni se disponibili (oltre la riserva se `priorita` > 0).
+
+        Returns:
+            float: 0 se i gettoni sono stati presi, altrimenti i secondi da aspettare
+        """
+        # Una richiesta grande quanto il bucket deve poter passare comunque
+        minimo = n + min(self.riserva, self.capacita - n) if priorita > 0 else n
+        with self._lock:
+            self._ricarica()
+            if self._gettoni >= minimo:
+                self._gettoni -= n
+                return 0.0
+            return (minimo - self._gettoni) / self.rate
+
+    def acquisisci(self, n: float = 1.0, priorita: int = 0) -> None:
+        """Aspetta (bloccando il thread) finché non ci sono `n` gettoni."""
+        while True:
+            attesa = self.prova(n, priorita)
+            if attesa <= 0:
+                return
+            time.sleep(attesa)
+
+    async def aacquisisci(self, n: float = 1.0, priorita: int = 0) -> None:
+        """Come acquisisci, senza bloccare l'event loop."""
+        while True:
+            attesa = self.prova(n, priorita)
+            if attesa <= 0:
+                return
+            await asyncio.sleep(attesa)
+
+
+def attesa_backoff(tentativo: int, base: float = 0.5, massimo: float = 30.0) -> float:
+    """Secondi da aspettare prima del tentativo `tentativo` + 1: backoff esponenziale con jitter pieno."""
+    return random.uniform(0.0, min(massimo, base * 2 ** tentativo))
+
+
+class _Attesa:
+    """Richiesta in coda per un posto di LimiteAdattivo."""
+
+    __slots__ = ("sveglia", "concessa", "annullata")
+
+    def __init__(self, sveglia):
+        self.sveglia = sveglia
+        self.concessa = False
+        self.annullata = False
+
+
+class LimiteAdattivo:
+    """
+    Limite di concorrenza adattivo (AIMD) con priorità. Thread-safe, usabile
+    sia da thread sia da coroutine.
+
+    Ogni risposta andata bene entro `latenza_obiettivo` alza il limite di
+    circa un posto ogni `limite` risposte; un rifiuto per sovraccarico (429)
+    o una risposta troppo lenta lo dimezza, al massimo una volta per
+    latenza media, così una raffica di 429 conta come un solo segnale.
+    I posti che si liberano vanno alle richieste in coda con la priorità
+    più bassa (0 = la più urgente), a parità in ordine di arrivo.
+    """
+
+    def __init__(self, iniziale: float = 8, minimo: float = 1, massimo: float = 64, latenza_obiettivo: float = None):
+        self.minimo = minimo
+        self.massimo = massimo
+        self.limite = float(min(max(iniziale, minimo), massimo))
+        self.latenza_obiettivo = latenza_obiettivo
+        self.latenza_media = None
+        self.in_corso = 0
+        self.riduzioni = 0
+        self._ultima_riduzione = 0.0
+        self._coda = []
+        self._sequenza = itertools.count()
+        self._lock = threading.Lock()
+
+    @property
+    def in_attesa(self) -> int:
+        with self._lock:
+            return sum(1 for _, _, a in self._coda if not a.annullata)
+
+    def _capienza(self) -> int:
+        return max(1, int(self.limite))
+
+    def _prenota(self, priorita: int, sveglia) -> _Attesa:
+        """Prende un posto se c'è e nessuno è in coda, altrimenti mette in coda. Va chiamata con il lock."""
+        attesa = _Attesa(sveglia)
+        if not self._coda and self.in_corso < self._capienza():
+            self.in_corso += 1
+            attesa.concessa = True
+        else:
+            heapq.heappush(self._coda, (priorita, next(self._sequenza), attesa))
+        return attesa
+
+    def _assegna(self) -> None:
+        """Passa i posti liberi alle richieste in coda. Va chiamata con il lock."""
+        while self._coda and self.in_corso < self._capienza():
+            _, _, attesa = heapq.heappop(self._coda)
+            if attesa.annullata:
+                continue
+            self.in_corso += 1
+            attesa.concessa = True
+            attesa.sveglia()
+
+    def acquisisci(self, priorita: int = 0) -> None:
+        """Aspetta (bloccando il thread) un posto libero."""
+        evento = threading.Event()
+        with self._lock:
+            attesa = self._prenota(priorita, evento.set)
+        if not attesa.concessa:
+            evento.wait()
+
+    async def aacquisisci(self, priorita: int = 0) -> None:
+        """Come acquisisci, senza bloccare l'event loop."""
+        loop = asyncio.get_running_loop()
+        futuro = loop.create_future()
+
+        def sveglia():
+            loop.call_soon_threadsafe(lambda: futuro.done() or futuro.set_result(None))
+
+        with self._lock:
+            attesa = self._prenota(priorita, sveglia)
+        if attesa.concessa:
+            return
+        try:
+            await futuro
+        except asyncio.CancelledError:
+            with self._lock:
+                if attesa.concessa:
+                    # Il posto è arrivato insieme alla cancellazione: va restituito
+                    self.in_corso -= 1
+                    self._assegna()
+                else:
+                    attesa.annullata = True
+            raise
+
+    def rilascia(self) -> None:
+        with self._lock:
+            self.in_corso -= 1
+            self._assegna()
+
+    def successo(self, latenza: float) -> None:
+        """Segnala una risposta arrivata dopo `latenza` secondi."""
+        with self._lock:
+            self.latenza_media = latenza if self.latenza_media is None else 0.8 * self.latenza_media + 0.2 * latenza
+            if self.latenza_obiettivo and latenza > self.latenza_obiettivo:
+                self._riduci()
+            else:
+                self.limite = min(self.massimo, self.limite + 1.0 / self.limite)
+                self._assegna()
+
+    def sovraccarico(self) -> None:
+        """Segnala un rifiuto per sovraccarico (429, timeout)."""
+        with self._lock:
+            self._riduci()
+
+    def _riduci(self) -> None:
+        adesso = time.monotonic()
+        if adesso - self._ultima_riduzione < (self.latenza_media or 1.0):
+            return
+        self._ultima_riduzione = adesso
+        self.limite = max(self.minimo, self.limite / 2)
+        self.riduzioni += 1
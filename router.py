@@ -0,0 +1,257 @@
+import argparse
+import json
+import os
+import threading
+from datetime import datetime
+import numpy as np
+import telemetria
+from ann import kmeans_sferico
+from similarity import SimilarityIndex
+
+# Router locale tra FAQ, Knowledge Base e Web: decide dai punteggi
+# dell'embedding della query (già calcolato per la ricerca) con una piccola
+# regressione logistica, senza chiamare l'LLM.
+#
+# Le etichette di addestramento devono essere indipendenti dalle soglie
+# della ricerca interna, altrimenti il modello impara solo a rifare la
+# stessa regola: si usano il percorso scelto dal pre-processing fuso
+# (LLM), annotazioni manuali o, con --etichetta-llm, classify_query_agent
+# di 2agent.py. L'esito della ricerca viene registrato solo per confronto.
+#
+# Il router fa saltare la ricerca interna alle query chiaramente da web
+# solo se così si risparmia davvero: quando almeno un corpus è riassunto
+# in centroidi (più di MAX_RIEPILOGO righe). Con corpus piccoli le
+# caratteristiche costano quanto la ricerca stessa.
+#
+# ROUTER_LOG=<file>: registra domanda, percorso ed esito di ogni ricerca
+# python router.py <log.jsonl> [altri log] : addestra e salva ROUTER_MODELLO
+
+PERCORSI = ["FAQ", "Knowledge Base", "Web"]
+ROUTER_MODELLO = os.getenv("ROUTER_MODELLO", "data/router.npz")
+# Probabilità di "Web" oltre la quale la ricerca interna viene saltata
+SOGLIA_WEB = float(os.getenv("ROUTER_SOGLIA_WEB", "0.9"))
+# Vettori di riepilogo per corpus: i corpus più piccoli vengono usati interi
+MAX_RIEPILOGO = 256
+
+_lock_log = threading.Lock()
+
+
+def percorso_da_fonte(fonte: str) -> str:
+    """Percorso corrispondente alla fonte trovata dalla ricerca interna."""
+    if fonte in ("faq", "faq+kb"):
+        return "FAQ"
+    if fonte == "kb":
+        return "Knowledge Base"
+    return "Web"
+
+
+def registra_esito(domanda: str, fonte: str, percorso: str = None, path_log: str = None) -> None:
+    """
+    Aggiunge al log (ROUTER_LOG) la domanda, l'esito della ricerca interna
+    (`esito_ricerca`, solo per confronto) e, se noto, il `percorso` scelto
+    indipendentemente dalla ricerca (es. dal pre-processing fuso), che è
+    l'etichetta di addestramento.
+    """
+    path_log = path_log or os.getenv("ROUTER_LOG")
+    if not path_log:
+        return
+    record = {
+        "timestamp": datetime.now().isoformat(),
+        "domanda": domanda,
+        "esito_ricerca": percorso_da_fonte(fonte),
+    }
+    if percorso in PERCORSI:
+        record["percorso"] = percorso
+    riga = json.dumps(record, ensure_ascii=False)
+    with _lock_log:
+        with open(path_log, "a", encoding="utf-8") as f:
+            f.write(riga + "\n")
+
+
+class Caratteristiche:
+    """
+    Calcola le caratteristiche di una query: i due migliori punteggi contro
+    FAQ e KB, i margini tra primo e secondo e il massimo tra i due corpus.
+
+    Per i corpus grandi i punteggi sono calcolati contro al massimo
+    MAX_RIEPILOGO centroidi, così il costo non cresce con il corpus; i
+    corpus più piccoli vengono confrontati riga per riga, come nella ricerca.
+    """
+
+    NOMI = ["faq_1", "faq_2", "faq_margine", "kb_1", "kb_2", "kb_margine", "massimo"]
+
+    def __init__(self, faq_embeddings, kb_embeddings, max_riepilogo: int = MAX_RIEPILOGO):
+        self.faq = self._riepilogo(faq_embeddings, max_riepilogo)
+        self.kb = self._riepilogo(kb_embeddings, max_riepilogo)
+        # Almeno un corpus riassunto: le caratteristiche costano meno della ricerca
+        self.riassunte = max(len(faq_embeddings), len(kb_embeddings)) > max_riepilogo
+
+    @staticmethod
+    def _riepilogo(embeddings, max_riepilogo: int) -> SimilarityIndex:
+        indice = SimilarityIndex(embeddings, normalizzata=True)
+        if len(indice) <= max_riepilogo:
+            return indice
+        return SimilarityIndex(kmeans_sferico(indice.matrice, max_riepilogo), normalizzata=True)
+
+    @staticmethod
+    def _primi_due(indice: SimilarityIndex, vettore) -> tuple:
+        top = indice.top_k(vettore, 2)
+        primo = top[0][1] if top else 0.0
+        secondo = top[1][1] if len(top) > 1 else 0.0
+        return primo, secondo
+
+    def calcola(self, vettore) -> np.ndarray:
+        faq_1, faq_2 = self._primi_due(self.faq, vettore)
+        kb_1, kb_2 = self._primi_due(self.kb, vettore)
+        return np.array([faq_1, faq_2, faq_1 - faq_2, kb_1, kb_2, kb_1 - kb_2, max(faq_1, kb_1)], dtype=np.float32)
+
+
+class RegressioneLogistica:
+    """Regressione logistica multinomiale (softmax) con regolarizzazione L2, in NumPy."""
+
+    def __init__(self, pesi: np.ndarray, media: np.ndarray, scala: np.ndarray, classi: list):
+        self.pesi = pesi
+        self.media = media
+        self.scala = scala
+        self.classi = list(classi)
+
+    @classmethod
+    def addestra(cls, x: np.ndarray, y: np.ndarray, classi: list, l2: float = 1e-3,
+                 iterazioni: int = 2000, passo: float = 0.5):
+        """Discesa del gradiente sulla log-verosimiglianza; `y` contiene gli indici delle classi."""
+        media = x.mean(axis=0)
+        scala = x.std(axis=0)
+        scala[scala == 0] = 1.0
+        xs = np.hstack([(x - media) / scala, np.ones((x.shape[0], 1))])
+        obiettivo = np.eye(len(classi))[y]
+        pesi = np.zeros((xs.shape[1], len(classi)))
+        for _ in range(iterazioni):
+            probabilita = _softmax(xs @ pesi)
+            gradiente = xs.T @ (probabilita - obiettivo) / xs.shape[0] + l2 * pesi
+            pesi -= passo * gradiente
+        return cls(pesi, media, scala, classi)
+
+    def probabilita(self, x: np.ndarray) -> np.ndarray:
+        x = np.atleast_2d(x)
+        xs = np.hstack([(x - self.media) / self.scala, np.ones((x.shape[0], 1))])
+        return _softmax(xs @ self.pesi)
+
+    def salva(self, path: str) -> None:
+        tmp = path + ".tmp.npz"
+        np.savez(tmp, pesi=self.pesi, media=self.media, scala=self.scala, classi=np.array(self.classi))
+        os.replace(tmp, path)
+
+    @classmethod
+    def carica(cls, path: str):
+        with np.load(path) as dati:
+            return cls(dati["pesi"], dati["media"], dati["scala"], [str(c) for c in dati["classi"]])
+
+
+def _softmax(z: np.ndarray) -> np.ndarray:
+    z = z - z.max(axis=1, keepdims=True)
+    e = np.exp(z)
+    return e / e.sum(axis=1, keepdims=True)
+
+
+class Router:
+    """Sceglie il percorso di una query dal suo embedding."""
+
+    def __init__(self, caratteristiche: Caratteristiche, modello: RegressioneLogistica, soglia_web: float = SOGLIA_WEB):
+        self.caratteristiche = caratteristiche
+        self.modello = modello
+        self.soglia_web = soglia_web
+
+    def probabilita(self, vettore) -> dict:
+        """Probabilità di ogni percorso."""
+        p = self.modello.probabilita(self.caratteristiche.calcola(vettore))[0]
+        return {classe: float(p[i]) for i, classe in enumerate(self.modello.classi)}
+
+    def scegli(self, vettore) -> tuple:
+        """(percorso più probabile, probabilità)"""
+        probabilita = self.probabilita(vettore)
+        percorso = max(probabilita, key=probabilita.get)
+        return percorso, probabilita[percorso]
+
+    @property
+    def risparmia_ricerca(self) -> bool:
+        """True se le caratteristiche costano meno della ricerca interna (vedi Caratteristiche)."""
+        return self.caratteristiche.riassunte
+
+    def solo_web(self, vettore) -> bool:
+        """True se la query va sicuramente sul web e la ricerca interna si può saltare."""
+        return self.probabilita(vettore).get("Web", 0.0) >= self.soglia_web
+
+
+def carica_router(faq_embeddings, kb_embeddings, path_modello: str = ROUTER_MODELLO):
+    """Router con il modello addestrato, o None se il modello non c'è o ROUTER=0."""
+    if os.getenv("ROUTER", "1").lower() in ("0", "false", "no") or not os.path.exists(path_modello):
+        return None
+    try:
+        modello = RegressioneLogistica.carica(path_modello)
+    except Exception as e:
+        telemetria.evento("router_non_caricato", f"Errore nel caricamento del router {path_modello}: {e}")
+        return None
+    return Router(Caratteristiche(faq_embeddings, kb_embeddings), modello)
+
+
+def leggi_log(*paths_log: str) -> tuple:
+    """
+    Esempi etichettati dei log: coppie (domanda, percorso), l'ultima
+    etichetta vince per le domande ripetute. Le domande senza `percorso`
+    (solo `esito_ricerca`) non sono etichette valide e vengono restituite
+    a parte.
+
+    Returns:
+        tuple: (coppie (domanda, percorso), domande senza etichetta)
+    """
+    esiti, senza_etichetta = {}, {}
+    for path in paths_log:
+        with open(path, "r", encoding="utf-8") as f:
+            for riga in f:
+                if not riga.strip():
+                    continue
+                record = json.loads(riga)
+                if record.get("percorso") in PERCORSI:
+                    esiti[record["domanda"]] = record["percorso"]
+                    senza_etichetta.pop(record["domanda"], None)
+                elif record["domanda"] not in esiti:
+                    senza_etichetta[record["domanda"]] = None
+    return list(esiti.items()), list(senza_etichetta)
+
+
+def addestra(esempi: list, caratteristiche: Caratteristiche, embed_fn) -> RegressioneLogistica:
+    """Addestra il classificatore su coppie (domanda, percorso)."""
+    x = np.array([caratteristiche.calcola(embed_fn(domanda)) for domanda, _ in esempi])
+    y = np.array([PERCORSI.index(percorso) for _, percorso in esempi])
+    return RegressioneLogistica.addestra(x, y, PERCORSI)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Addestra il router locale sulle domande etichettate (ROUTER_LOG).")
+    parser.add_argument("log", nargs="+", help="File JSONL con record {domanda, percorso}")
+    parser.add_argument("--etichetta-llm", action="store_true",
+                        help="Etichetta le domande senza percorso con classify_query_agent di 2agent.py")
+    parser.add_argument("--output", default=ROUTER_MODELLO)
+    args = parser.parse_args()
+
+    from embedding_store import carica_corpus
+    from llm_client import embed_query
+    _, faq_embeddings = carica_corpus("data/faq.json", "dVec")
+    _, kb_embeddings = carica_corpus("data/knowledgeBase.json", "vec")
+    esempi, senza_etichetta = leggi_log(*args.log)
+    if args.etichetta_llm and senza_etichetta:
+        from valuta_router import carica_2agent, normalizza_percorso
+        agente_llm = carica_2agent()
+        for domanda in senza_etichetta:
+            percorso = normalizza_percorso(agente_llm.classify_query_agent(domanda))
+            if percorso is not None:
+                esempi.append((domanda, percorso))
+    elif senza_etichetta:
+        print(f"Domande senza percorso ignorate: {len(senza_etichetta)} (--etichetta-llm per etichettarle)")
+    if not esempi:
+        parser.error("nessuna domanda etichettata con un percorso")
+    conteggi = {p: sum(1 for _, e in esempi if e == p) for p in PERCORSI}
+    print(f"Esempi: {len(esempi)} {conteggi}")
+    modello = addestra(esempi, Caratteristiche(faq_embeddings, kb_embeddings), embed_query)
+    modello.salva(args.output)
+    print(f"Router salvato in {args.output}")
@@ -0,0 +1,179 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from cache_utils import normalizza_testo
+
+
+class SemanticCache:
+    """
+    Cache delle risposte generate, cercate per similarità della domanda.
+
+    Una risposta viene riusata se la nuova domanda ha similarità coseno
+    almeno `soglia` con una domanda in cache dello stesso ruolo utente,
+    con gli stessi record FAQ/KB trovati e lo stesso contesto (impronta di
+    sentimento e turni precedenti, vedi impronta_contesto), oppure se il
+    testo normalizzato della domanda è identico (così serve anche quando la
+    ricerca lessicale ha evitato l'embedding). Le voci scadono dopo `ttl`
+    secondi, la cache tiene al massimo `max_size` voci e si svuota quando
+    cambia la versione del corpus (es. dopo ingest.py).
+    """
+
+    def __init__(self, soglia: float = 0.93, max_size: int = 1000, ttl: float = 3600.0, versione_fn=None):
+        self.soglia = soglia
+        self.max_size = max_size
+        self.ttl = ttl
+        self.versione_fn = versione_fn
+        self._versione = versione_fn() if versione_fn else None
+        self._voci = OrderedDict()
+        self._gruppi = {}
+        self._testi = {}
+        self._lock = threading.Lock()
+        self._prossimo_id = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _normalizza(self, vettore) -> np.ndarray:
+        if vettore is None:
+            return None
+        v = np.asarray(vettore, dtype=np.float32).reshape(-1)
+        norma = np.linalg.norm(v)
+        return v / norma if norma > 0 else v
+
+    def _controlla_versione(self) -> None:
+        if self.versione_fn is None:
+            return
+        versione = self.versione_fn()
+        if versione != self._versione:
+            self._versione = versione
+            self._svuota()
+
+    def _svuota(self) -> None:
+        self._voci.clear()
+        self._gruppi.clear()
+        self._testi.clear()
+
+    def _rimuovi(self, voce_id) -> None:
+        voce = self._voci.pop(voce_id)
+        gruppo = self._gruppi[voce["gruppo"]]
+        del gruppo[voce_id]
+        if not gruppo:
+            del self._gruppi[voce["gruppo"]]
+        if voce["testo"] is not None and self._testi.get((voce["gruppo"], voce["testo"])) == voce_id:
+            del self._testi[(voce["gruppo"], voce["testo"])]
+
+    def cerca(self, vettore, ruolo: str, fonti, testo: str = None, contesto: str = None) -> str:
+        """
+        Restituisce la risposta in cache per una domanda simile, o None.
+
+        Args:
+            vettore: Embedding della domanda (None: solo confronto del testo)
+            ruolo (str): Ruolo dell'utente
+            fonti: Chiave dei record FAQ/KB trovati dal retrieval
+            testo (str, optional): Domanda, per il confronto esatto del testo normalizzato
+            contesto (str, optional): Impronta del contesto della conversazione
+        """
+        q = self._normalizza(vettore)
+        gruppo_id = (ruolo, fonti, contesto)
+        chiave_testo = (gruppo_id, normalizza_testo(testo)) if testo is not None else None
+        adesso = time.monotonic()
+        with self._lock:
+            self._controlla_versione()
+            migliore, migliore_id = -1.0, None
+            voce_id = self._testi.get(chiave_testo) if chiave_testo is not None else None
+            if voce_id is not None and self._voci[voce_id]["scadenza"] > adesso:
+                migliore, migliore_id = 1.0, voce_id
+            elif q is not None:
+                gruppo = self._gruppi.get(gruppo_id)
+                for voce_id in list(gruppo or ()):
+                    voce = self._voci[voce_id]
+                    if voce["scadenza"] <= adesso:
+                        self._rimuovi(voce_id)
+                        continue
+                    if voce["vettore"] is None or voce["vettore"].shape != q.shape:
+                        continue
+                    sim = float(voce["vettore"] @ q)
+                    if sim > migliore:
+                        migliore, migliore_id = sim, voce_id
+            if migliore_id is not None and migliore >= self.soglia:
+                self._voci.move_to_end(migliore_id)
+                self.hits += 1
+                return self._voci[migliore_id]["risposta"]
+            self.misses += 1
+            return None
+
+    def salva(self, vettore, ruolo: str, fonti, risposta: str, testo: str = None, contesto: str = None) -> None:
+        """Aggiunge una risposta generata alla cache (`vettore` None: trovabile solo per testo)."""
+        with self._lock:
+            self._controlla_versione()
+            voce_id = self._prossimo_id
+            self._prossimo_id += 1
+            gruppo = (ruolo, fonti, contesto)
+            testo_normalizzato = normalizza_testo(testo) if testo is not None else None
+            self._voci[voce_id] = {
+                "vettore": self._normalizza(vettore),
+                "gruppo": gruppo,
+                "testo": testo_normalizzato,
+                "risposta": risposta,
+                "scadenza": time.monotonic() + self.ttl,
+            }
+            self._gruppi.setdefault(gruppo, {})[voce_id] = True
+            if testo_normalizzato is not None:
+                self._testi[(gruppo, testo_normalizzato)] = voce_id
+            while len(self._voci) > self.max_size:
+                self._rimuovi(next(iter(self._voci)))
+
+    def invalida(self) -> None:
+        """Svuota la cache."""
+        with self._lock:
+            self._svuota()
+
+    def stats(self) -> dict:
+        totale = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / totale if totale else 0.0,
+            "dimensione": len(self._voci),
+        }
+
+
+def chiave_fonti(faq_result: dict):
+    """
+    Chiave dei record FAQ/KB trovati; None se la risposta non viene dai dati
+    interni (i risultati web non si mettono in cache).
+    """
+    indici = faq_result.get("indici") or {}
+    if faq_result.get("fonte") == "none" or (indici.get("faq") is None and indici.get("kb") is None):
+        return None
+    return (indici.get("faq"), indici.get("kb"))
+
+
+def impronta_contesto(*parti) -> str:
+    """
+    Impronta delle parti del prompt che, oltre a domanda e fonti, cambiano
+    la risposta (es. sentimento e turni precedenti): una risposta data in
+    una conversazione non viene riusata in un'altra con un contesto diverso.
+    """
+    h = hashlib.sha1()
+    for parte in parti:
+        h.update(str(parte).encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def crea_semantic_cache(versione_fn=None):
+    """
+    Crea la cache dalla configurazione: SEMANTIC_CACHE=0 la disattiva,
+    SEMANTIC_CACHE_SOGLIA, SEMANTIC_CACHE_SIZE e SEMANTIC_CACHE_TTL la regolano.
+    """
+    if os.getenv("SEMANTIC_CACHE", "1").lower() in ("0", "false", "no"):
+        return None
+    return SemanticCache(
+        soglia=float(os.getenv("SEMANTIC_CACHE_SOGLIA", "0.93")),
+        max_size=int(os.getenv("SEMANTIC_CACHE_SIZE", "1000")),
+        ttl=float(os.getenv("SEMANTIC_CACHE_TTL", "3600")),
+        versione_fn=versione_fn,
+    )
@@ -0,0 +1,127 @@
+import asyncio
+import os
+import queue
+import threading
+from concurrent.futures import Future
+import telemetria
+
+# Modello multilingua che classifica da 1 a 5 stelle: corrisponde alle cinque classi
+DEFAULT_MODEL = "nlptown/bert-base-multilingual-uncased-sentiment"
+
+# Classi di conversation_utils.SENTIMENTI, da 1 a 5 stelle
+_SCALA = ["Molto Negativo", "Negativo", "Neutro", "Positivo", "Molto Positivo"]
+
+
+def mappa_etichetta(label: str, score: float) -> str:
+    """
+    Converte l'etichetta del modello nella scala italiana a cinque livelli.
+    Supporta i modelli a stelle ("1 star" ... "5 stars") e quelli
+    POSITIVE / NEGATIVE / NEUTRAL.
+    """
+    label = label.lower()
+    if label[:1].isdigit():
+        return _SCALA[min(max(int(label[0]), 1), 5) - 1]
+    if label.startswith("neg"):
+        return "Molto Negativo" if score >= 0.95 else "Negativo"
+    if label.startswith("pos"):
+        return "Molto Positivo" if score >= 0.95 else "Positivo"
+    return "Neutro"
+
+
+def _completa(future: Future, esito=None, errore: Exception = None):
+    """Completa `future` senza mai sollevare: il worker deve restare vivo."""
+    try:
+        if errore is not None:
+            future.set_exception(errore)
+        else:
+            future.set_result(esito)
+    except Exception:
+        pass
+
+
+class SentimentService:
+    """
+    Classificatore di sentiment locale (CPU) caricato una sola volta.
+
+    Le richieste concorrenti vengono raccolte in micro-batch (al massimo
+    `max_batch` testi o `max_attesa` secondi) ed eseguite con un solo
+    passaggio del modello.
+    """
+
+    def __init__(self, model: str = DEFAULT_MODEL, max_batch: int = 16, max_attesa: float = 0.01, pipeline=None):
+        if pipeline is None:
+            from transformers import pipeline as hf_pipeline
+            pipeline = hf_pipeline("sentiment-analysis", model=model, device=-1)
+        self.pipeline = pipeline
+        self.max_batch = max_batch
+        self.max_attesa = max_attesa
+        self._coda = queue.Queue()
+        self._worker = threading.Thread(target=self._esegui, name="sentiment", daemon=True)
+        self._worker.start()
+
+    def _esegui(self):
+        while True:
+            batch = [self._coda.get()]
+            try:
+                while len(batch) < self.max_batch:
+                    batch.append(self._coda.get(timeout=self.max_attesa))
+            except queue.Empty:
+                pass
+            # I Future annullati dal chiamante (es. task asyncio cancellato)
+            # non vanno calcolati né completati: set_result solleverebbe
+            # InvalidStateError e fermerebbe il worker
+            batch = [(testo, future) for testo, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            testi = [testo for testo, _ in batch]
+            try:
+                risultati = self.pipeline(testi, truncation=True)
+            except Exception as e:
+                for _, future in batch:
+                    _completa(future, errore=e)
+                continue
+            for (_, future), risultato in zip(batch, risultati):
+                try:
+                    esito = (mappa_etichetta(risultato["label"], risultato["score"]), float(risultato["score"]))
+                except Exception as e:
+                    _completa(future, errore=e)
+                else:
+                    _completa(future, esito)
+
+    def invia(self, testo: str) -> Future:
+        """Accoda un testo; il Future restituisce (sentimento, confidenza)."""
+        future = Future()
+        self._coda.put((testo, future))
+        return future
+
+    def classifica(self, testo: str) -> tuple:
+        """Restituisce (sentimento, confidenza) per `testo`."""
+        return self.invia(testo).result()
+
+    async def aclassifica(self, testo: str) -> tuple:
+        return await asyncio.wrap_future(self.invia(testo))
+
+
+_lock = threading.Lock()
+_sentiment_service = None
+_non_disponibile = False
+
+
+def get_sentiment_service():
+    """
+    SentimentService condiviso dal processo, o None se disattivato
+    (SENTIMENT_LOCALE=0) o se il modello non si può caricare.
+    SENTIMENT_MODEL sceglie il modello.
+    """
+    global _sentiment_service, _non_disponibile
+    if os.getenv("SENTIMENT_LOCALE", "1").lower() in ("0", "false", "no"):
+        return None
+    with _lock:
+        if _sentiment_service is None and not _non_disponibile:
+            try:
+                _sentiment_service = SentimentService(os.getenv("SENTIMENT_MODEL", DEFAULT_MODEL))
+            except Exception as e:
+                telemetria.evento("sentimento_locale_non_disponibile",
+                                  f"Modello di sentiment locale non disponibile: {e}")
+                _non_disponibile = True
+        return _sentiment_service
@@ -0,0 +1,214 @@
+# Servizio HTTP (ASGI) per l'assistente.
+# Avvio: `uvicorn server:app` oppure `python server.py`.
+#
+# Endpoint:
+# - POST /query  {"question": ..., "user": ..., "conversation_id": ...}
+# - POST /query/stream  come /query, risposta in testo a pezzi man mano che viene generata
+# - GET  /health processo attivo
+# - GET  /ready  risorse caricate e servizio pronto a ricevere richieste
+# - GET  /metrics metriche in formato Prometheus (con TELEMETRIA=1)
+import asyncio
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+import agent
+import telemetria
+
+# Richieste elaborate contemporaneamente; le altre aspettano al massimo CODA_TIMEOUT secondi
+MAX_CONCORRENZA = int(os.getenv("SERVER_CONCORRENZA", "16"))
+CODA_TIMEOUT = float(os.getenv("SERVER_CODA_TIMEOUT", "30"))
+# Thread per le fasi bloccanti (retrieval, web, archivi)
+THREAD_POOL = int(os.getenv("SERVER_THREAD", "32"))
+# Secondi concessi alle richieste in corso durante lo spegnimento
+SHUTDOWN_TIMEOUT = float(os.getenv("SERVER_SHUTDOWN_TIMEOUT", "30"))
+
+
+class AssistantApp:
+    """
+    Applicazione ASGI: carica modelli, corpus e configurazione una volta
+    all'avvio (evento lifespan) e li riusa per tutte le richieste.
+    """
+
+    def __init__(self):
+        self.pronta = False
+        self.in_chiusura = False
+        self.in_corso = 0
+        self._semaforo = None
+        self._nessuna_in_corso = None
+        self._executor = None
+
+    async def avvio(self):
+        loop = asyncio.get_running_loop()
+        self._executor = ThreadPoolExecutor(max_workers=THREAD_POOL, thread_name_prefix="agente")
+        loop.set_default_executor(self._executor)
+        self._semaforo = asyncio.Semaphore(MAX_CONCORRENZA)
+        self._nessuna_in_corso = asyncio.Event()
+        self._nessuna_in_corso.set()
+        await asyncio.to_thread(agent.avvia)
+        self.pronta = True
+
+    async def chiusura(self):
+        # Smette di accettare richieste e aspetta quelle in corso
+        self.in_chiusura = True
+        self.pronta = False
+        if self._nessuna_in_corso is not None:
+            try:
+                await asyncio.wait_for(self._nessuna_in_corso.wait(), SHUTDOWN_TIMEOUT)
+            except asyncio.TimeoutError:
+                telemetria.evento("chiusura_con_richieste", f"Chiusura con {self.in_corso} richieste ancora in corso")
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _ammetti(self, body: bytes):
+        """
+        Legge la richiesta e aspetta un posto tra quelle in corso.
+
+        Returns:
+            tuple: ((domanda, user, cId), None) se ammessa, altrimenti (None, (stato, errore))
+        """
+        try:
+            dati = json.loads(body or b"{}")
+            campi = dati["question"], dati["user"], dati["conversation_id"]
+        except (ValueError, KeyError, TypeError):
+            return None, (400, {"errore": "Servono i campi 'question', 'user' e 'conversation_id'"})
+        if self.in_chiusura or not self.pronta:
+            return None, (503, {"errore": "Servizio non disponibile"})
+        try:
+            await asyncio.wait_for(self._semaforo.acquire(), CODA_TIMEOUT)
+        except asyncio.TimeoutError:
+            return None, (503, {"errore": "Troppe richieste in corso"})
+        self.in_corso += 1
+        self._nessuna_in_corso.clear()
+        return campi, None
+
+    def _rilascia(self):
+        self._semaforo.release()
+        self.in_corso -= 1
+        if self.in_corso == 0:
+            self._nessuna_in_corso.set()
+
+    async def _query(self, body: bytes):
+        campi, rifiuto = await self._ammetti(body)
+        if rifiuto is not None:
+            return rifiuto
+        try:
+            risposta = await agent.aprocess_query(*campi)
+            return 200, {"risposta": risposta}
+        except Exception as e:
+            telemetria.evento("richiesta_errore", f"Errore nell'elaborazione della richiesta: {e}",
+                              errore=type(e).__name__)
+            return 500, {"errore": "Errore interno"}
+        finally:
+            self._rilascia()
+
+    async def _query_stream(self, body: bytes, send) -> int:
+        """
+        Invia la risposta a pezzi (text/plain) man mano che l'LLM la genera.
+        Gli errori prima del primo pezzo diventano una risposta 500; dopo,
+        la risposta si chiude dove è arrivata.
+
+        Returns:
+            int: Codice di stato inviato
+        """
+        campi, rifiuto = await self._ammetti(body)
+        if rifiuto is not None:
+            await _invia_json(send, *rifiuto)
+            return rifiuto[0]
+        iniziata = False
+        try:
+            async for pezzo in agent.aprocess_query_stream(*campi):
+                if not iniziata:
+                    await _inizia(send, 200, b"text/plain; charset=utf-8")
+                    iniziata = True
+                await send({"type": "http.response.body", "body": pezzo.encode("utf-8"), "more_body": True})
+        except Exception as e:
+            telemetria.evento("richiesta_errore", f"Errore nell'elaborazione della richiesta: {e}",
+                              errore=type(e).__name__)
+            if not iniziata:
+                await _invia_json(send, 500, {"errore": "Errore interno"})
+                return 500
+        finally:
+            self._rilascia()
+        if not iniziata:
+            await _inizia(send, 200, b"text/plain; charset=utf-8")
+        await send({"type": "http.response.body", "body": b""})
+        return 200
+
+    async def _lifespan(self, receive, send):
+        while True:
+            messaggio = await receive()
+            if messaggio["type"] == "lifespan.startup":
+                try:
+                    await self.avvio()
+                except Exception as e:
+                    await send({"type": "lifespan.startup.failed", "message": str(e)})
+                    return
+                await send({"type": "lifespan.startup.complete"})
+            elif messaggio["type"] == "lifespan.shutdown":
+                await self.chiusura()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+
+        metodo, path = scope["method"], scope["path"]
+        if path == "/health" and metodo == "GET":
+            stato, dati = 200, {"status": "ok"}
+        elif path == "/ready" and metodo == "GET":
+            stato, dati = (200, {"status": "ready"}) if self.pronta else (503, {"status": "not ready"})
+        elif path == "/metrics" and metodo == "GET":
+            await _invia(send, 200, telemetria.esporta_prometheus().encode("utf-8"),
+                         b"text/plain; version=0.0.4; charset=utf-8")
+            return
+        elif path == "/query" and metodo == "POST":
+            with telemetria.span("richiesta_http", path=path):
+                stato, dati = await self._query(await _leggi_body(receive))
+            telemetria.incrementa("http_richieste_totale", path=path, stato=stato)
+        elif path == "/query/stream" and metodo == "POST":
+            with telemetria.span("richiesta_http", path=path):
+                stato = await self._query_stream(await _leggi_body(receive), send)
+            telemetria.incrementa("http_richieste_totale", path=path, stato=stato)
+            return
+        else:
+            stato, dati = 404, {"errore": "Endpoint non trovato"}
+        await _invia_json(send, stato, dati)
+
+
+async def _leggi_body(receive) -> bytes:
+    body = b""
+    while True:
+        messaggio = await receive()
+        body += messaggio.get("body", b"")
+        if not messaggio.get("more_body"):
+            return body
+
+
+async def _inizia(send, stato: int, content_type: bytes, headers: list = ()) -> None:
+    await send({
+        "type": "http.response.start",
+        "status": stato,
+        "headers": [(b"content-type", content_type), *headers],
+    })
+
+
+async def _invia(send, stato: int, corpo: bytes, content_type: bytes) -> None:
+    await _inizia(send, stato, content_type, [(b"content-length", str(len(corpo)).encode())])
+    await send({"type": "http.response.body", "body": corpo})
+
+
+async def _invia_json(send, stato: int, dati: dict) -> None:
+    corpo = json.dumps(dati, ensure_ascii=False).encode("utf-8")
+    await _invia(send, stato, corpo, b"application/json; charset=utf-8")
+
+
+app = AssistantApp()
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host=os.getenv("SERVER_HOST", "127.0.0.1"), port=int(os.getenv("SERVER_PORT", "8000")))
@@ -0,0 +1,113 @@
+import numpy as np
+
+
+def _a_matrice(embeddings) -> np.ndarray:
+    """
+    Converte una lista di embedding in una matrice float32 contigua.
+    Se le dimensioni non combaciano tronca tutte le righe alla dimensione minima.
+    """
+    if isinstance(embeddings, np.ndarray):
+        matrice = embeddings.astype(np.float32, copy=False)
+    else:
+        righe = list(embeddings)
+        if not righe:
+            return np.zeros((0, 0), dtype=np.float32)
+        min_dim = min(len(r) for r in righe)
+        matrice = np.array([r[:min_dim] for r in righe], dtype=np.float32)
+    if matrice.ndim == 1:
+        matrice = matrice.reshape(1, -1)
+    return np.ascontiguousarray(matrice)
+
+
+def normalizza_righe(matrice: np.ndarray) -> np.ndarray:
+    """Divide ogni riga per la sua norma (le righe nulle restano nulle)."""
+    norme = np.linalg.norm(matrice, axis=1, keepdims=True)
+    norme[norme == 0] = 1.0
+    return matrice / norme
+
+
+class SimilarityIndex:
+    """
+    Indice di similarità coseno costruito una sola volta sugli embedding.
+
+    Tiene una matrice float32 contigua con le righe già normalizzate, così per
+    ogni query basta un solo prodotto matrice-vettore.
+    """
+
+    def __init__(self, embeddings, normalizzata: bool = False):
+        matrice = _a_matrice(embeddings)
+        if not normalizzata and matrice.size:
+            matrice = np.ascontiguousarray(normalizza_righe(matrice), dtype=np.float32)
+        self.matrice = matrice
+
+    def __len__(self):
+        return self.matrice.shape[0]
+
+    @property
+    def dim(self) -> int:
+        return self.matrice.shape[1]
+
+    def _prepara_query(self, query):
+        """Restituisce (query normalizzata, matrice) con le dimensioni allineate."""
+        q = np.asarray(query, dtype=np.float32).reshape(-1)
+        matrice = self.matrice
+        if q.shape[0] > self.dim:
+            q = q[:self.dim]
+        elif q.shape[0] < self.dim:
+            # Caso raro: query più corta degli embedding salvati
+            matrice = normalizza_righe(matrice[:, :q.shape[0]])
+        norma = np.linalg.norm(q)
+        if norma > 0:
+            q = q / norma
+        return q, matrice
+
+    def punteggi(self, query) -> np.ndarray:
+        """Similarità coseno della query con tutte le righe dell'indice."""
+        if not len(self):
+            return np.zeros(0, dtype=np.float32)
+        q, matrice = self._prepara_query(query)
+        return matrice @ q
+
+    def punteggi_di(self, query, indici) -> np.ndarray:
+        """Similarità coseno della query con le sole righe `indici`."""
+        indici = np.asarray(indici, dtype=np.int64)
+        if not len(self) or not indici.size:
+            return np.zeros(indici.size, dtype=np.float32)
+        q, matrice = self._prepara_query(query)
+        return matrice[indici] @ q
+
+    def top_k(self, query, k: int = 1):
+        """
+        Restituisce le coppie (indice, punteggio) dei `k` elementi più simili,
+        ordinate per punteggio decrescente.
+        """
+        punteggi = self.punteggi(query)
+        if not punteggi.size or k <= 0:
+            return []
+        k = min(k, punteggi.shape[0])
+        if k < punteggi.shape[0]:
+            candidati = np.argpartition(-punteggi, k - 1)[:k]
+        else:
+            candidati = np.arange(punteggi.shape[0])
+        ordinati = candidati[np.argsort(-punteggi[candidati])]
+        return [(int(i), float(punteggi[i])) for i in ordinati]
+
+
+def rivaluta(matrice: np.ndarray, q: np.ndarray, righe: np.ndarray, stime: np.ndarray, k: int,
+             fattore: int = 10, min_candidati: int = 50):
+    """
+    Prende i migliori candidati secondo le `stime`, ne calcola il punteggio
+    esatto con i vettori completi e restituisce le coppie (indice, punteggio)
+    dei `k` migliori.
+    """
+    n_candidati = min(righe.size, max(k * fattore, min_candidati))
+    if n_candidati < righe.size:
+        scelti = np.argpartition(-stime, n_candidati - 1)[:n_candidati]
+        candidati = np.sort(righe[scelti])
+    else:
+        candidati = righe
+    punteggi = matrice[candidati] @ q
+    k = min(k, candidati.size)
+    migliori = np.argpartition(-punteggi, k - 1)[:k] if k < candidati.size else np.arange(candidati.size)
+    migliori = migliori[np.argsort(-punteggi[migliori])]
+    return [(int(candidati[i]), float(punteggi[i])) for i in migliori]
@@ -0,0 +1,314 @@
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from bisect import bisect_left
+
+# Metriche e tracce della pipeline.
+#
+# TELEMETRIA=1 attiva contatori e istogrammi (esportati in formato testo
+# Prometheus, vedi esporta_prometheus e l'endpoint /metrics di server.py);
+# TELEMETRIA_TRACCE=<file> scrive anche uno span JSON per riga.
+# Da spenta ogni chiamata si ferma al controllo di un booleano, tranne il
+# log degli eventi (vedi evento), che resta sempre attivo.
+
+# Bucket (secondi) per le durate delle fasi
+BUCKET_DURATE = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Bucket per i punteggi di similarità
+BUCKET_PUNTEGGI = (0.1, 0.2, 0.3, 0.4, 0.5, 0.55, 0.6, 0.7, 0.8, 0.9, 1.0)
+# Bucket per i token di una chiamata LLM
+BUCKET_TOKEN = (50, 100, 250, 500, 1000, 2000, 4000, 8000, 16000)
+
+DESCRIZIONI = {
+    "fase_durata_secondi": "Durata delle fasi della pipeline e dei tool",
+    "fase_errori_totale": "Fasi terminate con un'eccezione",
+    "llm_chiamate_totale": "Chiamate LLM per agente",
+    "llm_token_totale": "Token LLM consumati per agente e tipo (input/output)",
+    "llm_token_chiamata": "Token per singola chiamata LLM",
+    "llm_http_totale": "Risposte HTTP dell'API LLM per endpoint ed esito (codice di stato o errore)",
+    "llm_http_secondi": "Secondi fino agli header delle risposte dell'API LLM",
+    "llm_ritentativi_totale": "Richieste all'API LLM ripetute per endpoint e codice di stato",
+    "ricerca_punteggio": "Miglior punteggio di similarità per indice",
+    "ricerca_interna_totale": "Ricerche interne per metodo (lessicale, ibrida, vettoriale)",
+    "ricerca_fonte_totale": "Fonte scelta dalla ricerca interna",
+    "ricerca_web_totale": "Esito delle ricerche web",
+    "web_speculativa_totale": "Ricerche web speculative per motivo ed esito (usata, scartata, non_avviata se serviva ma non era partita)",
+    "web_speculativa_secondi_totale": "Secondi di ricerca web speculativa: risparmiati (usata) o sprecati (scartata)",
+    "sentimento_totale": "Sentimenti classificati dal modello locale o dall'LLM",
+    "cache_risposte_totale": "Esito della ricerca nella cache delle risposte",
+    "ticket_totale": "Ticket aperti per sentimento e ruolo",
+    "contesto_sezioni_totale": "Sezioni del contesto escluse o troncate per il budget di token",
+    "http_richieste_totale": "Richieste HTTP per endpoint e codice di stato",
+    "ttft_secondi": "Secondi fino al primo token delle risposte in streaming",
+    "eventi_totale": "Anomalie gestite (fallback, timeout, errori recuperati) per tipo",
+}
+
+_attiva = os.getenv("TELEMETRIA", "0").lower() in ("1", "true", "si")
+_path_tracce = os.getenv("TELEMETRIA_TRACCE") or None
+_file_tracce = None
+_lock = threading.Lock()
+_contatori = {}
+_istogrammi = {}
+_collettori = {}
+_span_corrente = contextvars.ContextVar("span_corrente", default=None)
+_logger = logging.getLogger("telemetria")
+
+
+def attiva(abilitata: bool = True, path_tracce: str = None) -> None:
+    """Accende o spegne la telemetria a runtime (e imposta il file delle tracce JSON)."""
+    global _attiva, _path_tracce, _file_tracce
+    with _lock:
+        _attiva = abilitata
+        if path_tracce != _path_tracce and _file_tracce is not None:
+            _file_tracce.close()
+            _file_tracce = None
+        _path_tracce = path_tracce
+
+
+def abilitata() -> bool:
+    return _attiva
+
+
+def azzera() -> None:
+    """Cancella tutte le metriche raccolte."""
+    with _lock:
+        _contatori.clear()
+        _istogrammi.clear()
+
+
+def _chiave(etichette: dict) -> tuple:
+    return tuple(sorted((k, str(v)) for k, v in etichette.items()))
+
+
+def incrementa(nome: str, valore: float = 1.0, **etichette) -> None:
+    """Incrementa il contatore `nome` con le etichette date."""
+    if not _attiva:
+        return
+    chiave = _chiave(etichette)
+    with _lock:
+        serie = _contatori.setdefault(nome, {})
+        serie[chiave] = serie.get(chiave, 0.0) + valore
+
+
+def osserva(nome: str, valore: float, bucket: tuple = BUCKET_DURATE, **etichette) -> None:
+    """Aggiunge `valore` all'istogramma `nome` con le etichette date."""
+    if not _attiva:
+        return
+    chiave = _chiave(etichette)
+    with _lock:
+        bucket_istogramma, serie = _istogrammi.setdefault(nome, (bucket, {}))
+        conteggi = serie.get(chiave)
+        if conteggi is None:
+            # Un conteggio per bucket più quello per +Inf, poi somma e totale
+            conteggi = serie[chiave] = [[0] * (len(bucket_istogramma) + 1), 0.0, 0]
+        conteggi[0][bisect_left(bucket_istogramma, valore)] += 1
+        conteggi[1] += valore
+        conteggi[2] += 1
+
+
+def registra_collettore(nome: str, fn) -> None:
+    """
+    Registra una funzione che restituisce un dict di valori numerici
+    (es. `EmbeddingCache.stats`), esportati come gauge `nome{statistica=...}`.
+    Un collettore con lo stesso nome viene sostituito.
+    """
+    with _lock:
+        _collettori[nome] = fn
+
+
+class _SpanNullo:
+    """Span usato a telemetria spenta: non fa nulla."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def imposta(self, chiave, valore):
+        pass
+
+    def aggiungi_evento(self, nome, **attributi):
+        pass
+
+
+_SPAN_NULLO = _SpanNullo()
+
+
+class Span:
+    """
+    Intervallo misurato: alla chiusura la durata finisce nell'istogramma
+    `fase_durata_secondi{fase=nome}` e, se attive, nelle tracce JSON.
+    Gli span aperti dentro uno span (anche in task asyncio e thread di
+    `asyncio.to_thread`) ne diventano figli.
+    """
+
+    def __init__(self, nome: str, attributi: dict):
+        self.nome = nome
+        self.attributi = attributi
+        self.span_id = uuid.uuid4().hex[:16]
+        self.trace_id = None
+        self.parent_id = None
+        self._token = None
+
+    def imposta(self, chiave, valore):
+        """Aggiunge un attributo allo span (es. la fonte scelta o un punteggio)."""
+        self.attributi[chiave] = valore
+
+    def aggiungi_evento(self, nome, **attributi):
+        """Registra un evento puntuale nello span (lista "eventi" delle tracce)."""
+        self.attributi.setdefault("eventi", []).append({"nome": nome, "istante": time.time(), **attributi})
+
+    def __enter__(self):
+        padre = _span_corrente.get()
+        if padre is not None:
+            self.trace_id, self.parent_id = padre.trace_id, padre.span_id
+        else:
+            self.trace_id = uuid.uuid4().hex
+        self._token = _span_corrente.set(self)
+        self._inizio_epoch = time.time()
+        self._inizio = time.perf_counter()
+        return self
+
+    def __exit__(self, tipo_eccezione, eccezione, tb):
+        durata = time.perf_counter() - self._inizio
+        _span_corrente.reset(self._token)
+        osserva("fase_durata_secondi", durata, fase=self.nome)
+        if tipo_eccezione is not None:
+            incrementa("fase_errori_totale", fase=self.nome, errore=tipo_eccezione.__name__)
+            self.attributi["errore"] = f"{tipo_eccezione.__name__}: {eccezione}"
+        if _path_tracce:
+            _scrivi_traccia({
+                "trace_id": self.trace_id,
+                "span_id": self.span_id,
+                "parent_id": self.parent_id,
+                "nome": self.nome,
+                "inizio": self._inizio_epoch,
+                "durata": durata,
+                "attributi": self.attributi,
+            })
+        return False
+
+
+def span(nome: str, **attributi):
+    """
+    Context manager che misura una fase:
+
+        with telemetria.span("ricerca_interna") as s:
+            ...
+            s.imposta("fonte", "faq")
+    """
+    if not _attiva:
+        return _SPAN_NULLO
+    return Span(nome, attributi)
+
+
+def span_corrente():
+    """Span aperto nel contesto corrente (lo span nullo se non ce n'è uno)."""
+    if not _attiva:
+        return _SPAN_NULLO
+    return _span_corrente.get() or _SPAN_NULLO
+
+
+def evento(nome: str, messaggio: str = None, **etichette) -> None:
+    """
+    Segnala un'anomalia gestita (fallback, timeout, errore recuperato):
+    contatore `eventi_totale{evento=nome, ...}`, evento nello span corrente
+    e, con `messaggio`, una riga WARNING sul logger "telemetria".
+    Le `etichette` diventano etichette Prometheus: vanno tenute a pochi valori.
+    """
+    if messaggio is not None:
+        _logger.warning(messaggio)
+    if not _attiva:
+        return
+    incrementa("eventi_totale", evento=nome, **etichette)
+    span_corrente().aggiungi_evento(nome, messaggio=messaggio, **etichette)
+
+
+def _scrivi_traccia(record: dict) -> None:
+    global _file_tracce
+    riga = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+    with _lock:
+        if _path_tracce is None:
+            return
+        if _file_tracce is None:
+            _file_tracce = open(_path_tracce, "a", encoding="utf-8", buffering=1)
+        _file_tracce.write(riga)
+
+
+def registra_uso_llm(messaggio, agente: str) -> None:
+    """
+    Conta una chiamata LLM di `agente` e i token usati, se il messaggio
+    restituito da LangChain riporta `usage_metadata`.
+    """
+    if not _attiva:
+        return
+    incrementa("llm_chiamate_totale", agente=agente)
+    uso = getattr(messaggio, "usage_metadata", None)
+    if not uso:
+        return
+    for tipo in ("input", "output"):
+        token = uso.get(f"{tipo}_tokens")
+        if token:
+            incrementa("llm_token_totale", token, agente=agente, tipo=tipo)
+            osserva("llm_token_chiamata", token, BUCKET_TOKEN, agente=agente, tipo=tipo)
+    span_corrente().imposta("token", uso.get("total_tokens"))
+
+
+def _etichette(chiave: tuple, extra: tuple = ()) -> str:
+    coppie = list(chiave) + list(extra)
+    if not coppie:
+        return ""
+    testo = ",".join(
+        '{}="{}"'.format(k, v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in coppie
+    )
+    return "{" + testo + "}"
+
+
+def _numero(valore) -> str:
+    return repr(float(valore)) if not float(valore).is_integer() else str(int(valore))
+
+
+def esporta_prometheus() -> str:
+    """Tutte le metriche nel formato testo di Prometheus (versione 0.0.4)."""
+    with _lock:
+        contatori = {nome: dict(serie) for nome, serie in _contatori.items()}
+        istogrammi = {
+            nome: (bucket, {k: (list(c[0]), c[1], c[2]) for k, c in serie.items()})
+            for nome, (bucket, serie) in _istogrammi.items()
+        }
+        collettori = list(_collettori.items())
+
+    righe = []
+    for nome in sorted(contatori):
+        righe.append(f"# HELP {nome} {DESCRIZIONI.get(nome, nome)}")
+        righe.append(f"# TYPE {nome} counter")
+        for chiave, valore in sorted(contatori[nome].items()):
+            righe.append(f"{nome}{_etichette(chiave)} {_numero(valore)}")
+    for nome in sorted(istogrammi):
+        bucket, serie = istogrammi[nome]
+        righe.append(f"# HELP {nome} {DESCRIZIONI.get(nome, nome)}")
+        righe.append(f"# TYPE {nome} histogram")
+        for chiave, (conteggi, somma, totale) in sorted(serie.items()):
+            cumulato = 0
+            for limite, conteggio in zip(list(bucket) + ["+Inf"], conteggi):
+                cumulato += conteggio
+                le = limite if limite == "+Inf" else _numero(limite)
+                righe.append(f"{nome}_bucket{_etichette(chiave, (('le', le),))} {cumulato}")
+            righe.append(f"{nome}_sum{_etichette(chiave)} {_numero(somma)}")
+            righe.append(f"{nome}_count{_etichette(chiave)} {totale}")
+    for nome, fn in sorted(collettori, key=lambda c: c[0]):
+        try:
+            valori = fn()
+        except Exception as e:
+            _logger.warning(f"Errore nel collettore di metriche {nome}: {e}")
+            continue
+        righe.append(f"# TYPE {nome} gauge")
+        for statistica, valore in sorted(valori.items()):
+            if isinstance(valore, (int, float)):
+                righe.append(f'{nome}{{statistica="{statistica}"}} {_numero(valore)}')
+    return "\n".join(righe) + "\n"
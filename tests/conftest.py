@@ -0,0 +1,17 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+# I moduli del progetto stanno nella radice del repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def corpus():
+    """Embedding normalizzati raggruppati in cluster, come quelli di un corpus reale."""
+    rng = np.random.default_rng(42)
+    centri = rng.standard_normal((40, 64)).astype(np.float32)
+    righe = centri[rng.integers(0, len(centri), 4000)] + 0.6 * rng.standard_normal((4000, 64)).astype(np.float32)
+    return righe / np.linalg.norm(righe, axis=1, keepdims=True)
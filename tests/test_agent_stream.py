@@ -0,0 +1,54 @@
+import asyncio
+
+import pytest
+
+import telemetria
+
+# agent richiede LangChain
+agent = pytest.importorskip("agent")
+
+
+@pytest.fixture
+def pipeline_finta(monkeypatch):
+    """Pipeline senza ricerca né LLM: lo stream genera i pezzi indicati."""
+    pezzi = []
+
+    async def prepara(domanda, user, cId, preprocessing_fuso=None, tempi=None):
+        return {"sentiment": "Neutro", "faq_result": {}, "web_results": None, "fonti": None, "vettore": None,
+                "contesto": None, "domanda_pulita": domanda, "risposta_cache": None}
+
+    async def stream(*argomenti):
+        for pezzo in pezzi:
+            yield pezzo
+
+    async def finalizza(*argomenti):
+        return ""
+
+    monkeypatch.setattr(agent, "_aprepara_risposta", prepara)
+    monkeypatch.setattr(agent, "astream_assistance", stream)
+    monkeypatch.setattr(agent, "_afinalizza_risposta", finalizza)
+    telemetria.attiva(True)
+    telemetria.azzera()
+    yield pezzi
+    telemetria.azzera()
+    telemetria.attiva(False)
+
+
+async def raccogli(stream):
+    return [pezzo async for pezzo in stream]
+
+
+def test_stream_vuoto_con_telemetria(pipeline_finta):
+    metriche = {}
+    assert asyncio.run(raccogli(agent.aprocess_query_stream("domanda", "Cliente", "c1", metriche=metriche))) == []
+    assert metriche["ttft"] is None
+    assert "ttft_secondi_count" not in telemetria.esporta_prometheus()
+
+
+def test_stream_misura_il_primo_token(pipeline_finta):
+    pipeline_finta.extend(["Buon", "giorno"])
+    metriche = {}
+    pezzi = asyncio.run(raccogli(agent.aprocess_query_stream("domanda", "Cliente", "c1", metriche=metriche)))
+    assert pezzi == ["Buon", "giorno"]
+    assert 0 <= metriche["ttft"] <= metriche["totale"]
+    assert "ttft_secondi_count 1" in telemetria.esporta_prometheus()
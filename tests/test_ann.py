@@ -0,0 +1,44 @@
+import numpy as np
+
+from ann import IVFIndex, carica_ivf, query_di_prova, salva_ivf, valuta
+from embedding_store import percorso_vettori, salva_vettori
+from similarity import SimilarityIndex
+
+
+def test_richiamo_rispetto_alla_ricerca_esatta(corpus):
+    indice = IVFIndex.costruisci(corpus, nprobe=8)
+    query = query_di_prova(corpus, 100)
+    assert valuta(indice, query, k=10)["richiamo"] >= 0.9
+    # Più liste controllate, richiamo non peggiore
+    assert valuta(indice, query, k=10, nprobe=32)["richiamo"] >= valuta(indice, query, k=10, nprobe=2)["richiamo"]
+
+
+def test_tutte_le_liste_equivale_alla_ricerca_esatta(corpus):
+    indice = IVFIndex.costruisci(corpus)
+    esatto = SimilarityIndex(corpus, normalizzata=True)
+    n_liste = indice.centroidi.shape[0]
+    for q in query_di_prova(corpus, 20):
+        approssimati = indice.top_k(q, 5, nprobe=n_liste)
+        veri = esatto.top_k(q, 5)
+        assert [i for i, _ in approssimati] == [i for i, _ in veri]
+        np.testing.assert_allclose([s for _, s in approssimati], [s for _, s in veri], rtol=1e-5)
+
+
+def test_liste_coprono_tutte_le_righe(corpus):
+    indice = IVFIndex.costruisci(corpus, n_liste=30)
+    assert indice.offset[-1] == len(corpus)
+    assert sorted(indice.ordine.tolist()) == list(range(len(corpus)))
+
+
+def test_salva_e_carica(corpus, tmp_path):
+    path_json = str(tmp_path / "kb.json")
+    salva_vettori(percorso_vettori(path_json), corpus)
+    indice = IVFIndex.costruisci(corpus, n_liste=20)
+    salva_ivf(path_json, indice)
+
+    caricato = carica_ivf(path_json, corpus)
+    np.testing.assert_array_equal(caricato.ordine, indice.ordine)
+    q = corpus[7]
+    assert caricato.top_k(q, 3) == indice.top_k(q, 3)
+    # Corpus con un altro numero di righe: l'indice non vale più
+    assert carica_ivf(path_json, corpus[:100]) is None
@@ -0,0 +1,51 @@
+import asyncio
+import json
+
+import pytest
+
+# batch_runner importa agent, che richiede LangChain
+batch_runner = pytest.importorskip("batch_runner")
+
+
+def richiesta(id_richiesta, conversation_id):
+    return {"id": id_richiesta, "question": f"domanda {id_richiesta}", "user": "Cliente",
+            "conversation_id": conversation_id}
+
+
+def test_ripresa_dalla_prima_richiesta_fallita():
+    richieste = [richiesta(0, "a"), richiesta(1, "b"), richiesta(2, "a"), richiesta(3, "a"), richiesta(4, "b")]
+    da_elaborare = batch_runner.richieste_da_elaborare(richieste, completate={0, 1, 3, 4})
+    # La 3 era riuscita dopo il fallimento della 2: si rifà in ordine
+    assert {cid: [r["id"] for r in lista] for cid, lista in da_elaborare.items()} == {"a": [2, 3]}
+
+
+def test_conta_l_ultimo_risultato(tmp_path):
+    path_output = tmp_path / "risultati.jsonl"
+    righe = [{"id": 0, "risposta": "ok"}, {"id": 1, "errore": "Timeout"}, {"id": 0, "errore": "Timeout"},
+             {"id": 1, "risposta": "ok"}]
+    path_output.write_text("\n".join(json.dumps(r) for r in righe) + '\n{"id": 2, "risp', encoding="utf-8")
+    assert batch_runner.richieste_completate(str(path_output)) == {1}
+
+
+def test_ripresa_non_duplica_la_memoria(tmp_path, monkeypatch):
+    from memory_store import MemoryStore
+    store = MemoryStore(str(tmp_path / "memoria.db"), str(tmp_path))
+    fallite = {1}
+
+    async def aprocess_query(domanda, user, cId, preprocessing_fuso=None, tempi=None):
+        if domanda in {f"domanda {i}" for i in fallite}:
+            raise TimeoutError("scaduto")
+        store.aggiungi(cId, {"timestamp": "2024-05-01T10:00:00", "user_query": domanda, "ai_response": "ok"})
+        return "ok"
+
+    monkeypatch.setattr(batch_runner, "get_memory_store", lambda: store)
+    monkeypatch.setattr(batch_runner.agent, "aprocess_query", aprocess_query)
+    monkeypatch.setattr(batch_runner.agent, "avvia", lambda: None)
+    richieste = [richiesta(i, "a") for i in range(3)]
+    path_output = str(tmp_path / "risultati.jsonl")
+
+    asyncio.run(batch_runner.BatchRunner(path_output, concorrenza=1).esegui(richieste))
+    assert [i["user_query"] for i in store.tutte("a")] == ["domanda 0", "domanda 2"]
+    fallite.clear()
+    asyncio.run(batch_runner.BatchRunner(path_output, concorrenza=1).esegui(richieste))
+    assert [i["user_query"] for i in store.tutte("a")] == ["domanda 0", "domanda 1", "domanda 2"]
@@ -0,0 +1,65 @@
+import threading
+import time
+
+import pytest
+
+from cache_utils import LRUCache, SingleFlight, normalizza_testo
+
+
+def test_normalizza_testo():
+    assert normalizza_testo("  Orari   DEL negozio\n") == "orari del negozio"
+
+
+def test_lru_elimina_il_meno_recente():
+    cache = LRUCache(max_size=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert "b" not in cache
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.get("b", "manca") == "manca"
+
+
+def test_lru_scadenza():
+    cache = LRUCache(ttl=0.05)
+    cache.put("a", 1)
+    assert cache.get("a") == 1
+    time.sleep(0.06)
+    assert cache.get("a") is None
+
+
+def test_single_flight_accorpa_le_chiamate():
+    gruppo = SingleFlight()
+    sblocca = threading.Event()
+    chiamate = []
+
+    def lenta():
+        chiamate.append(1)
+        sblocca.wait(5)
+        return "risultato"
+
+    risultati = []
+    thread = [threading.Thread(target=lambda: risultati.append(gruppo.do("q", lenta))) for _ in range(4)]
+    for t in thread:
+        t.start()
+    while gruppo.seguaci("q") < 3:
+        time.sleep(0.001)
+    sblocca.set()
+    for t in thread:
+        t.join(5)
+    assert risultati == ["risultato"] * 4
+    assert len(chiamate) == 1 and gruppo.accorpate == 3
+    assert gruppo.seguaci("q") == 0
+
+
+def test_single_flight_propaga_gli_errori():
+    gruppo = SingleFlight()
+
+    def errore():
+        raise ValueError("backend non disponibile")
+
+    with pytest.raises(ValueError):
+        gruppo.do("q", errore)
+    # Dopo l'errore la chiave si può riprovare
+    assert gruppo.do("q", lambda: 1) == 1
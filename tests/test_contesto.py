@@ -0,0 +1,46 @@
+import pytest
+
+import contesto
+from contesto import componi, conta_token, tronca
+
+
+@pytest.fixture(autouse=True)
+def senza_tiktoken(monkeypatch):
+    """Stima len/4, indipendente dalla presenza di tiktoken."""
+    monkeypatch.setattr(contesto, "_encoder", None)
+    monkeypatch.setattr(contesto, "_encoder_caricato", True)
+
+
+def test_stima_len_4():
+    assert conta_token("") == 0
+    assert conta_token("a" * 8) == 2
+    assert conta_token("a" * 9) == 3
+    assert tronca("a" * 8, 2) == "a" * 8
+    assert tronca("a" * 20, 2) == "aaaaaaa…"
+    assert tronca("testo", 0) == ""
+
+
+def test_ordine_di_taglio():
+    sezioni = [
+        ("ruolo", "r" * 40, False),           # 10 token
+        ("faq", "f" * 400, True),             # 100 token
+        ("turno[0]", "t" * 40, False),        # 10 token
+        ("web[0]", "w" * 400, True),          # 100 token
+    ]
+    # Entra tutto
+    assert componi(sezioni, budget=300).split("\n") == ["r" * 40, "f" * 400, "t" * 40, "w" * 400]
+    # La FAQ si accorcia al residuo, turno e web restano fuori
+    incluse = componi(sezioni, budget=60).split("\n")
+    assert incluse[0] == "r" * 40
+    assert incluse[1].startswith("f") and incluse[1].endswith("…") and conta_token(incluse[1]) <= 60 - 11 - 1
+    assert len(incluse) == 2
+    # Residuo sotto MIN_TOKEN_SEZIONE: la FAQ si esclude, il turno successivo entra
+    assert componi(sezioni, budget=11 + contesto.MIN_TOKEN_SEZIONE).split("\n") == ["r" * 40, "t" * 40]
+
+
+def test_ruolo_oltre_il_budget_resta_troncato():
+    sezioni = [("ruolo", "r" * 400, False), ("faq", "f" * 40, True)]
+    incluse = componi(sezioni, budget=30).split("\n")
+    assert len(incluse) == 1
+    assert incluse[0].startswith("r") and incluse[0].endswith("…")
+    assert conta_token(incluse[0]) <= 29
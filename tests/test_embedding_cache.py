@@ -0,0 +1,41 @@
+import numpy as np
+
+from embedding_cache import EmbeddingCache
+
+
+class EmbeddingFinti:
+    def __init__(self):
+        self.testi = []
+
+    def embed_documents(self, testi):
+        self.testi.extend(testi)
+        return [[float(len(t)), 1.0, 0.5] for t in testi]
+
+
+def test_embed_usa_il_testo_originale_e_la_chiave_normalizzata():
+    cache = EmbeddingCache()
+    modello = EmbeddingFinti()
+    primo = cache.embed("Come resetto la Password?", "m", modello)
+    secondo = cache.embed("  come resetto la password? ", "m", modello)
+
+    assert modello.testi == ["Come resetto la Password?"]
+    assert secondo is primo
+    assert isinstance(primo, np.ndarray) and primo.dtype == np.float32
+    assert not primo.flags.writeable
+    assert cache.stats() == {"hits": 1, "hits_disco": 0, "misses": 1, "dimensione": 1}
+
+
+def test_persistenza_su_disco(tmp_path):
+    path_db = str(tmp_path / "embedding.db")
+    cache = EmbeddingCache(path_db=path_db)
+    originale = cache.embed("orari del negozio", "m", EmbeddingFinti())
+
+    riaperta = EmbeddingCache(path_db=path_db)
+    modello = EmbeddingFinti()
+    letto = riaperta.embed("Orari del negozio", "m", modello)
+
+    assert modello.testi == []
+    np.testing.assert_array_equal(letto, originale)
+    assert letto.dtype == np.float32
+    assert riaperta.stats()["hits_disco"] == 1
+    assert riaperta.get("orari del negozio", "altro-modello") is None
@@ -0,0 +1,50 @@
+import json
+
+import numpy as np
+import pytest
+
+from embedding_store import (
+    carica_corpus, carica_manifest, carica_vettori, firma_corpus, percorso_manifest, percorso_vettori, salva_corpus,
+    versione_corpus,
+)
+
+
+def test_round_trip_npy_e_manifest(tmp_path):
+    path_json = str(tmp_path / "faq.json")
+    records = [{"question": "a", "answer": "1"}, {"question": "b", "answer": "2"}]
+    salva_corpus(path_json, records, [[3.0, 4.0], [0.0, 2.0]], hashes=["h1", "h2"], modello="modello-x")
+
+    assert percorso_vettori(path_json) == str(tmp_path / "faq.npy")
+    letti, vettori = carica_corpus(path_json, "vec")
+    assert letti == records
+    assert isinstance(vettori, np.memmap) and vettori.dtype == np.float32
+    np.testing.assert_allclose(vettori, [[0.6, 0.8], [0.0, 1.0]], rtol=1e-6)
+    assert carica_manifest(path_json) == {"modello": "modello-x", "hash": ["h1", "h2"]}
+    assert firma_corpus(path_json, 2) != firma_corpus(path_json, 3) == "righe:3"
+    assert versione_corpus(path_json, str(tmp_path / "kb.json"))[1] is None
+
+
+def test_senza_manifest(tmp_path):
+    path_json = str(tmp_path / "kb.json")
+    salva_corpus(path_json, [{"a": 1}], [[1.0, 0.0]])
+    assert not (tmp_path / "kb.manifest.json").exists()
+    assert carica_manifest(path_json) == {"modello": None, "hash": []}
+    assert percorso_manifest(path_json) == str(tmp_path / "kb.manifest.json")
+    assert carica_vettori(percorso_vettori(path_json)).shape == (1, 2)
+
+
+def test_vecchio_formato_con_vettori_nel_json(tmp_path):
+    path_json = tmp_path / "kb.json"
+    path_json.write_text(json.dumps([{"nome": "x", "vec": [0.0, 5.0]}]), encoding="utf-8")
+    records, vettori = carica_corpus(str(path_json), "vec")
+    assert records == [{"nome": "x"}]
+    np.testing.assert_allclose(vettori, [[0.0, 1.0]])
+
+
+def test_npy_non_allineato_ai_record(tmp_path):
+    path_json = str(tmp_path / "faq.json")
+    salva_corpus(path_json, [{"question": "a"}], [[1.0, 0.0]])
+    with open(path_json, "w", encoding="utf-8") as f:
+        json.dump([{"question": "a"}, {"question": "b"}], f)
+    with pytest.raises(ValueError, match="rilanciare ingest.py"):
+        carica_corpus(path_json, "vec")
@@ -0,0 +1,73 @@
+import json
+
+import numpy as np
+import pytest
+
+from embedding_store import carica_corpus, carica_manifest
+
+# ingest usa llm_client, che richiede LangChain
+ingest = pytest.importorskip("ingest")
+
+
+class EmbeddingsFinti:
+    """Vettore deterministico per testo; registra i testi ricevuti."""
+
+    def __init__(self):
+        self.testi = []
+
+    def embed_documents(self, testi):
+        self.testi.extend(testi)
+        return [[float(len(t)), float(sum(map(ord, t)) % 97), 1.0] for t in testi]
+
+
+def scrivi(path_json, records):
+    path_json.write_text(json.dumps(records, ensure_ascii=False), encoding="utf-8")
+
+
+def aggiorna(path_json, modello):
+    return ingest.aggiorna_corpus(str(path_json), "dVec", ingest.testo_faq, modello, batch_size=2)
+
+
+def vettore_atteso(testo):
+    v = np.array(EmbeddingsFinti().embed_documents([testo])[0], dtype=np.float32)
+    return v / np.linalg.norm(v)
+
+
+def test_ricalcola_solo_i_record_nuovi_o_cambiati(tmp_path):
+    path_json = tmp_path / "faq.json"
+    scrivi(path_json, [{"domanda": d, "risposta": "r"} for d in ("uno", "due", "tre")])
+    modello = EmbeddingsFinti()
+    assert aggiorna(path_json, modello) == 3
+    # Nessuna modifica: nessun embedding
+    assert aggiorna(path_json, modello) == 0
+
+    # "due" modificato, "tre" eliminato, "quattro" aggiunto
+    scrivi(path_json, [{"domanda": d, "risposta": "r"} for d in ("uno", "due!", "quattro")])
+    modello = EmbeddingsFinti()
+    assert aggiorna(path_json, modello) == 2
+    assert sorted(modello.testi) == ["due!", "quattro"]
+    records, vettori = carica_corpus(str(path_json), "dVec")
+    assert [r["domanda"] for r in records] == ["uno", "due!", "quattro"]
+    for r, v in zip(records, vettori):
+        np.testing.assert_allclose(v, vettore_atteso(r["domanda"]), rtol=1e-6)
+    assert len(carica_manifest(str(path_json))["hash"]) == 3
+
+
+def test_cambio_di_modello_ricalcola_tutto(tmp_path, monkeypatch):
+    path_json = tmp_path / "faq.json"
+    scrivi(path_json, [{"domanda": d} for d in ("uno", "due")])
+    aggiorna(path_json, EmbeddingsFinti())
+    monkeypatch.setattr(ingest, "EMBEDDING_MODEL", "altro-modello")
+    assert aggiorna(path_json, EmbeddingsFinti()) == 2
+    assert carica_manifest(str(path_json))["modello"] == "altro-modello"
+
+
+def test_migrazione_riusa_i_vettori_nel_json(tmp_path):
+    path_json = tmp_path / "faq.json"
+    scrivi(path_json, [{"domanda": "uno", "dVec": [0.0, 3.0, 4.0]}, {"domanda": "due"}])
+    modello = EmbeddingsFinti()
+    assert aggiorna(path_json, modello) == 1
+    assert modello.testi == ["due"]
+    records, vettori = carica_corpus(str(path_json), "dVec")
+    assert "dVec" not in records[0]
+    np.testing.assert_allclose(vettori[0], [0.0, 0.6, 0.8], rtol=1e-6)
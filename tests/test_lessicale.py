@@ -0,0 +1,63 @@
+import lessicale
+from lessicale import BM25Index, fusione_rrf, tokenizza
+
+FAQ = [
+    "Come posso reimpostare la password dell'account?",
+    "Quali sono gli orari di apertura del negozio?",
+    "Come richiedo il reso di un prodotto difettoso?",
+    "Il modello TA-1200 è compatibile con il caricatore rapido?",
+    "Quanto costa la spedizione all'estero?",
+]
+
+
+def test_tokenizza():
+    # Accenti, elisioni e parole vuote ("perché") spariscono, le parole restano con la radice
+    assert tokenizza("Perché l'account è bloccato?") == ["account", "blocc"]
+    assert tokenizza("Ricambi per TA-1200") == ["ricamb", "ta-1200", "ta", "1200"]
+    assert tokenizza("il e di") == []
+
+
+def test_cerca_ordina_per_rilevanza():
+    indice = BM25Index(FAQ)
+    risultati = indice.cerca("password account", 3)
+    assert risultati[0][0] == 0
+    punteggi = [score for _, score in risultati]
+    assert all(score > 0 for score in punteggi) and punteggi == sorted(punteggi, reverse=True)
+    assert indice.cerca("ornitorinco", 3) == []
+
+
+def test_codice_prodotto():
+    indice = BM25Index(FAQ)
+    assert indice.cerca("TA-1200", 1)[0][0] == 3
+    assert indice.cerca("ta 1200", 1)[0][0] == 3
+
+
+def test_copertura_e_match_sicuro():
+    indice = BM25Index(FAQ)
+    copertura_documento, copertura_query = indice.copertura(FAQ[1], 1)
+    assert copertura_documento > 0.99 and copertura_query > 0.99
+    assert indice.match_sicuro("quali sono gli orari di apertura del negozio") == (1, indice.copertura(FAQ[1], 1)[0])
+    # Query troppo generica: nessun match sicuro
+    assert indice.match_sicuro("come") is None
+    assert indice.match_sicuro("orari") is None
+
+
+def test_indice_vuoto():
+    indice = BM25Index([])
+    assert len(indice) == 0
+    assert indice.cerca("password") == []
+    assert indice.match_sicuro("password") is None
+
+
+def test_testo_record():
+    record = {"titolo": "Garanzia", "tag": ["reso", "rimborso"], "dettagli": {"durata": "2 anni"}, "vec": [0.1]}
+    assert lessicale.testo_record(record) == "Garanzia reso rimborso 2 anni"
+
+
+def test_fusione_rrf():
+    vettoriali = [(1, 0.9), (2, 0.8), (3, 0.7)]
+    lessicali = [(3, 12.0), (1, 8.0), (4, 2.0)]
+    # 1 è in cima a entrambe, 3 compare in entrambe, 2 e 4 in una sola
+    assert fusione_rrf(vettoriali, lessicali) == [1, 3, 2, 4]
+    assert fusione_rrf([], lessicali) == [3, 1, 4]
+    assert fusione_rrf() == []
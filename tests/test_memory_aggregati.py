@@ -0,0 +1,85 @@
+import sqlite3
+
+from memory_store import MemoryStore
+
+
+def interazione(timestamp: str, ruolo: str, sentimento: str) -> dict:
+    return {"timestamp": timestamp, "user_query": "domanda", "ai_response": "risposta",
+            "user_role": ruolo, "sentiment": sentimento}
+
+
+STORIA = [
+    ("c1", interazione("2024-05-01T09:00:00", "Cliente", "Neutro")),
+    ("c1", interazione("2024-05-01T09:05:00", "Cliente", "Negativo")),
+    ("c1", interazione("2024-05-02T08:00:00", "Cliente", "Negativo")),
+    ("c2", interazione("2024-05-02T10:00:00", "Partner", "Positivo")),
+    ("c2", interazione("2024-06-01T10:00:00", "Partner", None)),
+]
+
+
+def crea_store(tmp_path) -> MemoryStore:
+    store = MemoryStore(str(tmp_path / "memoria.db"), str(tmp_path))
+    for conversation_id, i in STORIA:
+        store.aggiungi(conversation_id, i)
+    return store
+
+
+def tabelle_aggregati(store: MemoryStore) -> dict:
+    conn = store.db.connessione()
+    return {tabella: sorted(tuple(r) for r in conn.execute(f"SELECT * FROM {tabella}"))
+            for tabella in ("riepiloghi", "sentimenti_conversazione", "statistiche_giornaliere")}
+
+
+def test_riepilogo(tmp_path):
+    store = crea_store(tmp_path)
+    assert store.riepilogo("c1") == {
+        "turni": 3,
+        "inizio": "2024-05-01T09:00:00",
+        "fine": "2024-05-02T08:00:00",
+        "sentimenti": {"Neutro": 1, "Negativo": 2},
+    }
+    assert store.riepilogo("c2")["sentimenti"] == {"Positivo": 1, "": 1}
+    assert store.riepilogo("sconosciuta") is None
+
+
+def test_statistiche(tmp_path):
+    store = crea_store(tmp_path)
+    assert store.statistiche(("mese",)) == [{"mese": "2024-05", "n": 4}, {"mese": "2024-06", "n": 1}]
+    assert store.statistiche(("user_role", "sentiment"), dal="2024-05-02", al="2024-05-31") == [
+        {"user_role": "Cliente", "sentiment": "Negativo", "n": 1},
+        {"user_role": "Partner", "sentiment": "Positivo", "n": 1},
+    ]
+    assert store.statistiche(()) == [{"n": 5}]
+
+
+def test_ricostruzione_uguale_agli_aggregati_incrementali(tmp_path):
+    store = crea_store(tmp_path)
+    incrementali = tabelle_aggregati(store)
+    store.ricostruisci_aggregati()
+    assert tabelle_aggregati(store) == incrementali
+
+
+def test_database_senza_aggregati_viene_completato(tmp_path):
+    store = crea_store(tmp_path)
+    attesi = tabelle_aggregati(store)
+    # Database scritto prima che esistessero gli aggregati
+    conn = sqlite3.connect(store.db.path_db)
+    conn.executescript("DROP TABLE riepiloghi; DROP TABLE sentimenti_conversazione; "
+                       "DROP TABLE statistiche_giornaliere;")
+    conn.close()
+
+    riaperto = MemoryStore(store.db.path_db, str(tmp_path))
+    assert tabelle_aggregati(riaperto) == attesi
+    assert riaperto.riepilogo("c1")["turni"] == 3
+
+
+def test_tronca_aggiorna_gli_aggregati(tmp_path):
+    store = crea_store(tmp_path)
+    assert store.tronca("c1", 1) == 2
+    assert store.tronca("c2", 0) == 2
+    incrementali = tabelle_aggregati(store)
+    store.ricostruisci_aggregati()
+    assert tabelle_aggregati(store) == incrementali
+    assert store.riepilogo("c1") == {"turni": 1, "inizio": "2024-05-01T09:00:00", "fine": "2024-05-01T09:00:00",
+                                     "sentimenti": {"Neutro": 1}}
+    assert store.riepilogo("c2") is None
@@ -0,0 +1,76 @@
+import json
+import threading
+
+from memory_store import MemoryStore
+
+
+def interazione(n: int, timestamp: str = None, ruolo: str = "Cliente", sentimento: str = "Neutro") -> dict:
+    return {
+        "timestamp": timestamp or f"2024-05-01T10:00:{n:02d}",
+        "user_query": f"domanda {n}",
+        "ai_response": f"risposta {n}",
+        "user_role": ruolo,
+        "sentiment": sentimento,
+    }
+
+
+def test_aggiungi_e_rileggi(tmp_path):
+    store = MemoryStore(str(tmp_path / "memoria.db"), str(tmp_path))
+    for n in range(5):
+        assert store.aggiungi("c1", interazione(n)) == n + 1
+    store.aggiungi("c2", interazione(0))
+
+    assert store.conta("c1") == 5
+    assert [i["user_query"] for i in store.ultime("c1", 2)] == ["domanda 4", "domanda 3"]
+    assert store.tutte("c1")[0] == interazione(0)
+    assert store.conta("sconosciuta") == 0 and store.ultime("sconosciuta") == []
+
+
+def test_persistenza_tra_istanze(tmp_path):
+    path_db = str(tmp_path / "memoria.db")
+    MemoryStore(path_db, str(tmp_path)).aggiungi("c1", interazione(1))
+    assert MemoryStore(path_db, str(tmp_path)).tutte("c1") == [interazione(1)]
+
+
+def test_migrazione_json(tmp_path):
+    storia = [interazione(2), interazione(1)]
+    path_json = tmp_path / "conversation_memory_c1.json"
+    path_json.write_text(json.dumps(storia), encoding="utf-8")
+
+    store = MemoryStore(str(tmp_path / "memoria.db"), str(tmp_path))
+    assert store.tutte("c1") == [interazione(1), interazione(2)]
+    assert not path_json.exists()
+    assert (tmp_path / "conversation_memory_c1.json.migrato").exists()
+    assert store.aggiungi("c1", interazione(3)) == 3
+
+
+def test_scritture_concorrenti(tmp_path):
+    store = MemoryStore(str(tmp_path / "memoria.db"), str(tmp_path))
+
+    def scrivi(base):
+        for n in range(20):
+            store.aggiungi("c1", interazione(base + n))
+
+    thread = [threading.Thread(target=scrivi, args=(i * 20,)) for i in range(4)]
+    for t in thread:
+        t.start()
+    for t in thread:
+        t.join()
+    assert store.conta("c1") == 80
+    assert len(store.tutte("c1")) == 80
+
+
+def test_tronca_prima_di_rielaborare(tmp_path):
+    store = MemoryStore(str(tmp_path / "memoria.db"), str(tmp_path))
+    # Turno 1 fallito, turno 2 riuscito: il batch riprende dal turno 1
+    store.aggiungi("c1", interazione(0))
+    store.aggiungi("c1", interazione(2))
+    store.aggiungi("c2", interazione(0))
+
+    assert store.tronca("c1", 1) == 1
+    for n in (1, 2):
+        store.aggiungi("c1", interazione(n))
+    assert [i["user_query"] for i in store.tutte("c1")] == ["domanda 0", "domanda 1", "domanda 2"]
+    assert store.conta("c1") == 3
+    assert store.tronca("c1", 3) == 0
+    assert store.conta("c2") == 1
@@ -0,0 +1,47 @@
+import numpy as np
+
+from ann import IVFIndex, query_di_prova
+from quantizzazione import QuantizedIndex, VettoriRidotti, valuta
+from similarity import SimilarityIndex
+
+
+def test_codici_int8():
+    matrice = np.array([[0.6, -0.8, 0.0], [0.0, 0.0, 1.0]], dtype=np.float32)
+    ridotti = VettoriRidotti.da_matrice(matrice, int8=True)
+    assert ridotti.codici.dtype == np.int8
+    assert np.abs(ridotti.codici).max() == 127
+    np.testing.assert_allclose(ridotti.codici * ridotti.scale[:, None], matrice, atol=0.01)
+    assert ridotti.nbytes < matrice.nbytes
+
+
+def test_stima_vicina_al_coseno(corpus):
+    ridotti = VettoriRidotti.da_matrice(corpus, int8=True)
+    q = corpus[0]
+    np.testing.assert_allclose(ridotti.stima(q), corpus @ q, atol=0.02)
+
+
+def test_rescoring_restituisce_i_punteggi_esatti(corpus):
+    esatto = SimilarityIndex(corpus, normalizzata=True)
+    for int8, dim in ((True, None), (True, 32), (False, 32)):
+        indice = QuantizedIndex(corpus, VettoriRidotti.da_matrice(corpus, dim, int8), fattore=10)
+        for q in query_di_prova(corpus, 20):
+            for i, score in indice.top_k(q, 5):
+                assert abs(score - float(corpus[i] @ q)) < 1e-5
+            # Con tutti i candidati rivalutati il risultato è quello esatto
+            completo = QuantizedIndex(corpus, indice.ridotti, fattore=len(corpus))
+            assert [i for i, _ in completo.top_k(q, 5)] == [i for i, _ in esatto.top_k(q, 5)]
+
+
+def test_richiamo_con_rescoring(corpus):
+    query = query_di_prova(corpus, 100)
+    risultato = valuta(corpus, VettoriRidotti.da_matrice(corpus, 32, int8=True), query, k=3)
+    assert risultato["richiamo"] >= 0.95
+    assert risultato["richiamo"] >= risultato["richiamo_prima_passata"]
+
+
+def test_ivf_con_vettori_ridotti(corpus):
+    indice = IVFIndex.costruisci(corpus)
+    indice.ridotti = VettoriRidotti.da_matrice(corpus, int8=True)
+    for q in query_di_prova(corpus, 10):
+        for i, score in indice.top_k(q, 3):
+            assert abs(score - float(corpus[i] @ q)) < 1e-5
@@ -0,0 +1,93 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from rate_limit import LimiteAdattivo, TokenBucket, attesa_backoff
+
+
+def test_token_bucket_picco_e_attesa():
+    bucket = TokenBucket(rate=10, capacita=2)
+    assert bucket.prova() == 0
+    assert bucket.prova() == 0
+    attesa = bucket.prova()
+    assert 0 < attesa <= 0.1
+
+
+def test_token_bucket_riserva_per_le_chiamate_interattive():
+    bucket = TokenBucket(rate=0.001, capacita=10, riserva=0.2)
+    for _ in range(8):
+        assert bucket.prova(1, priorita=1) == 0
+    # Il batch si ferma alla riserva, le chiamate interattive no
+    assert bucket.prova(1, priorita=1) > 0
+    assert bucket.prova(1, priorita=0) == 0
+    assert bucket.prova(1, priorita=0) == 0
+    assert bucket.prova(1, priorita=0) > 0
+
+
+def test_token_bucket_richiesta_grande_quanto_la_capacita():
+    bucket = TokenBucket(rate=1000, capacita=10, riserva=0.5)
+    assert bucket.prova(10, priorita=1) == 0
+
+
+def test_attesa_backoff_limitata():
+    for tentativo in range(10):
+        assert 0 <= attesa_backoff(tentativo, 0.5, 4.0) <= 4.0
+
+
+def test_limite_adattivo_aimd():
+    limite = LimiteAdattivo(iniziale=4, minimo=1, massimo=8)
+    limite.sovraccarico()
+    assert limite.limite == 2
+    # Una seconda riduzione subito dopo conta come lo stesso segnale
+    limite.sovraccarico()
+    assert limite.limite == 2 and limite.riduzioni == 1
+    for _ in range(10):
+        limite.successo(0.01)
+    assert 2 < limite.limite <= 8
+
+
+def test_limite_adattivo_serve_prima_la_priorita_piu_urgente():
+    limite = LimiteAdattivo(iniziale=1)
+    limite.acquisisci()
+    ordine = []
+
+    def richiesta(priorita, nome):
+        limite.acquisisci(priorita)
+        ordine.append(nome)
+        limite.rilascia()
+
+    batch = threading.Thread(target=richiesta, args=(1, "batch"))
+    batch.start()
+    while limite.in_attesa < 1:
+        time.sleep(0.001)
+    interattiva = threading.Thread(target=richiesta, args=(0, "interattiva"))
+    interattiva.start()
+    while limite.in_attesa < 2:
+        time.sleep(0.001)
+    limite.rilascia()
+    batch.join(5)
+    interattiva.join(5)
+    assert ordine == ["interattiva", "batch"]
+    assert limite.in_corso == 0
+
+
+def test_limite_adattivo_attesa_cancellata_non_perde_posti():
+    limite = LimiteAdattivo(iniziale=1)
+
+    async def scenario():
+        await limite.aacquisisci()
+        attesa = asyncio.create_task(limite.aacquisisci())
+        await asyncio.sleep(0.01)
+        attesa.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await attesa
+        assert limite.in_attesa == 0
+        limite.rilascia()
+        # Il posto liberato non va alla richiesta cancellata
+        await asyncio.wait_for(limite.aacquisisci(), 1)
+        limite.rilascia()
+
+    asyncio.run(scenario())
+    assert limite.in_corso == 0
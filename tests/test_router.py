@@ -0,0 +1,58 @@
+import json
+
+import numpy as np
+
+from router import PERCORSI, Caratteristiche, RegressioneLogistica, Router, addestra, leggi_log, registra_esito
+
+
+def test_log_separa_etichetta_ed_esito_della_ricerca(tmp_path):
+    path_log = str(tmp_path / "router.jsonl")
+    registra_esito("orari negozio", "faq", "FAQ", path_log=path_log)
+    registra_esito("meteo di domani", "none", path_log=path_log)
+    registra_esito("garanzia TA-1200", "kb", "Web", path_log=path_log)
+
+    record = [json.loads(riga) for riga in open(path_log, encoding="utf-8")]
+    assert record[1] == {"timestamp": record[1]["timestamp"], "domanda": "meteo di domani", "esito_ricerca": "Web"}
+    assert record[2]["esito_ricerca"] == "Knowledge Base" and record[2]["percorso"] == "Web"
+
+    esempi, senza_etichetta = leggi_log(path_log)
+    assert esempi == [("orari negozio", "FAQ"), ("garanzia TA-1200", "Web")]
+    assert senza_etichetta == ["meteo di domani"]
+
+
+def test_risparmia_ricerca_solo_con_corpus_riassunti(corpus):
+    piccolo = corpus[:100]
+    assert not Caratteristiche(piccolo, piccolo).riassunte
+    caratteristiche = Caratteristiche(corpus[:300], piccolo)
+    assert caratteristiche.riassunte
+    assert len(caratteristiche.faq) == 256
+
+
+def test_addestramento_su_etichette(corpus):
+    rng = np.random.default_rng(0)
+    faq, kb = corpus[:200], corpus[200:400]
+    vettori = {}
+    esempi = []
+    for n, (sorgente, percorso) in enumerate([(faq, "FAQ"), (kb, "Knowledge Base"), (None, "Web")] * 30):
+        if sorgente is None:
+            v = rng.standard_normal(corpus.shape[1]).astype(np.float32)
+        else:
+            v = sorgente[rng.integers(len(sorgente))] + 0.05 * rng.standard_normal(corpus.shape[1]).astype(np.float32)
+        vettori[f"domanda {n}"] = v
+        esempi.append((f"domanda {n}", percorso))
+
+    caratteristiche = Caratteristiche(faq, kb)
+    modello = addestra(esempi, caratteristiche, vettori.__getitem__)
+    router = Router(caratteristiche, modello)
+    corrette = sum(router.scegli(vettori[d])[0] == p for d, p in esempi)
+    assert corrette / len(esempi) > 0.9
+    assert not router.risparmia_ricerca
+
+
+def test_salva_e_carica_il_modello(tmp_path):
+    modello = RegressioneLogistica(np.ones((8, 3)), np.zeros(7), np.ones(7), PERCORSI)
+    path = str(tmp_path / "router.npz")
+    modello.salva(path)
+    caricato = RegressioneLogistica.carica(path)
+    assert caricato.classi == PERCORSI
+    np.testing.assert_array_equal(caricato.pesi, modello.pesi)
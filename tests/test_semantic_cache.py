@@ -0,0 +1,54 @@
+import numpy as np
+
+import semantic_cache
+from semantic_cache import SemanticCache, impronta_contesto
+
+FONTI = (3, None)
+
+
+def vettore(*valori) -> np.ndarray:
+    return np.array(valori, dtype=np.float32)
+
+
+def test_hit_per_domanda_simile():
+    cache = SemanticCache(soglia=0.9)
+    cache.salva(vettore(1, 0, 0), "Cliente", FONTI, "risposta")
+    assert cache.cerca(vettore(0.98, 0.1, 0), "Cliente", FONTI) == "risposta"
+    # Stesso testo normalizzato anche senza embedding
+    cache.salva(None, "Cliente", FONTI, "per testo", "Come resetto la password?")
+    assert cache.cerca(None, "Cliente", FONTI, "come resetto  la password?") == "per testo"
+    assert cache.stats()["hits"] == 2
+
+
+def test_miss_sotto_soglia_o_con_altre_fonti():
+    cache = SemanticCache(soglia=0.9)
+    cache.salva(vettore(1, 0, 0), "Cliente", FONTI, "risposta")
+    assert cache.cerca(vettore(0.7, 0.7, 0), "Cliente", FONTI) is None
+    assert cache.cerca(vettore(1, 0, 0), "Cliente", (4, None)) is None
+    assert cache.cerca(vettore(1, 0, 0), "Partner", FONTI) is None
+    assert cache.stats()["misses"] == 3
+
+
+def test_scadenza_ttl(monkeypatch):
+    adesso = [100.0]
+    monkeypatch.setattr(semantic_cache.time, "monotonic", lambda: adesso[0])
+    cache = SemanticCache(soglia=0.9, ttl=10)
+    cache.salva(vettore(1, 0), "Cliente", FONTI, "risposta", "domanda")
+    adesso[0] += 9
+    assert cache.cerca(vettore(1, 0), "Cliente", FONTI) == "risposta"
+    adesso[0] += 1
+    assert cache.cerca(vettore(1, 0), "Cliente", FONTI) is None
+    assert cache.cerca(None, "Cliente", FONTI, "domanda") is None
+    assert cache.stats()["dimensione"] == 0
+
+
+def test_conversazioni_con_contesto_diverso_non_condividono_risposte():
+    cache = SemanticCache(soglia=0.9)
+    storia_a = impronta_contesto("Negativo", "Utente: il router non si accende\nAssistente: ...")
+    storia_b = impronta_contesto("Neutro", "Utente: vorrei una fattura\nAssistente: ...")
+    cache.salva(vettore(1, 0), "Cliente", FONTI, "risposta per a", "e adesso?", storia_a)
+    assert cache.cerca(vettore(1, 0), "Cliente", FONTI, "e adesso?", storia_b) is None
+    assert cache.cerca(vettore(1, 0), "Cliente", FONTI, "e adesso?", storia_a) == "risposta per a"
+    # Senza turni precedenti il contesto coincide: la risposta si riusa tra conversazioni
+    assert impronta_contesto("Neutro") == impronta_contesto("Neutro")
+    assert impronta_contesto("Neutro") != impronta_contesto("Negativo")
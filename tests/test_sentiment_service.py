@@ -0,0 +1,82 @@
+import asyncio
+import threading
+
+import pytest
+
+from sentiment_service import SentimentService, mappa_etichetta
+
+
+class PipelineFinta:
+    """Pipeline che resta bloccata finché `sblocca` non viene impostato."""
+
+    def __init__(self):
+        self.sblocca = threading.Event()
+        self.iniziata = threading.Event()
+        self.testi = []
+
+    def __call__(self, testi, truncation=True):
+        self.iniziata.set()
+        self.sblocca.wait(5)
+        self.testi.extend(testi)
+        return [{"label": "4 stars", "score": 0.9} for _ in testi]
+
+
+def test_mappa_etichetta():
+    assert mappa_etichetta("1 star", 0.8) == "Molto Negativo"
+    assert mappa_etichetta("5 stars", 0.8) == "Molto Positivo"
+    assert mappa_etichetta("NEGATIVE", 0.99) == "Molto Negativo"
+    assert mappa_etichetta("POSITIVE", 0.6) == "Positivo"
+    assert mappa_etichetta("NEUTRAL", 0.6) == "Neutro"
+
+
+def test_classifica():
+    pipeline = PipelineFinta()
+    pipeline.sblocca.set()
+    servizio = SentimentService(pipeline=pipeline)
+    assert servizio.classifica("ottimo servizio") == ("Positivo", 0.9)
+
+
+def test_future_annullato_non_ferma_il_worker():
+    pipeline = PipelineFinta()
+    servizio = SentimentService(pipeline=pipeline, max_attesa=0)
+    primo = servizio.invia("primo")
+    assert pipeline.iniziata.wait(5)
+    annullato = servizio.invia("annullato")
+    assert annullato.cancel()
+    pipeline.sblocca.set()
+
+    assert primo.result(timeout=5) == ("Positivo", 0.9)
+    assert servizio.invia("dopo").result(timeout=5) == ("Positivo", 0.9)
+    assert "annullato" not in pipeline.testi
+    assert servizio._worker.is_alive()
+
+
+def test_attesa_asyncio_cancellata():
+    pipeline = PipelineFinta()
+    servizio = SentimentService(pipeline=pipeline, max_attesa=0)
+
+    async def scenario():
+        servizio.invia("occupa il worker")
+        assert await asyncio.to_thread(pipeline.iniziata.wait, 5)
+        attesa = asyncio.create_task(servizio.aclassifica("cancellato"))
+        await asyncio.sleep(0)
+        attesa.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await attesa
+        pipeline.sblocca.set()
+        return await asyncio.wait_for(servizio.aclassifica("successivo"), 5)
+
+    assert asyncio.run(scenario()) == ("Positivo", 0.9)
+    assert servizio._worker.is_alive()
+
+
+def test_errore_della_pipeline_propagato():
+    def pipeline(testi, truncation=True):
+        raise RuntimeError("modello non disponibile")
+
+    servizio = SentimentService(pipeline=pipeline)
+    with pytest.raises(RuntimeError):
+        servizio.classifica("testo")
+    with pytest.raises(RuntimeError):
+        servizio.classifica("ancora")
+    assert servizio._worker.is_alive()
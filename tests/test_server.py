@@ -0,0 +1,90 @@
+import asyncio
+import json
+
+import pytest
+
+# server importa agent, che richiede LangChain
+server = pytest.importorskip("server")
+
+
+async def chiama(app, metodo: str, path: str, body: bytes = b"") -> tuple:
+    """Esegue una richiesta ASGI e restituisce (stato, headers, corpo, pezzi del corpo)."""
+    messaggi = []
+    richiesta = [{"type": "http.request", "body": body, "more_body": False}]
+
+    async def receive():
+        return richiesta.pop(0)
+
+    async def send(messaggio):
+        messaggi.append(messaggio)
+
+    await app({"type": "http", "method": metodo, "path": path}, receive, send)
+    inizio, pezzi = messaggi[0], [m["body"] for m in messaggi[1:]]
+    assert inizio["type"] == "http.response.start" and not messaggi[-1].get("more_body")
+    return inizio["status"], dict(inizio["headers"]), b"".join(pezzi), pezzi
+
+
+@pytest.fixture
+def app(monkeypatch):
+    async def aprocess_query(domanda, user, cId):
+        if domanda == "errore":
+            raise RuntimeError("LLM non raggiungibile")
+        return f"{user}/{cId}: {domanda}"
+
+    async def aprocess_query_stream(domanda, user, cId):
+        if domanda == "errore":
+            raise RuntimeError("LLM non raggiungibile")
+        for pezzo in ("Buon", "giorno", f" {user}"):
+            yield pezzo
+
+    monkeypatch.setattr(server.agent, "avvia", lambda: None)
+    monkeypatch.setattr(server.agent, "aprocess_query", aprocess_query)
+    monkeypatch.setattr(server.agent, "aprocess_query_stream", aprocess_query_stream)
+    return server.AssistantApp()
+
+
+def corpo(domanda: str) -> bytes:
+    return json.dumps({"question": domanda, "user": "Cliente", "conversation_id": "c1"}).encode()
+
+
+def test_query(app):
+    async def scenario():
+        assert (await chiama(app, "POST", "/query", corpo("ciao")))[0] == 503
+        await app.avvio()
+        risposte = [await chiama(app, "POST", "/query", corpo(d)) for d in ("ciao", "errore")]
+        await app.chiusura()
+        return risposte
+
+    (stato, headers, testo, _), (stato_errore, _, testo_errore, _) = asyncio.run(scenario())
+    assert stato == 200 and json.loads(testo) == {"risposta": "Cliente/c1: ciao"}
+    assert headers[b"content-length"] == str(len(testo)).encode()
+    assert stato_errore == 500 and "errore" in json.loads(testo_errore)
+    assert app.in_corso == 0
+
+
+@pytest.mark.parametrize("body", [b"non json", b"[]", b'{"question": "ciao"}'])
+def test_body_non_valido(app, body):
+    async def scenario():
+        await app.avvio()
+        risposte = [await chiama(app, "POST", path, body) for path in ("/query", "/query/stream")]
+        await app.chiusura()
+        return risposte
+
+    for stato, _, testo, _ in asyncio.run(scenario()):
+        assert stato == 400 and "conversation_id" in json.loads(testo)["errore"]
+
+
+def test_query_stream(app):
+    async def scenario():
+        await app.avvio()
+        risposte = [await chiama(app, "POST", "/query/stream", corpo(d)) for d in ("ciao", "errore")]
+        await app.chiusura()
+        return risposte
+
+    (stato, headers, testo, pezzi), (stato_errore, _, _, _) = asyncio.run(scenario())
+    assert stato == 200 and headers[b"content-type"].startswith(b"text/plain")
+    assert b"content-length" not in headers
+    assert pezzi[:3] == [b"Buon", b"giorno", b" Cliente"] and testo == b"Buongiorno Cliente"
+    # Errore prima del primo pezzo: risposta 500 completa
+    assert stato_errore == 500
+    assert app.in_corso == 0
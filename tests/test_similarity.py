@@ -0,0 +1,35 @@
+import numpy as np
+
+from similarity import SimilarityIndex
+
+
+def test_top_k_ordinato_come_la_ricerca_esaustiva(corpus):
+    indice = SimilarityIndex(corpus * 3.0)
+    query = corpus[7] + 0.1 * corpus[8]
+    risultati = indice.top_k(query, k=10)
+
+    attesi = np.argsort(-(corpus @ (query / np.linalg.norm(query))))[:10]
+    assert [i for i, _ in risultati] == attesi.tolist()
+    punteggi = [p for _, p in risultati]
+    assert punteggi == sorted(punteggi, reverse=True)
+    assert risultati[0][0] == 7
+
+
+def test_top_k_casi_limite(corpus):
+    indice = SimilarityIndex(corpus[:3])
+    assert [i for i, _ in indice.top_k(corpus[1], k=10)][0] == 1
+    assert len(indice.top_k(corpus[1], k=10)) == 3
+    assert indice.top_k(corpus[1], k=0) == []
+    assert SimilarityIndex([]).top_k(corpus[1]) == []
+
+
+def test_dimensioni_diverse():
+    indice = SimilarityIndex([[1.0, 0.0, 0.0], [0.0, 1.0, 5.0]])
+    assert indice.dim == 3
+    # Query più lunga: si tronca alla dimensione dell'indice
+    assert indice.top_k([1.0, 0.0, 0.0, 9.0], k=1)[0][0] == 0
+    # Query più corta: si confrontano solo le prime componenti, rinormalizzate
+    riga, punteggio = indice.top_k([0.0, 2.0], k=1)[0]
+    assert riga == 1 and np.isclose(punteggio, 1.0)
+    # Embedding di lunghezza diversa: tutte le righe alla dimensione minima
+    assert SimilarityIndex([[3.0, 4.0, 7.0], [1.0, 0.0]]).dim == 2
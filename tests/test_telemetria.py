@@ -0,0 +1,38 @@
+import pytest
+
+import telemetria
+
+
+@pytest.fixture
+def telemetria_attiva():
+    telemetria.attiva(True)
+    telemetria.azzera()
+    yield
+    telemetria.azzera()
+    telemetria.attiva(False)
+
+
+def test_evento_conta_e_finisce_nello_span(telemetria_attiva, caplog):
+    with telemetria.span("ricerca") as s:
+        telemetria.evento("web_timeout", "Tempo scaduto per http://a", fase="pagina")
+    assert s.attributi["eventi"][0]["nome"] == "web_timeout"
+    assert s.attributi["eventi"][0]["messaggio"] == "Tempo scaduto per http://a"
+    assert 'eventi_totale{evento="web_timeout",fase="pagina"} 1' in telemetria.esporta_prometheus()
+    assert "Tempo scaduto per http://a" in caplog.text
+
+
+def test_evento_a_telemetria_spenta_resta_nel_log(caplog):
+    telemetria.attiva(False)
+    telemetria.evento("preprocessing_fallback", "Pre-processing fuso non valido")
+    assert "Pre-processing fuso non valido" in caplog.text
+
+
+def test_esportazione_prometheus(telemetria_attiva):
+    telemetria.incrementa("ricerca_fonte_totale", fonte="faq")
+    telemetria.incrementa("ricerca_fonte_totale", fonte="faq")
+    telemetria.osserva("ricerca_punteggio", 0.52, telemetria.BUCKET_PUNTEGGI, indice="faq")
+    testo = telemetria.esporta_prometheus()
+    assert 'ricerca_fonte_totale{fonte="faq"} 2' in testo
+    assert 'ricerca_punteggio_bucket{indice="faq",le="0.5"} 0' in testo
+    assert 'ricerca_punteggio_bucket{indice="faq",le="0.55"} 1' in testo
+    assert 'ricerca_punteggio_count{indice="faq"} 1' in testo
@@ -0,0 +1,53 @@
+import json
+
+from ticket_store import TicketStore
+
+
+def ticket(conversation_id: str, ruolo: str = "Cliente", sentimento: str = "Negativo",
+           scadenza: str = "2024-05-03T00:00:00") -> dict:
+    return {
+        "id": conversation_id,
+        "timestamp": "2024-05-01T10:00:00",
+        "query_originale": "il prodotto non funziona",
+        "sentiment": sentimento,
+        "ruolo_utente": ruolo,
+        "motivazione": "sentimento negativo",
+        "stato": "Aperto",
+        "data_scadenza": scadenza,
+    }
+
+
+def test_crea_cerca_e_aggiorna(tmp_path):
+    store = TicketStore(str(tmp_path / "tickets.db"), None)
+    store.crea(ticket("c1"))
+    store.crea(ticket("c2", ruolo="Partner", sentimento="Molto Negativo", scadenza="2024-05-10T00:00:00"))
+
+    assert store.per_conversazione("c1") == [ticket("c1")]
+    assert [t["id"] for t in store.in_scadenza("2024-05-05T00:00:00")] == ["c1"]
+    assert store.aggiorna_stato("c1", "Chiuso") == 1
+    assert [t["id"] for t in store.per_stato("Aperto")] == ["c2"]
+    assert store.statistiche() == {
+        "totale_ticket": 2,
+        "ticket_per_ruolo": {"Cliente": 1, "Partner": 1},
+        "ticket_per_sentimento": {"Negativo": 1, "Molto Negativo": 1},
+    }
+
+
+def test_migrazione_json(tmp_path):
+    path_legacy = tmp_path / "tickets.json"
+    path_legacy.write_text(json.dumps({
+        "aperti": [ticket("c1")],
+        "chiusi": [dict(ticket("c0"), stato="Chiuso")],
+        "statistiche": {"totale_ticket": 2, "ticket_per_ruolo": {"Cliente": 2},
+                        "ticket_per_sentimento": {"Negativo": 2}},
+    }), encoding="utf-8")
+
+    store = TicketStore(str(tmp_path / "tickets.db"), str(path_legacy))
+    assert not path_legacy.exists()
+    assert [t["id"] for t in store.per_stato("Aperto")] == ["c1"]
+    store.crea(ticket("c2"))
+    assert store.statistiche()["totale_ticket"] == 3
+    assert store.statistiche()["ticket_per_ruolo"] == {"Cliente": 3}
+
+    # Riaprire l'archivio non reimporta nulla
+    assert len(TicketStore(str(tmp_path / "tickets.db"), str(path_legacy)).per_stato("Aperto")) == 2
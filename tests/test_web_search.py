@@ -0,0 +1,96 @@
+import threading
+import time
+
+from web_search import WebSearcher, estrai_testo
+
+
+class RispostaFinta:
+    def __init__(self, corpo: bytes, encoding: str = "utf-8", pausa: float = 0.0):
+        self.corpo = corpo
+        self.encoding = encoding
+        self.pausa = pausa
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *eccezione):
+        return False
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size=16384):
+        for inizio in range(0, len(self.corpo), chunk_size):
+            time.sleep(self.pausa)
+            yield self.corpo[inizio:inizio + chunk_size]
+
+
+class SessioneFinta:
+    def __init__(self, pagine: dict):
+        self.pagine = pagine
+        self.timeout = {}
+
+    def get(self, url, timeout=None, stream=False):
+        self.timeout[url] = timeout
+        pagina = self.pagine[url]
+        if isinstance(pagina, Exception):
+            raise pagina
+        return pagina
+
+    def close(self):
+        pass
+
+
+def crea_searcher(pagine: dict, search_fn=None, **parametri) -> WebSearcher:
+    search_fn = search_fn or (lambda domanda, num: list(pagine)[:num])
+    return WebSearcher(search_fn=search_fn, session=SessioneFinta(pagine), cache_ttl=0, **parametri)
+
+
+def test_estrai_testo():
+    pagina = "<html><script>var x = 1;</script><p>Orari &amp; contatti</p><!-- nota --></html>"
+    assert estrai_testo(pagina) == "Orari & contatti"
+
+
+def test_charset_sconosciuto_usa_utf8():
+    searcher = crea_searcher({"http://a": RispostaFinta("<p>perché</p>".encode(), encoding="x-inventato")})
+    assert searcher.cerca("domanda") == [{"url": "http://a", "contenuto": "perché"}]
+
+
+def test_errore_di_una_pagina_non_blocca_le_altre():
+    pagine = {"http://rotta": ValueError("risposta non valida"), "http://ok": RispostaFinta(b"<p>ok</p>")}
+    searcher = crea_searcher(pagine)
+    assert searcher.cerca("domanda") == [{"url": "http://ok", "contenuto": "ok"}]
+
+
+def test_backend_di_ricerca_entro_la_deadline():
+    sblocca = threading.Event()
+
+    def search_fn(domanda, num):
+        sblocca.wait(5)
+        return ["http://a"]
+
+    searcher = crea_searcher({"http://a": RispostaFinta(b"a")}, search_fn=search_fn, deadline=0.2)
+    inizio = time.monotonic()
+    assert searcher.cerca("domanda") == []
+    assert time.monotonic() - inizio < 1.0
+    sblocca.set()
+    searcher.close()
+
+
+def test_download_lento_limitato_dal_tempo_residuo():
+    lenta = RispostaFinta(b"x" * 16384 * 20, pausa=0.05)
+    searcher = crea_searcher({"http://lenta": lenta, "http://veloce": RispostaFinta(b"veloce")}, deadline=0.3)
+    assert searcher.cerca("domanda") == [{"url": "http://veloce", "contenuto": "veloce"}]
+    assert searcher.session.timeout["http://lenta"] <= 0.3
+
+    # Il thread del download lento si libera poco dopo la deadline
+    inizio = time.monotonic()
+    searcher._executor.shutdown(wait=True)
+    assert time.monotonic() - inizio < 0.5
+
+
+def test_ricerca_annullata():
+    annulla = threading.Event()
+    annulla.set()
+    searcher = crea_searcher({"http://a": RispostaFinta(b"a")})
+    assert searcher.cerca("domanda", annulla) == []
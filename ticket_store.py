@@ -0,0 +1,150 @@
+import json
+import os
+import threading
+from db import SQLiteDB
+
+DEFAULT_DB = "data/tickets.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tickets (
+    pk INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    query_originale TEXT,
+    sentiment TEXT,
+    ruolo_utente TEXT,
+    motivazione TEXT,
+    stato TEXT NOT NULL,
+    data_scadenza TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_tickets_id ON tickets (id);
+CREATE INDEX IF NOT EXISTS idx_tickets_stato_scadenza ON tickets (stato, data_scadenza);
+CREATE INDEX IF NOT EXISTS idx_tickets_scadenza ON tickets (data_scadenza);
+CREATE TABLE IF NOT EXISTS statistiche (
+    chiave TEXT NOT NULL,
+    sottochiave TEXT NOT NULL DEFAULT '',
+    valore INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (chiave, sottochiave)
+);
+"""
+
+_CAMPI = ("id", "timestamp", "query_originale", "sentiment", "ruolo_utente", "motivazione", "stato", "data_scadenza")
+
+
+class TicketStore:
+    """
+    Archivio dei ticket su SQLite.
+
+    Ogni ticket è una riga e le statistiche (totale, per ruolo, per
+    sentimento) sono contatori aggiornati nella stessa transazione, quindi
+    creare un ticket non dipende dal numero di ticket esistenti e più
+    processi possono scrivere insieme senza perdere dati.
+    """
+
+    def __init__(self, path_db: str = DEFAULT_DB, path_legacy: str = "data/tickets.json"):
+        self.db = SQLiteDB(path_db, SCHEMA)
+        if path_legacy and os.path.exists(path_legacy):
+            self.migra_json(path_legacy)
+
+    def migra_json(self, path_legacy: str) -> int:
+        """
+        Importa il vecchio `tickets.json` (ticket aperti, chiusi e statistiche)
+        e lo rinomina in `.migrato`.
+
+        Returns:
+            int: Numero di ticket importati
+        """
+        try:
+            with open(path_legacy, 'r', encoding='utf-8') as f:
+                tickets = json.load(f)
+        except FileNotFoundError:
+            return 0
+        importati = tickets.get("aperti", []) + tickets.get("chiusi", [])
+        statistiche = tickets.get("statistiche", {})
+        with self.db.transazione() as conn:
+            if not os.path.exists(path_legacy):
+                return 0
+            for ticket in importati:
+                self._inserisci(conn, ticket)
+            self._incrementa(conn, "totale_ticket", "", statistiche.get("totale_ticket", 0))
+            for ruolo, n in statistiche.get("ticket_per_ruolo", {}).items():
+                self._incrementa(conn, "ticket_per_ruolo", ruolo, n)
+            for sentimento, n in statistiche.get("ticket_per_sentimento", {}).items():
+                self._incrementa(conn, "ticket_per_sentimento", sentimento, n)
+            os.replace(path_legacy, path_legacy + ".migrato")
+        return len(importati)
+
+    def _inserisci(self, conn, ticket: dict) -> None:
+        conn.execute(
+            f"INSERT INTO tickets ({', '.join(_CAMPI)}) VALUES ({', '.join('?' for _ in _CAMPI)})",
+            tuple(ticket.get(campo) for campo in _CAMPI),
+        )
+
+    def _incrementa(self, conn, chiave: str, sottochiave: str, n: int = 1) -> None:
+        conn.execute(
+            "INSERT INTO statistiche (chiave, sottochiave, valore) VALUES (?, ?, ?) "
+            "ON CONFLICT(chiave, sottochiave) DO UPDATE SET valore = valore + excluded.valore",
+            (chiave, sottochiave, n),
+        )
+
+    def crea(self, ticket: dict) -> dict:
+        """Salva un nuovo ticket e aggiorna i contatori nella stessa transazione."""
+        with self.db.transazione() as conn:
+            self._inserisci(conn, ticket)
+            self._incrementa(conn, "totale_ticket", "")
+            self._incrementa(conn, "ticket_per_ruolo", ticket["ruolo_utente"])
+            self._incrementa(conn, "ticket_per_sentimento", ticket["sentiment"])
+        return ticket
+
+    def _cerca(self, where: str, parametri: tuple) -> list:
+        righe = self.db.connessione().execute(
+            f"SELECT {', '.join(_CAMPI)} FROM tickets WHERE {where} ORDER BY pk", parametri
+        ).fetchall()
+        return [dict(riga) for riga in righe]
+
+    def per_conversazione(self, conversation_id: str) -> list:
+        """Tutti i ticket di una conversazione."""
+        return self._cerca("id = ?", (conversation_id,))
+
+    def per_stato(self, stato: str) -> list:
+        """Ticket in un certo stato (es. "Aperto")."""
+        return self._cerca("stato = ?", (stato,))
+
+    def in_scadenza(self, entro: str, stato: str = "Aperto") -> list:
+        """Ticket nello stato indicato con `data_scadenza` (ISO) non oltre `entro`."""
+        return self._cerca("stato = ? AND data_scadenza <= ?", (stato, entro))
+
+    def aggiorna_stato(self, conversation_id: str, stato: str) -> int:
+        """
+        Cambia lo stato dei ticket di una conversazione (es. "Chiuso").
+
+        Returns:
+            int: Numero di ticket aggiornati
+        """
+        with self.db.transazione() as conn:
+            return conn.execute(
+                "UPDATE tickets SET stato = ? WHERE id = ?", (stato, conversation_id)
+            ).rowcount
+
+    def statistiche(self) -> dict:
+        """Statistiche nello stesso formato del vecchio `tickets.json`."""
+        statistiche = {"totale_ticket": 0, "ticket_per_ruolo": {}, "ticket_per_sentimento": {}}
+        for riga in self.db.connessione().execute("SELECT chiave, sottochiave, valore FROM statistiche"):
+            if riga["chiave"] == "totale_ticket":
+                statistiche["totale_ticket"] = riga["valore"]
+            else:
+                statistiche.setdefault(riga["chiave"], {})[riga["sottochiave"]] = riga["valore"]
+        return statistiche
+
+
+_lock = threading.Lock()
+_ticket_store = None
+
+
+def get_ticket_store() -> TicketStore:
+    """TicketStore condiviso dal processo (percorso da TICKETS_DB)."""
+    global _ticket_store
+    with _lock:
+        if _ticket_store is None:
+            _ticket_store = TicketStore(os.getenv("TICKETS_DB", DEFAULT_DB))
+        return _ticket_store
@@ -1,113 +1,147 @@
+import os
 from typing import Dict, List
 from langchain.tools import Tool
-import requests
-from bs4 import BeautifulSoup
-from googlesearch import search
-import numpy as np
-from langchain_openai import OpenAIEmbeddings
+import telemetria
+from llm_client import embed_query
+from ann import carica_ivf
+from quantizzazione import FATTORE_RESCORING, QuantizedIndex, carica_ridotti, modalita_ridotta
+from lessicale import BM25Index, fusione_rrf, testo_record
+from similarity import SimilarityIndex
+from web_search import WebSearcher, get_web_searcher
 
-def cerca_su_internet(domanda: str) -> List[dict]:
+# Indici BM25 accanto a quelli vettoriali (LESSICALE=0 li disattiva)
+RICERCA_LESSICALE = os.getenv("LESSICALE", "1").lower() not in ("0", "false", "no")
+# Copertura lessicale oltre la quale una FAQ è identificata senza embedding
+SOGLIA_LESSICALE = float(os.getenv("LESSICALE_SOGLIA", "0.8"))
+# Copertura lessicale che basta ad accettare un candidato nella ricerca ibrida
+SOGLIA_FUSIONE = float(os.getenv("LESSICALE_SOGLIA_FUSIONE", "0.6"))
+# Risultati per lista unite dalla fusione
+PROFONDITA_FUSIONE = 10
+# Similarità minime per accettare una FAQ o un record KB
+SOGLIA_FAQ = 0.55
+SOGLIA_KB = 0.40
+
+def cerca_su_internet(domanda: str, web_searcher: WebSearcher = None, annulla=None) -> List[dict]:
     """
     Cerca informazioni su Internet e restituisce il contenuto testuale delle pagine.
+    Le pagine vengono scaricate in parallelo entro la deadline del WebSearcher;
+    `annulla` (threading.Event) interrompe una ricerca che non serve più.
     """
-    try:
-        # Esegue la ricerca su Google
-        risultati_url = list(search(domanda, num=3, stop=3, lang="it"))
-        
-        contenuti_pagine = []
-        
-        # Scarica e analizza il contenuto di ogni pagina
-        for url in risultati_url:
-            try:
-                # Invia una richiesta GET alla pagina
-                headers = {
-                    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-                }
-                risposta = requests.get(url, headers=headers, timeout=10)
-                
-                # Verifica che la richiesta sia andata a buon fine
-                risposta.raise_for_status()
-                
-                # Analizza il contenuto HTML
-                soup = BeautifulSoup(risposta.text, 'html.parser')
-                
-                # Rimuove script, style e altri tag non testuali
-                for script in soup(["script", "style"]):
-                    script.decompose()
-                
-                # Estrae il testo principale
-                testo = soup.get_text(separator=' ', strip=True)
-                
-                # Pulisce il testo (rimuove spazi extra, newline)
-                testo = ' '.join(testo.split())
-                
-                # Tronca il testo se troppo lungo (ad esempio, primi 2000 caratteri)
-                testo = testo[:2000]
-                
-                # Aggiunge il risultato alla lista
-                contenuti_pagine.append({
-                    'url': url,
-                    'contenuto': testo
-                })
-                
-            except requests.RequestException as e:
-                print(f"Errore nel recuperare {url}: {e}")
-        
+    with telemetria.span("cerca_su_internet") as s:
+        try:
+            contenuti_pagine = (web_searcher or get_web_searcher()).cerca(domanda, annulla)
+        except Exception as e:
+            telemetria.incrementa("ricerca_web_totale", esito="errore")
+            s.imposta("errore", str(e))
+            return [{"errore": f"Errore nella ricerca online: {e}"}]
+        s.imposta("pagine", len(contenuti_pagine or []))
+        if annulla is not None and annulla.is_set():
+            telemetria.incrementa("ricerca_web_totale", esito="annullata")
+            return []
+        telemetria.incrementa("ricerca_web_totale", esito="ok" if contenuti_pagine else "vuota")
         # Restituisce i risultati
         return contenuti_pagine if contenuti_pagine else [{"errore": "Nessun risultato trovato"}]
     
-    except Exception as e:
-        return [{"errore": f"Errore nella ricerca online: {e}"}]
-    
-def find_best_match(question, faq_embeddings, faq, kb_embeddings, kb, threshold=0.55):
+def _fondi(question, question_embedding, index, lex, k, soglia):
     """
-    Finds the most relevant answer by comparing the question with FAQ and KB embeddings
-    using cosine similarity. Handles different embedding formats safely.
+    Unisce con reciprocal rank fusion i risultati vettoriali e lessicali.
+    Un candidato è accettato se supera la soglia di similarità o se query e
+    testo si coprono lessicalmente almeno per SOGLIA_FUSIONE (codici prodotto,
+    nomi di modelli).
+
+    Returns:
+        tuple: (coppie (indice, similarità) accettate in ordine di fusione,
+                risultati vettoriali in ordine di similarità)
     """
-    print("Attivo ricerca interna")
-
-    # Get the question embedding
-    embeddings_model = OpenAIEmbeddings(model="text-embedding-3-large")
-    question_embedding = embeddings_model.embed_documents([question])[0]
-
-    def compute_similarity(question_embedding, embeddings_list):
-        similarities = []
-        for i, emb in enumerate(embeddings_list):
-            try:
-                q_array = np.array(question_embedding, dtype=np.float32)
-                emb_array = np.array(emb, dtype=np.float32)
-
-                # Assicurati che le dimensioni combacino
-                if len(q_array.shape) == 1:
-                    q_array = q_array.reshape(1, -1)
-                if len(emb_array.shape) == 1:
-                    emb_array = emb_array.reshape(1, -1)
-
-                min_dim = min(q_array.shape[1], emb_array.shape[1])
-                q_array = q_array[:, :min_dim]
-                emb_array = emb_array[:, :min_dim]
-
-                # Calcola la similarità
-                sim = np.dot(q_array, emb_array.T).flatten()[0] / (
-                    np.linalg.norm(q_array) * np.linalg.norm(emb_array)
-                )
-                similarities.append(float(sim))
-            except Exception as e:
-                print(f"Errore con l'elemento {i}: {e}")
-                similarities.append(-1.0)
-        return similarities
-
-    # Calcola le similarità
-    faq_similarities = compute_similarity(question_embedding, faq_embeddings)
-    kb_similarities = compute_similarity(question_embedding, kb_embeddings)
+    profondita = max(k, PROFONDITA_FUSIONE)
+    vettoriali = index.top_k(question_embedding, profondita)
+    ordine = fusione_rrf(vettoriali, lex.cerca(question, profondita))
+    accettati = []
+    for i, score in zip(ordine, index.punteggi_di(question_embedding, ordine)):
+        if score > soglia or min(lex.copertura(question, i)) >= SOGLIA_FUSIONE:
+            accettati.append((i, float(score)))
+            if len(accettati) == k:
+                break
+    return accettati, vettoriali
+
+def _kb_lessicale(question, kb_lex):
+    """Il primo record KB per BM25 se la copertura reciproca arriva a SOGLIA_FUSIONE: [(indice, copertura)]."""
+    top = kb_lex.cerca(question, 1)
+    if not top:
+        return []
+    copertura = min(kb_lex.copertura(question, top[0][0]))
+    return [(top[0][0], copertura)] if copertura >= SOGLIA_FUSIONE else []
+
+def find_best_match(question, faq_index, faq, kb_index, kb, threshold=SOGLIA_FAQ, kb_threshold=SOGLIA_KB, top_k=3,
+                    faq_lex=None, kb_lex=None, router=None):
+    """
+    Finds the most relevant answer by comparing the question with the FAQ and KB
+    similarity indexes (cosine similarity, one matrix product per index).
+    Also returns the ranked FAQ candidates above the threshold; each one says
+    whether its "punteggio" is a cosine similarity ("coseno") or a lexical
+    coverage ("copertura"), the two scales are not comparable.
+
+    With the BM25 indexes (`faq_lex`, `kb_lex`) a question that lexically
+    identifies one FAQ is answered without the embedding call ("lessicale"),
+    together with the best BM25 KB record if it covers the question enough;
+    otherwise lexical and vector results are fused ("ibrida").
+    With a `router` (see router.py) a question that is clearly for the web
+    skips the BM25 and vector search of both corpora ("router"), when the
+    router's features are cheaper than that search (large corpora only).
+    """
+    match = faq_lex.match_sicuro(question, SOGLIA_LESSICALE) if faq_lex is not None else None
+    if match is not None:
+        metodo = "lessicale"
+        # Il punteggio dei risultati lessicali è la copertura (0-1), non il coseno
+        tipo_punteggio = "copertura"
+        faq_ok = [match]
+        # Il record KB migliore per BM25 accompagna la FAQ con la stessa
+        # soglia della ricerca ibrida: i record KB lunghi non arrivano mai
+        # alla copertura di un match sicuro
+        kb_ok = _kb_lessicale(question, kb_lex) if kb_lex is not None else []
+    else:
+        metodo = "ibrida" if faq_lex is not None else "vettoriale"
+        tipo_punteggio = "coseno"
+        # Get the question embedding (shared client + cache)
+        with telemetria.span("embedding"):
+            question_embedding = embed_query(question)
+
+        # Calcola le similarità
+        if router is not None and router.risparmia_ricerca and router.solo_web(question_embedding):
+            # Domanda da web secondo il router: niente ricerca interna
+            metodo = "router"
+            faq_ok, kb_ok, faq_top, kb_top = [], [], [], []
+        else:
+            with telemetria.span("similarita", n_faq=len(faq_index), n_kb=len(kb_index)):
+                if faq_lex is not None:
+                    faq_ok, faq_top = _fondi(question, question_embedding, faq_index, faq_lex, top_k, threshold)
+                else:
+                    faq_top = faq_index.top_k(question_embedding, top_k)
+                    faq_ok = [(i, score) for i, score in faq_top if score > threshold]
+                if kb_lex is not None:
+                    kb_ok, kb_top = _fondi(question, question_embedding, kb_index, kb_lex, 1, kb_threshold)
+                else:
+                    kb_top = kb_index.top_k(question_embedding, 1)
+                    kb_ok = [(i, score) for i, score in kb_top if score > kb_threshold]
+        if faq_top:
+            telemetria.osserva("ricerca_punteggio", faq_top[0][1], telemetria.BUCKET_PUNTEGGI, indice="faq")
+        if kb_top:
+            telemetria.osserva("ricerca_punteggio", kb_top[0][1], telemetria.BUCKET_PUNTEGGI, indice="kb")
+    telemetria.incrementa("ricerca_interna_totale", metodo=metodo)
+
+    # Candidati FAQ ordinati per punteggio
+    candidati = [
+        {"indice": i, "domanda": faq[i]["domanda"], "risposta": faq[i]["risposta"], "punteggio": score,
+         "tipo_punteggio": tipo_punteggio}
+        for i, score in faq_ok
+    ]
 
     # Trova il miglior match nelle FAQ
-    best_faq_idx, best_faq_score = (np.argmax(faq_similarities), max(faq_similarities)) if faq_similarities else (-1, -1)
-    best_faq_answer = faq[best_faq_idx]["risposta"] if best_faq_score > threshold else None
+    best_faq_answer = candidati[0]["risposta"] if candidati else None
 
     # Trova il miglior match nella KB
-    best_kb_idx, best_kb_score = (np.argmax(kb_similarities), max(kb_similarities)) if kb_similarities else (-1, -1)
-    best_kb_answer = {k: v for k, v in kb[best_kb_idx].items() if k != 'vec'} if best_kb_score > 0.40 else None
+    best_kb_idx = kb_ok[0][0] if kb_ok else None
+    best_kb_answer = {k: v for k, v in kb[best_kb_idx].items() if k != 'vec'} if kb_ok else None
 
     # Costruisci la risposta combinata
     risposta = {}
@@ -116,32 +150,104 @@ def find_best_match(question, faq_embeddings, faq, kb_embeddings, kb, threshold=
     if best_kb_answer:
         risposta["kb"] = best_kb_answer
 
+    # Indici dei record scelti (usati ad esempio come chiave dalla cache delle risposte)
+    indici = {"faq": candidati[0]["indice"] if candidati else None,
+              "kb": best_kb_idx}
+
     if risposta:
         return {"source": "faq+kb" if "faq" in risposta and "kb" in risposta else ("faq" if "faq" in risposta else "kb"),
-                "content": risposta}
+                "content": risposta,
+                "candidates": candidati,
+                "indexes": indici,
+                "method": metodo}
     
-    return {"source": "none", "content": "Nessuna risposta trovata nelle FAQ o Knowledge Base."}
+    return {"source": "none", "content": "Nessuna risposta trovata nelle FAQ o Knowledge Base.", "candidates": [], "indexes": indici,
+            "method": metodo}
 
-def cerca_nelle_faq(domanda: str, faq_embeddings, faq, kb_embeddings, kb) -> Dict[str, str]:
-    """Cerca una risposta nelle FAQ utilizzando similarity search."""
-    contesto = find_best_match(domanda, faq_embeddings, faq, kb_embeddings, kb)
-    print(contesto)
+def cerca_nelle_faq(domanda: str, faq_index, faq, kb_index, kb, faq_lex=None, kb_lex=None, router=None) -> Dict[str, str]:
+    """Cerca una risposta nelle FAQ utilizzando similarity search (e BM25, se ci sono gli indici lessicali)."""
+    with telemetria.span("cerca_nelle_faq") as s:
+        contesto = find_best_match(domanda, faq_index, faq, kb_index, kb, faq_lex=faq_lex, kb_lex=kb_lex, router=router)
+        s.imposta("fonte", contesto["source"])
+        s.imposta("metodo", contesto["method"])
+        s.imposta("indici", contesto["indexes"])
+        s.imposta("punteggi", [c["punteggio"] for c in contesto["candidates"]])
+    telemetria.incrementa("ricerca_fonte_totale", fonte=contesto["source"])
     return {
         "risposta": contesto["content"],
-        "fonte": contesto["source"]
+        "fonte": contesto["source"],
+        "candidati": contesto["candidates"],
+        "indici": contesto["indexes"],
+        "ricerca": contesto["method"]
     }
 
-def create_tools(faq_embeddings, faq, kb_embeddings, kb):
-    """Crea e restituisce i tools configurati."""
-    
+def stima_ricerca(domanda: str, faq_index, kb_index, faq_lex=None, router=None) -> dict:
+    """
+    Stima veloce dell'esito della ricerca interna, senza scegliere la fonte:
+    miglior similarità con FAQ e KB e, con il router, la probabilità che la
+    domanda sia da web. Una FAQ identificata lessicalmente vale 1.
+    """
+    if faq_lex is not None and faq_lex.match_sicuro(domanda, SOGLIA_LESSICALE) is not None:
+        return {"faq": 1.0, "kb": 0.0, "web": 0.0}
+    vettore = embed_query(domanda)
+    faq_top = faq_index.top_k(vettore, 1)
+    kb_top = kb_index.top_k(vettore, 1)
+    return {
+        "faq": faq_top[0][1] if faq_top else 0.0,
+        "kb": kb_top[0][1] if kb_top else 0.0,
+        "web": router.probabilita(vettore).get("Web", 0.0) if router is not None else None,
+    }
+
+def _indice_vettoriale(embeddings, path_json, normalizzati):
+    """
+    Indice di similarità di un corpus: IVF se ingest.py l'ha costruito, con
+    la prima passata sui vettori ridotti se EMBEDDING_DIM_RIDOTTA o
+    EMBEDDING_INT8 la attivano, altrimenti ricerca esatta.
+    """
+    if not normalizzati or not path_json:
+        return SimilarityIndex(embeddings, normalizzata=normalizzati)
+    indice = carica_ivf(path_json, embeddings)
+    if modalita_ridotta():
+        ridotti = carica_ridotti(path_json, embeddings)
+        if indice is None:
+            return QuantizedIndex(embeddings, ridotti)
+        indice.ridotti, indice.fattore = ridotti, FATTORE_RESCORING
+    return indice or SimilarityIndex(embeddings, normalizzata=True)
+
+def create_tools(faq_embeddings, faq, kb_embeddings, kb, normalizzati=False, web_searcher=None, lessicale=None,
+                 faq_path=None, kb_path=None, router=None):
+    """
+    Crea e restituisce i tools configurati, più la funzione di stima
+    veloce della ricerca interna (vedi stima_ricerca).
+    Con `normalizzati=True` gli embedding (es. la matrice in memory mapping
+    scritta da ingest.py) vengono usati così come sono, senza copiarli.
+    `web_searcher` permette di sostituire backend di ricerca e client HTTP.
+    `lessicale` (default: RICERCA_LESSICALE) costruisce anche gli indici BM25.
+    Con i percorsi dei corpus (`faq_path`, `kb_path`) vengono caricati gli
+    indici IVF scritti da ingest.py, se ci sono: la ricerca vettoriale
+    diventa approssimata (vedi ann.py). `router` (vedi router.py) fa saltare
+    la ricerca interna alle domande da web, se i corpus sono abbastanza grandi
+    da renderlo conveniente.
+    """
+    # Gli indici vengono costruiti una sola volta e riusati per ogni query
+    faq_index = _indice_vettoriale(faq_embeddings, faq_path, normalizzati)
+    kb_index = _indice_vettoriale(kb_embeddings, kb_path, normalizzati)
+    if lessicale is None:
+        lessicale = RICERCA_LESSICALE
+    faq_lex = BM25Index([r["domanda"] for r in faq]) if lessicale else None
+    kb_lex = BM25Index([testo_record(r) for r in kb]) if lessicale else None
+
+    def cerca_su_internet_configured(domanda: str) -> List[dict]:
+        return cerca_su_internet(domanda, web_searcher)
+
     web_tool = Tool(
         name="Web Search",
-        func=cerca_su_internet,
+        func=cerca_su_internet_configured,
         description="Cerca informazioni su Internet quando richiesto esplicitamente o quando non si trovano risposte nelle FAQ."
     )
 
     def cerca_nelle_faq_configured(domanda: str) -> Dict[str, str]:
-        return cerca_nelle_faq(domanda, faq_embeddings, faq, kb_embeddings, kb)
+        return cerca_nelle_faq(domanda, faq_index, faq, kb_index, kb, faq_lex, kb_lex, router)
 
     faq_tool = Tool(
         name="FAQ Search",
@@ -149,4 +255,7 @@ def create_tools(faq_embeddings, faq, kb_embeddings, kb):
         description="Cerca risposte nelle FAQ e nella Knowledge Base interna."
     )
 
-    return web_tool, faq_tool
\ No newline at end of file
+    def stima_ricerca_configured(domanda: str) -> dict:
+        return stima_ricerca(domanda, faq_index, kb_index, faq_lex, router)
+
+    return web_tool, faq_tool, stima_ricerca_configured
\ No newline at end of file
@@ -0,0 +1,118 @@
+import argparse
+import importlib.util
+import json
+import os
+import time
+import numpy as np
+from embedding_store import carica_corpus
+from router import PERCORSI, ROUTER_MODELLO, Caratteristiche, RegressioneLogistica, Router
+
+# Confronto offline tra il router locale (router.py) e l'agente LLM
+# classify_query_agent di 2agent.py su domande registrate.
+# Esempio:
+#   python valuta_router.py domande.jsonl
+#   python valuta_router.py domande.jsonl --modello data/router.npz --senza-llm
+# Ogni riga del file ha `question` (o `domanda`) e l'etichetta `percorso`.
+# Le domande senza etichetta vengono contate e saltate: l'esito della
+# ricerca interna non è un'etichetta indipendente (il router lo imita).
+
+
+def carica_2agent():
+    """Importa 2agent.py (il nome non è un identificatore valido, quindi via importlib)."""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "2agent.py")
+    spec = importlib.util.spec_from_file_location("agent_2", path)
+    modulo = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(modulo)
+    return modulo
+
+
+def normalizza_percorso(risposta: str):
+    """Riporta la risposta dell'agente LLM a uno dei PERCORSI (None se non riconosciuta)."""
+    pulita = risposta.strip().strip(".'\"").lower()
+    for percorso in PERCORSI:
+        if pulita == percorso.lower():
+            return percorso
+    return None
+
+
+def leggi_domande(path: str) -> list:
+    domande = []
+    with open(path, "r", encoding="utf-8") as f:
+        for riga in f:
+            if riga.strip():
+                record = json.loads(riga)
+                domande.append((record.get("question") or record["domanda"], record.get("percorso")))
+    return domande
+
+
+def riassumi(predizioni: list, etichette: list, durate: list) -> dict:
+    confusione = {e: {p: 0 for p in PERCORSI + [None]} for e in PERCORSI}
+    for predetto, vero in zip(predizioni, etichette):
+        confusione[vero][predetto] += 1
+    return {
+        "accuratezza": sum(p == e for p, e in zip(predizioni, etichette)) / max(1, len(etichette)),
+        "ms_media": 1000 * float(np.mean(durate)) if durate else None,
+        "ms_p99": 1000 * float(np.percentile(durate, 99)) if durate else None,
+        "confusione": {vero: {str(p): n for p, n in riga.items() if n} for vero, riga in confusione.items()},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Confronta il router locale con classify_query_agent.")
+    parser.add_argument("domande", help="File JSONL con le domande da rigiocare")
+    parser.add_argument("--modello", default=None, help="Modello del router (default: ROUTER_MODELLO)")
+    parser.add_argument("--senza-llm", action="store_true", help="Valuta solo il router locale")
+    parser.add_argument("--output", help="File JSON del report")
+    args = parser.parse_args()
+
+    from llm_client import embed_query
+    _, faq_embeddings = carica_corpus("data/faq.json", "dVec")
+    _, kb_embeddings = carica_corpus("data/knowledgeBase.json", "vec")
+    router = Router(Caratteristiche(faq_embeddings, kb_embeddings),
+                    RegressioneLogistica.carica(args.modello or ROUTER_MODELLO))
+    agente_llm = None if args.senza_llm else carica_2agent()
+
+    etichette, locali, durate_locali, llm, durate_llm, saltate, saltate_errate = [], [], [], [], [], 0, 0
+    senza_etichetta = 0
+    for domanda, etichetta in leggi_domande(args.domande):
+        if etichetta not in PERCORSI:
+            senza_etichetta += 1
+            continue
+        etichette.append(etichetta)
+
+        t = time.perf_counter()
+        vettore = embed_query(domanda)
+        percorso, _ = router.scegli(vettore)
+        solo_web = router.solo_web(vettore)
+        durate_locali.append(time.perf_counter() - t)
+        locali.append(percorso)
+        if solo_web:
+            saltate += 1
+            saltate_errate += etichetta != "Web"
+
+        if agente_llm is not None:
+            t = time.perf_counter()
+            llm.append(normalizza_percorso(agente_llm.classify_query_agent(domanda)))
+            durate_llm.append(time.perf_counter() - t)
+
+    report = {
+        "domande": len(etichette),
+        "senza_etichetta": senza_etichetta,
+        "router_locale": riassumi(locali, etichette, durate_locali),
+        # Domande per cui il router farebbe saltare la ricerca interna, e quante a torto
+        "ricerca_interna_saltata": saltate,
+        "ricerca_interna_saltata_a_torto": saltate_errate,
+    }
+    if agente_llm is not None:
+        report["router_llm"] = riassumi(llm, etichette, durate_llm)
+        report["accordo"] = sum(a == b for a, b in zip(locali, llm)) / max(1, len(llm))
+
+    testo = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(testo)
+    print(testo)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+import codecs
+import html
+import os
+import re
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, List
+import requests
+from requests.adapters import HTTPAdapter
+import telemetria
+from cache_utils import LRUCache, SingleFlight, normalizza_testo
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+
+_RE_NON_TESTO = re.compile(r"<(script|style|noscript|svg|template)\b.*?</\1\s*>|<!--.*?-->", re.IGNORECASE | re.DOTALL)
+_RE_TAG = re.compile(r"<[^>]+>")
+_RE_SPAZI = re.compile(r"\s+")
+
+
+def estrai_testo(pagina_html: str, max_caratteri: int = 2000) -> str:
+    """
+    Estrae il testo visibile da una pagina HTML con espressioni regolari,
+    senza costruire l'albero del documento.
+    """
+    testo = _RE_NON_TESTO.sub(" ", pagina_html)
+    testo = _RE_TAG.sub(" ", testo)
+    testo = html.unescape(testo)
+    return _RE_SPAZI.sub(" ", testo).strip()[:max_caratteri]
+
+
+def google_search(domanda: str, num: int) -> List[str]:
+    """Backend di ricerca predefinito (googlesearch)."""
+    from googlesearch import search
+    return list(search(domanda, num=num, stop=num, lang="it"))
+
+
+def crea_sessione(pool_size: int = 10) -> requests.Session:
+    """Sessione HTTP condivisa con pool di connessioni riusabili."""
+    sessione = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    sessione.mount("http://", adapter)
+    sessione.mount("https://", adapter)
+    sessione.headers["User-Agent"] = USER_AGENT
+    return sessione
+
+
+class WebSearcher:
+    """
+    Ricerca web con download concorrente delle pagine.
+
+    Args:
+        search_fn (callable, optional): Funzione (domanda, num) -> lista di URL
+        session (requests.Session, optional): Sessione HTTP da usare
+        max_risultati (int): Numero di pagine da scaricare
+        deadline (float): Secondi massimi per l'intera ricerca, backend di
+            ricerca compreso; si restituiscono le pagine completate entro il limite
+        timeout (float): Timeout di connessione/lettura per singola pagina
+            (ridotto al tempo che resta prima della deadline)
+        max_bytes (int): Byte massimi letti da ogni pagina
+        max_caratteri (int): Caratteri di testo tenuti per pagina
+        cache_ttl (float): Secondi di validità dei risultati in cache (0 = niente cache)
+        cache_size (int): Numero massimo di ricerche e di pagine in cache
+    """
+
+    def __init__(
+        self,
+        search_fn: Callable[[str, int], List[str]] = None,
+        session: requests.Session = None,
+        max_risultati: int = 3,
+        deadline: float = 8.0,
+        timeout: float = 5.0,
+        max_bytes: int = 512 * 1024,
+        max_caratteri: int = 2000,
+        max_workers: int = 8,
+        cache_ttl: float = 300.0,
+        cache_size: int = 1024,
+    ):
+        self.search_fn = search_fn or google_search
+        self.session = session or crea_sessione(max_workers)
+        self.max_risultati = max_risultati
+        self.deadline = deadline
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self.max_caratteri = max_caratteri
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="web")
+        # Cache per query normalizzata e per URL, più accorpamento delle ricerche in corso
+        self.cache_ricerche = LRUCache(cache_size, ttl=cache_ttl) if cache_ttl else None
+        self.cache_pagine = LRUCache(cache_size, ttl=cache_ttl) if cache_ttl else None
+        self._ricerche_in_corso = SingleFlight()
+
+    def scarica_pagina(self, url: str, timeout: float = None, scadenza: float = None) -> dict:
+        """
+        Scarica una pagina fermandosi a `max_bytes` e ne estrae il testo.
+        Con `scadenza` (istante di time.monotonic) la lettura si interrompe
+        allo scadere, così una pagina lenta non tiene occupato il thread.
+        """
+        if self.cache_pagine is not None:
+            pagina = self.cache_pagine.get(url)
+            if pagina is not None:
+                return pagina
+        timeout = timeout or self.timeout
+        with self.session.get(url, timeout=timeout, stream=True) as risposta:
+            risposta.raise_for_status()
+            contenuto = bytearray()
+            for blocco in risposta.iter_content(chunk_size=16384):
+                contenuto.extend(blocco)
+                if len(contenuto) >= self.max_bytes:
+                    break
+                if scadenza is not None and time.monotonic() >= scadenza:
+                    raise requests.Timeout(f"Deadline superata leggendo {url}")
+            encoding = _codifica(risposta.encoding)
+        testo = bytes(contenuto[:self.max_bytes]).decode(encoding, errors="replace")
+        pagina = {'url': url, 'contenuto': estrai_testo(testo, self.max_caratteri)}
+        if self.cache_pagine is not None:
+            self.cache_pagine.put(url, pagina)
+        return pagina
+
+    def cerca(self, domanda: str, annulla: threading.Event = None) -> List[dict]:
+        """
+        Cerca `domanda` e scarica in parallelo le pagine dei risultati.
+        Restituisce le pagine scaricate entro la deadline, nell'ordine dei risultati.
+
+        I risultati restano in cache per `cache_ttl` secondi e le ricerche
+        identiche in corso nello stesso momento condividono un unico download.
+        Quando `annulla` viene impostato (es. ricerca speculativa che non
+        serve più) i download non ancora finiti vengono abbandonati, a meno
+        che altre chiamate non stiano aspettando la stessa ricerca.
+        """
+        if self.cache_ricerche is None:
+            return self._cerca(domanda, annulla.is_set if annulla is not None else None)
+        chiave = normalizza_testo(domanda)
+        interrotta = None
+        if annulla is not None:
+            interrotta = lambda: annulla.is_set() and not self._ricerche_in_corso.seguaci(chiave)
+        risultati = self.cache_ricerche.get(chiave)
+        if risultati is None:
+            risultati = self._ricerche_in_corso.do(chiave, lambda: self._cerca_e_salva(domanda, chiave, interrotta))
+        return [dict(pagina) for pagina in risultati]
+
+    def _cerca_e_salva(self, domanda: str, chiave: str, interrotta=None) -> List[dict]:
+        risultati = self._cerca(domanda, interrotta)
+        # Le ricerche senza risultati non vengono salvate: potrebbe essere un errore temporaneo
+        if risultati:
+            self.cache_ricerche.put(chiave, risultati)
+        return risultati
+
+    @staticmethod
+    def _aspetta(futures, scadenza: float, interrotta=None):
+        """Come `wait` fino a `scadenza`, controllando `interrotta` mentre si aspetta."""
+        if interrotta is None:
+            return wait(futures, timeout=max(0.0, scadenza - time.monotonic()))
+        in_attesa = set(futures)
+        while in_attesa and not interrotta():
+            residuo = scadenza - time.monotonic()
+            if residuo <= 0:
+                break
+            _, in_attesa = wait(in_attesa, timeout=min(residuo, 0.05), return_when=FIRST_COMPLETED)
+        return set(futures) - in_attesa, in_attesa
+
+    def _cerca(self, domanda: str, interrotta=None) -> List[dict]:
+        scadenza = time.monotonic() + self.deadline
+        # Anche il backend di ricerca sta dentro la deadline
+        ricerca = self._executor.submit(self.search_fn, domanda, self.max_risultati)
+        completati, _ = self._aspetta([ricerca], scadenza, interrotta)
+        if not completati:
+            ricerca.cancel()
+            if interrotta is None or not interrotta():
+                telemetria.evento("web_timeout", f"Tempo scaduto per la ricerca di {domanda!r}", fase="ricerca")
+            return []
+        risultati_url = ricerca.result()[:self.max_risultati]
+
+        residuo = scadenza - time.monotonic()
+        if residuo <= 0 or not risultati_url or (interrotta is not None and interrotta()):
+            return []
+        timeout = min(self.timeout, residuo)
+        futures = {self._executor.submit(self.scarica_pagina, url, timeout, scadenza): url for url in risultati_url}
+        completati, in_ritardo = self._aspetta(futures, scadenza, interrotta)
+        if in_ritardo and interrotta is not None and interrotta():
+            # Ricerca annullata: i risultati parziali non vanno né usati né messi in cache
+            for future in in_ritardo:
+                future.cancel()
+            return []
+        for future in in_ritardo:
+            future.cancel()
+            telemetria.evento("web_timeout", f"Tempo scaduto per {futures[future]}", fase="pagina")
+
+        contenuti_pagine = []
+        for future in futures:
+            if future not in completati:
+                continue
+            try:
+                contenuti_pagine.append(future.result())
+            except Exception as e:
+                telemetria.evento("web_errore_pagina", f"Errore nel recuperare {futures[future]}: {e}",
+                                  errore=type(e).__name__)
+        return contenuti_pagine
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self.session.close()
+
+
+def _codifica(encoding: str) -> str:
+    """La codifica dichiarata dalla pagina se Python la conosce, altrimenti utf-8."""
+    if encoding:
+        try:
+            return codecs.lookup(encoding).name
+        except LookupError:
+            pass
+    return "utf-8"
+
+
+_lock = threading.Lock()
+_web_searcher = None
+
+
+def get_web_searcher() -> WebSearcher:
+    """
+    WebSearcher condiviso dal processo (sessione e thread riusati).
+    WEB_DEADLINE imposta i secondi massimi per ricerca, WEB_CACHE_TTL la
+    validità dei risultati in cache.
+    """
+    global _web_searcher
+    with _lock:
+        if _web_searcher is None:
+            _web_searcher = WebSearcher(
+                deadline=float(os.getenv("WEB_DEADLINE", "8")),
+                cache_ttl=float(os.getenv("WEB_CACHE_TTL", "300")),
+            )
+        return _web_searcher